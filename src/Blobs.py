@@ -0,0 +1,194 @@
+"""
+二进制文件（图片、配音、视频、音乐）的内容寻址存储。数据库的行中只保存sha256、大小与MIME类型，
+文件内容按sha256保存在存储后端中，相同内容只保存一份，查询与筛选时不再读取文件内容。
+"""
+import hashlib
+import io
+import logging
+import mimetypes
+import os
+import shutil
+import uuid
+from abc import ABCMeta, abstractmethod
+from typing import BinaryIO, Iterator, NamedTuple
+
+logging.basicConfig(format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s-%(funcName)s',
+                    level = logging.DEBUG)
+
+# 常见文件头与对应的MIME类型，没有扩展名可以参考时使用
+SIGNATURES = [
+	(b"\xff\xd8\xff", "image/jpeg"),
+	(b"\x89PNG\r\n\x1a\n", "image/png"),
+	(b"GIF8", "image/gif"),
+	(b"ID3", "audio/mpeg"),
+	(b"\xff\xfb", "audio/mpeg"),
+	(b"fLaC", "audio/flac"),
+]
+
+
+class BlobRef(NamedTuple):
+	"""
+	行中保存的文件引用
+	"""
+	sha256: str
+	size: int
+	mime: str | None
+
+
+class BlobBackend(metaclass = ABCMeta):
+	"""
+	存储后端抽象类，按sha256读写文件内容，可以替换为对象存储等实现
+	"""
+
+	@abstractmethod
+	def exists(self, digest: str) -> bool:
+		"""
+		:param digest: sha256
+		:return: 是否已经保存
+		"""
+
+	@abstractmethod
+	def write(self, digest: str, source: BinaryIO) -> None:
+		"""
+		保存文件内容，已经存在时不做任何事
+		:param digest: 文件内容的sha256，调用者负责计算
+		:param source: 从头开始读取的文件对象
+		:return: None
+		"""
+
+	@abstractmethod
+	def open(self, digest: str) -> BinaryIO:
+		"""
+		:param digest: sha256
+		:return: 可以分块读取的只读文件对象，不存在时抛出FileNotFoundError
+		"""
+
+
+class LocalBlobBackend(BlobBackend):
+	"""
+	本地目录，文件保存为 root/sha256前两位/sha256，先写入临时文件再重命名，可以在多个进程之间共享
+	"""
+
+	def __init__(self, root: str = "../blobs/"):
+		"""
+		:param root: 存储目录
+		"""
+		self.root = root
+
+	def path(self, digest: str) -> str:
+		return os.path.join(self.root, digest[:2], digest)
+
+	def exists(self, digest: str) -> bool:
+		return os.path.exists(self.path(digest))
+
+	def write(self, digest: str, source: BinaryIO) -> None:
+		target = self.path(digest)
+		if os.path.exists(target):
+			return
+		os.makedirs(os.path.dirname(target), exist_ok = True)
+		tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+		try:
+			with open(tmp, "wb") as f:
+				shutil.copyfileobj(source, f, 1 << 20)
+			os.replace(tmp, target)
+		finally:
+			if os.path.exists(tmp):
+				os.remove(tmp)
+
+	def open(self, digest: str) -> BinaryIO:
+		return open(self.path(digest), "rb")
+
+
+class BlobStore:
+	"""
+	写入时计算sha256并交给后端保存，返回BlobRef；读取时按sha256从后端分块读取
+	"""
+
+	def __init__(self, backend: BlobBackend = None, chunk_size: int = 1 << 20):
+		"""
+		:param backend: 存储后端，为None时使用../blobs/下的LocalBlobBackend
+		:param chunk_size: 分块读写的字节数
+		"""
+		self.backend = backend if backend is not None else LocalBlobBackend()
+		self.chunk_size = chunk_size
+
+	def put_file(self, path: str, mime: str = None) -> BlobRef:
+		"""
+		保存一个文件，分块计算sha256，不把整个文件读入内存
+		:param path: 文件路径
+		:param mime: MIME类型，为None时按扩展名或文件头推断
+		:return: BlobRef
+		"""
+		h = hashlib.sha256()
+		with open(path, "rb") as f:
+			head = f.read(16)
+			h.update(head)
+			while chunk := f.read(self.chunk_size):
+				h.update(chunk)
+		digest = h.hexdigest()
+		if not self.backend.exists(digest):
+			with open(path, "rb") as f:
+				self.backend.write(digest, f)
+		return BlobRef(digest, os.path.getsize(path), mime or mimetypes.guess_type(path)[0] or sniff_mime(head))
+
+	def put_bytes(self, data: bytes, mime: str = None) -> BlobRef:
+		"""
+		保存内存中的数据
+		:param data: 文件内容
+		:param mime: MIME类型，为None时按文件头推断
+		:return: BlobRef
+		"""
+		digest = hashlib.sha256(data).hexdigest()
+		if not self.backend.exists(digest):
+			self.backend.write(digest, io.BytesIO(data))
+		return BlobRef(digest, len(data), mime or sniff_mime(data))
+
+	def open(self, digest: str) -> BinaryIO:
+		return self.backend.open(digest)
+
+	def read(self, digest: str) -> bytes:
+		with self.open(digest) as f:
+			return f.read()
+
+	def iter_chunks(self, digest: str) -> Iterator[bytes]:
+		"""
+		分块读取，用于把大文件流式地发送或写出
+		"""
+		with self.open(digest) as f:
+			while chunk := f.read(self.chunk_size):
+				yield chunk
+
+	def copy_to(self, digest: str, path: str) -> str:
+		"""
+		将文件内容写出到path，先写入临时文件再重命名
+		:return: path
+		"""
+		tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+		try:
+			with self.open(digest) as source, open(tmp, "wb") as target:
+				shutil.copyfileobj(source, target, self.chunk_size)
+			os.replace(tmp, path)
+		finally:
+			if os.path.exists(tmp):
+				os.remove(tmp)
+		return path
+
+
+def sniff_mime(head: bytes) -> str | None:
+	"""
+	由文件头推断MIME类型
+	:param head: 文件开头的若干字节
+	:return: MIME类型，无法识别时返回None
+	"""
+	for signature, mime in SIGNATURES:
+		if head.startswith(signature):
+			return mime
+	if head[:4] == b"RIFF" and head[8:12] in (b"WAVE", b"WEBP"):
+		return "audio/wav" if head[8:12] == b"WAVE" else "image/webp"
+	if head[4:8] == b"ftyp":
+		return "video/mp4"
+	return None
+
+
+# 进程内共用的实例
+store = BlobStore()
@@ -0,0 +1,242 @@
+"""
+内容寻址的素材缓存，用于缓存生成的脚本、配音、图片与渲染结果
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Callable
+
+logging.basicConfig(format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s-%(funcName)s',
+                    level = logging.DEBUG)
+
+
+def digest_file(path: str, chunk_size: int = 1 << 20) -> str:
+	"""
+	计算文件内容的sha256，用于把文件作为缓存键的一部分
+	:param path: 文件路径
+	:param chunk_size: 每次读取的字节数
+	:return: 十六进制的sha256
+	"""
+	h = hashlib.sha256()
+	with open(path, "rb") as f:
+		while chunk := f.read(chunk_size):
+			h.update(chunk)
+	return h.hexdigest()
+
+
+class ArtifactCache:
+	"""
+	内容寻址的素材缓存。缓存键是(种类, 服务商, 模型, 参数, 输入)的哈希，每个缓存项是一个目录，包含若干输出文件和meta.json。
+	缓存项先写入临时目录再重命名，meta.json的修改时间记录最近一次使用时间，总大小超过上限时按最近最少使用淘汰。
+	缓存不在内存中保存索引，因此可以在多个线程和进程（例如渲染进程池）之间共享同一个目录。
+	"""
+
+	META = "meta.json"
+
+	def __init__(self, root: str = "../cache/", max_bytes: int = 5 * 1024 ** 3):
+		"""
+		:param root: 缓存目录
+		:param max_bytes: 缓存总大小上限，单位字节
+		"""
+		self.root = root
+		self.max_bytes = max_bytes
+		# 按种类统计的命中、未命中次数
+		self.counters: dict[str, dict[str, int]] = { }
+		self.evictions = 0
+		self._lock = threading.Lock()
+		os.makedirs(self.root, exist_ok = True)
+
+	def __getstate__(self):
+		# 进程池需要pickle缓存对象，锁不能被pickle
+		state = self.__dict__.copy()
+		del state["_lock"]
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self._lock = threading.Lock()
+
+	@staticmethod
+	def key(kind: str, **parts) -> str:
+		"""
+		计算缓存键
+		:param kind: 素材种类，例如script、tts、background、render
+		:param parts: 参与计算的各个部分，例如服务商签名、参数、输入文本、输入文件的digest_file
+		:return: 十六进制的sha256
+		"""
+		payload = json.dumps({ "kind": kind, **parts }, sort_keys = True, ensure_ascii = False, default = str)
+		return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+	def entry_path(self, key: str) -> str:
+		return os.path.join(self.root, key[:2], key)
+
+	def restore(self, kind: str, key: str, outputs: dict[str, str]) -> bool:
+		"""
+		如果缓存命中，将缓存项中的文件复制到outputs指定的路径
+		:param kind: 素材种类，用于统计
+		:param key: 缓存键
+		:param outputs: 输出名称到目标路径的映射
+		:return: 是否命中
+		"""
+		entry = self.entry_path(key)
+		try:
+			with open(os.path.join(entry, self.META), "r", encoding = "utf-8") as f:
+				meta = json.load(f)
+			if set(meta["files"]) != set(outputs):
+				raise KeyError(f"outputs mismatch: {sorted(meta['files'])} != {sorted(outputs)}")
+			for name, path in outputs.items():
+				tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+				shutil.copyfile(os.path.join(entry, meta["files"][name]), tmp)
+				os.replace(tmp, path)
+			# 更新最近使用时间
+			os.utime(os.path.join(entry, self.META))
+		except (OSError, ValueError, KeyError) as e:
+			if not isinstance(e, FileNotFoundError):
+				logging.warning(f"[ArtifactCache] Failed to restore {kind} {key[:12]}: {e!r}")
+			self._count(kind, "misses")
+			return False
+		self._count(kind, "hits")
+		logging.debug(f"[ArtifactCache] Hit {kind} {key[:12]} -> {outputs}")
+		return True
+
+	def store(self, kind: str, key: str, outputs: dict[str, str]) -> None:
+		"""
+		将outputs中的文件存入缓存，然后按最近最少使用淘汰超出上限的缓存项
+		:param kind: 素材种类
+		:param key: 缓存键
+		:param outputs: 输出名称到文件路径的映射
+		:return: None
+		"""
+		entry = self.entry_path(key)
+		if os.path.exists(entry):
+			return
+		tmp = os.path.join(self.root, f"tmp-{uuid.uuid4().hex}")
+		os.makedirs(tmp)
+		try:
+			files = { }
+			size = 0
+			for name, path in outputs.items():
+				files[name] = name + os.path.splitext(path)[1]
+				shutil.copyfile(path, os.path.join(tmp, files[name]))
+				size += os.path.getsize(path)
+			with open(os.path.join(tmp, self.META), "w", encoding = "utf-8") as f:
+				json.dump({ "kind": kind, "files": files, "size": size, "created_at": time.time() }, f)
+			os.makedirs(os.path.dirname(entry), exist_ok = True)
+			os.rename(tmp, entry)
+		except OSError as e:
+			# 其他进程可能已经存入了同一个缓存项
+			logging.debug(f"[ArtifactCache] Skip storing {kind} {key[:12]}: {e!r}")
+			shutil.rmtree(tmp, ignore_errors = True)
+			return
+		logging.debug(f"[ArtifactCache] Stored {kind} {key[:12]}, {size} bytes")
+		self.evict()
+
+	def fetch(self, kind: str, key: str, outputs: dict[str, str], produce: Callable[[], object]) -> bool:
+		"""
+		缓存命中则直接复制到outputs，否则调用produce生成outputs中的所有文件，再存入缓存
+		:param kind: 素材种类
+		:param key: 缓存键
+		:param outputs: 输出名称到目标路径的映射
+		:param produce: 生成outputs的函数
+		:return: 是否命中
+		"""
+		if self.restore(kind, key, outputs):
+			return True
+		produce()
+		self.store(kind, key, outputs)
+		return False
+
+	def entries(self) -> list[tuple[float, int, str]]:
+		"""
+		扫描所有缓存项
+		:return: (最近使用时间, 大小, 目录)的列表
+		"""
+		result = []
+		for prefix in os.scandir(self.root):
+			if not prefix.is_dir() or prefix.name.startswith("tmp-"):
+				continue
+			for entry in os.scandir(prefix.path):
+				meta_path = os.path.join(entry.path, self.META)
+				try:
+					with open(meta_path, "r", encoding = "utf-8") as f:
+						size = json.load(f)["size"]
+					result.append((os.path.getmtime(meta_path), size, entry.path))
+				except (OSError, ValueError, KeyError):
+					continue
+		return result
+
+	def evict(self) -> None:
+		"""
+		总大小超过上限时，按最近最少使用的顺序删除缓存项
+		:return: None
+		"""
+		entries = self.entries()
+		total = sum(size for _, size, _ in entries)
+		for _, size, path in sorted(entries):
+			if total <= self.max_bytes:
+				break
+			shutil.rmtree(path, ignore_errors = True)
+			total -= size
+			with self._lock:
+				self.evictions += 1
+			logging.debug(f"[ArtifactCache] Evicted {path}, {size} bytes")
+
+	def _count(self, kind: str, field: str) -> None:
+		with self._lock:
+			counter = self.counters.setdefault(kind, { "hits": 0, "misses": 0 })
+			counter[field] += 1
+
+	def stats(self) -> dict:
+		"""
+		本进程内的命中统计以及缓存目录的占用情况
+		:return: 统计信息
+		"""
+		with self._lock:
+			counters = { kind: dict(counter) for kind, counter in self.counters.items() }
+		hits = sum(counter["hits"] for counter in counters.values())
+		misses = sum(counter["misses"] for counter in counters.values())
+		entries = self.entries()
+		return {
+			"hits"     : hits,
+			"misses"   : misses,
+			"hit_rate" : hits / (hits + misses) if hits + misses else 0.0,
+			"by_kind"  : counters,
+			"evictions": self.evictions,
+			"entries"  : len(entries),
+			"bytes"    : sum(size for _, size, _ in entries),
+		}
+
+
+class ArtifactManifest:
+	"""
+	记录一期视频的每个素材是由哪个缓存键生成的，保存在素材目录下的artifacts.json中。
+	当输入（脚本、参数、服务商）变化导致缓存键变化时，已有的素材文件会被视为过期。
+	"""
+
+	def __init__(self, path: str):
+		"""
+		:param path: artifacts.json的路径
+		"""
+		self.path = path
+		self._lock = threading.Lock()
+		self.keys: dict[str, str] = { }
+		if os.path.exists(path):
+			with open(path, "r", encoding = "utf-8") as f:
+				self.keys = json.load(f)
+
+	def get(self, name: str) -> str | None:
+		with self._lock:
+			return self.keys.get(name)
+
+	def set(self, name: str, key: str) -> None:
+		with self._lock:
+			self.keys[name] = key
+			tmp = self.path + ".tmp"
+			with open(tmp, "w", encoding = "utf-8") as f:
+				json.dump(self.keys, f, indent = 4)
+			os.replace(tmp, self.path)
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import logging
 import time
@@ -5,10 +6,13 @@ from abc import abstractmethod, ABCMeta
 from http import HTTPStatus
 
 import dashscope
-import requests
 from dashscope.api_entities.dashscope_response import Role
 
+import Sessions
 import config
+from Limiters import RateLimiter
+from Sessions import HttpClient
+from Tokens import fetch_baidu_token, tokens
 
 logging.basicConfig(format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s-%(funcName)s',
                     level = logging.DEBUG)
@@ -19,6 +23,10 @@ class ChatAI(metaclass = ABCMeta):
 	对话大模型AI抽象类，定义了对话大模型AI的接口
 	"""
 	prompt = ""
+	# 发送HTTP请求使用的连接池，可以替换为单独配置的HttpClient
+	http_client: HttpClient = Sessions.client
+	# 同一服务商的所有实例共用的并发与速率限制，子类按服务商的配额覆盖
+	limiter: RateLimiter = RateLimiter("ChatAI", concurrency = 4)
 
 	@abstractmethod
 	def ask_once(self, question) -> str:
@@ -28,6 +36,34 @@ class ChatAI(metaclass = ABCMeta):
 		:return: 回答
 		"""
 
+	def ask_limited(self, question) -> str:
+		"""
+		经过limiter的并发与速率限制后调用ask_once，多个线程同时提问时使用
+		:param question: 问题
+		:return: 回答
+		"""
+		with self.limiter:
+			return self.ask_once(question)
+
+	async def ask_once_async(self, question) -> str:
+		"""
+		异步的ask_once。服务商的SDK与HTTP连接池都是阻塞的，请求在线程中执行，同样经过limiter的限制
+		:param question: 问题
+		:return: 回答
+		"""
+		return await asyncio.to_thread(self.ask_limited, question)
+
+	async def ask_many(self, questions: list[str], return_exceptions: bool = False) -> list:
+		"""
+		并发提问，例如同时为多条新闻生成脚本、描述或分类，实际同时进行的请求数与速率由limiter限制。
+		不在事件循环中时使用asyncio.run(chat_ai.ask_many(questions))
+		:param questions: 问题列表
+		:param return_exceptions: 为True时失败的问题以异常对象代替回答，不影响其他问题
+		:return: 与问题一一对应的回答
+		"""
+		return list(await asyncio.gather(*(self.ask_once_async(question) for question in questions),
+		                                 return_exceptions = return_exceptions))
+
 	@abstractmethod
 	def conversation(self, question: str) -> str:
 		"""
@@ -42,6 +78,13 @@ class ChatAI(metaclass = ABCMeta):
 		:return: None
 		"""
 
+	def cache_signature(self) -> dict:
+		"""
+		返回决定ask_once回答内容的服务商、模型、参数与prompt，用于计算素材缓存的键
+		:return: dict
+		"""
+		return { "provider": type(self).__name__, "prompt": self.prompt }
+
 
 class ErnieBot(ChatAI):
 	"""
@@ -50,6 +93,7 @@ class ErnieBot(ChatAI):
 
 	API_KEY = config.LLM_Ernie_API_KEY
 	SECRET_KEY = config.LLM_Ernie_SECRET_KEY
+	limiter = RateLimiter("ErnieBot", concurrency = 2, rate = 1.0)
 	# 用于对话的消息列表
 	messages: list = []
 	prompt: str = ""
@@ -82,11 +126,15 @@ class ErnieBot(ChatAI):
 			'Content-Type': 'application/json'
 		}
 
-		response = requests.request("POST", url, headers = headers, data = payload)
+		response = self.http_client.request("POST", url, headers = headers, data = payload)
 		while "error_code" in response.json():
 			logging.warning("[ErnieBot] Error at parsing response: " + str(response.json()) + ", retrying...")
+			# 110、111：Access Token失效或过期，丢弃缓存的token后重新获取
+			if response.json()["error_code"] in (110, 111):
+				tokens.invalidate("baidu", self.API_KEY)
+				url = "https://aip.baidubce.com/rpc/2.0/ai_custom/v1/wenxinworkshop/chat/completions_pro?access_token=" + self.get_access_token()
 			time.sleep(3)
-			response = requests.request("POST", url, headers = headers, data = payload)
+			response = self.http_client.request("POST", url, headers = headers, data = payload)
 		return response.json()
 
 	def parse_response(self, response) -> str:
@@ -121,34 +169,46 @@ class ErnieBot(ChatAI):
 
 	def get_access_token(self):
 		"""
-		使用 AK，SK 生成鉴权签名（Access Token）
-		:return: access_token，或是None(如果错误)
+		使用 AK，SK 生成鉴权签名（Access Token），在过期前由TokenManager缓存
+		:return: access_token
 		"""
-		url = "https://aip.baidubce.com/oauth/2.0/token"
-		params = { "grant_type": "client_credentials", "client_id": self.API_KEY, "client_secret": self.SECRET_KEY }
-		return str(requests.post(url, params = params).json().get("access_token"))
+		return tokens.get("baidu", self.API_KEY,
+		                  lambda: fetch_baidu_token(self.API_KEY, self.SECRET_KEY, self.http_client))
 
 
 class Qwen(ChatAI):
 	"""
 	对话大模型AI，Qwen的对话大模型AI。
 	"""
+	limiter = RateLimiter("Qwen", concurrency = 4, rate = 2.0, burst = 2)
 
 	def __init__(self, prompt="你好，你需要回答我的问题。"):
-		dashscope.api_key = config.LLM_DASHSCOPE_API_KEY
+		# 不写全局的dashscope.api_key，每次调用时传入
+		self.api_key = config.LLM_DASHSCOPE_API_KEY
 		self.prompt = prompt
 		self.messages = []
+		# ask_once使用的模型与参数
+		self.model = 'qwen-max'
+		self.top_p = 0.5
+		self.temperature = 1
+		self.seed = 9879
+		self.max_length = 1500
+
+	def cache_signature(self) -> dict:
+		return { **super().cache_signature(), "model": self.model, "top_p": self.top_p,
+		         "temperature": self.temperature, "seed": self.seed, "max_length": self.max_length }
 
 	def ask_once(self, question) -> str:
 		response = dashscope.Generation.call(
-				model = 'qwen-max',
+				model = self.model,
+				api_key = self.api_key,
 				prompt = self.prompt + question,
 				enable_search = True,
-				top_p = 0.5,
-				temperature = 1,
+				top_p = self.top_p,
+				temperature = self.temperature,
 				result_format = 'message',
-				seed = 9879,
-				max_length = 1500
+				seed = self.seed,
+				max_length = self.max_length
 		)
 		if response.status_code == HTTPStatus.OK:
 			print(response.output.choices[0].message.content)
@@ -178,6 +238,7 @@ class Qwen(ChatAI):
 			                       'content': question })
 		response = dashscope.Generation.call(
 				model = dashscope.Generation.Models.qwen_plus,
+				api_key = self.api_key,
 				messages = str(self.messages),
 				enable_search = True,
 				top_p = 0.5,
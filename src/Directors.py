@@ -1,14 +1,18 @@
+import functools
 import logging
 import os
 import random
 import time
 from abc import abstractmethod, ABCMeta
 
+import Caches
 import ChatAIs
 import DrawAIs
 import MovieEditors
+import Pipelines
 import Spiders
 import TTSAIs
+import Timings
 import Uploaders
 import artUtils
 import utils
@@ -67,7 +71,9 @@ class NewsDirector(Director):
 	             draw_ai: DrawAIs.DrawAI = DrawAIs.WanXiangDrawAI(),
 	             editor: MovieEditor = MovieEditors.MovieEditor(),
 	             uploader: Uploaders.Uploader = Uploaders.DouyinNewsUploader(),
-	             bgm_path: str = None
+	             bgm_path: str = None,
+	             news: dict = None,
+	             cache: Caches.ArtifactCache = None
 	             ):
 		"""
 		初始化新闻播报导演类，用于生成新闻播报视频。
@@ -75,8 +81,13 @@ class NewsDirector(Director):
 		:param chat_ai: 对话AI，用于生成脚本和视频描述
 		:param tts_ai: 文字转语音AI，用于生成TTS配音
 		:param draw_ai: 绘画AI，用于生成背景图片
-		:param editor: 视频编辑器，目前只有movieEditor.MovieEditor，使用的moviepy库
+		:param editor: 视频编辑器，MovieEditors.MovieEditor使用moviepy逐帧合成，
+		               FFMpegMovieEditor.FFMpegMovieEditor完全在ffmpeg滤镜图中渲染
 		:param uploader: 上传器，使用爬虫上传
+		:param bgm_path: 背景音乐路径
+		:param news: 指定要播报的新闻，包含title和content，例如Spiders.ZhihuHotSpider.get_news_list的一项；
+		             为None时爬取当天热点并随机选择一条
+		:param cache: 素材缓存，为None时使用默认目录../cache/
 		"""
 
 		logging.debug("[NewsDirector] __init__")
@@ -89,8 +100,11 @@ class NewsDirector(Director):
 		self.uploader = uploader
 		self.script = None
 		self.description = None
+		self.news = news
 		self.news_str = None
 		self.title = None
+		# 上一次获取素材时每个步骤的耗时，单位秒
+		self.step_timings: dict[str, float] = { }
 		# 日期路径
 		if date_path is None:
 			self.date_path = utils.get_today_dir()
@@ -114,61 +128,142 @@ class NewsDirector(Director):
 		self.output_path = self.date_path + "/output/output.mp4"
 		# 视频描述路径
 		self.description_path = self.date_path + "/input/description.json"
+		# 背景图片的prompt
+		self.background_prompt = "新闻播报 AI 信息 背景 麦克风"
+		# 素材缓存，以及记录每个素材由哪个缓存键生成的清单
+		self.cache = cache if cache is not None else Caches.ArtifactCache()
+		self.manifest = Caches.ArtifactManifest(self.date_path + "/input/artifacts.json")
 		logging.debug("[NewsDirector] __init__" + str(self.__dict__))
 
 	def fetch_video_material(self) -> None:
 		"""
 		获取视频素材，其中包括图片、视频、TTS配音、字幕、期号，没有则现场生成，有则直接使用。
+		各个素材按照依赖关系并发获取：背景图片不依赖脚本，视频描述不依赖TTS配音。
 		:return: None
 		"""
 		logging.debug("[NewsDirector] fetch_video_material")
+		self.step_timings = self.build_material_graph().run()
+		logging.info("[NewsDirector] Artifact cache stats: " + str(self.cache.stats()))
 
-		# 生成脚本，如果没有的话
-		if not os.path.exists(self.script_path):
+	def build_material_graph(self, graph: Pipelines.StepGraph = None) -> Pipelines.StepGraph:
+		"""
+		构造获取素材的步骤依赖图，每个步骤都标注了所属阶段，以便批量生产时按阶段限制并发
+		:param graph: 在这个依赖图上添加步骤，为None时新建一个
+		:return: 步骤依赖图
+		"""
+		if graph is None:
+			graph = Pipelines.StepGraph("NewsDirector")
+		graph.add("script", self.fetch_script, stage = "llm")
+		graph.add("tts", self.fetch_tts, depends = ["script"], stage = "tts")
+		graph.add("description", self.fetch_description, depends = ["script"], stage = "llm")
+		graph.add("background", self.fetch_background, stage = "draw")
+		graph.add("blured_background", self.fetch_blured_background, depends = ["background"])
+		return graph
+
+	def build_production_graph(self, fps=30, upload: bool = True) -> Pipelines.StepGraph:
+		"""
+		构造一期视频从获取素材到渲染、上传的完整步骤依赖图
+		:param fps: 渲染帧率
+		:param upload: 是否上传
+		:return: 步骤依赖图
+		"""
+		episode = os.path.basename(self.date_path.rstrip("/"))
+		graph = self.build_material_graph(Pipelines.StepGraph(f"NewsDirector-{episode}"))
+		graph.add("render", self.render_job(fps), depends = ["tts", "blured_background"], stage = "render")
+		if upload:
+			graph.add("upload", self.upload_video, depends = ["render", "description"], stage = "upload")
+		return graph
+
+	def fetch_artifact(self, name: str, key: str, outputs: dict[str, str], produce) -> None:
+		"""
+		按缓存键获取素材。已有的素材文件如果由同一个缓存键生成（或是没有记录的旧素材）则直接使用；
+		否则说明输入已经变化，从缓存中复制，缓存未命中时调用produce重新生成。
+		:param name: 素材名称，同时作为缓存的种类
+		:param key: 由服务商、参数与输入计算出的缓存键
+		:param outputs: 输出名称到素材路径的映射
+		:param produce: 生成素材的函数
+		:return: None
+		"""
+		recorded = self.manifest.get(name)
+		if all(os.path.exists(path) for path in outputs.values()) and recorded in (None, key):
+			logging.debug(f"[NewsDirector] fetch_video_material: {name} found, reading...")
+			if recorded is None:
+				self.manifest.set(name, key)
+			return
+		logging.debug(f"[NewsDirector] fetch_video_material: {name} not found or outdated, fetching...")
+		self.cache.fetch(name, key, outputs, produce)
+		self.manifest.set(name, key)
+
+	def fetch_script(self) -> None:
+		"""
+		获取脚本，没有则生成。指定了新闻时，同一条新闻、同样的对话AI生成的脚本会被缓存。
+		:return: None
+		"""
+		if self.news is not None:
+			key = self.cache.key("script", chat = self.chat_ai.cache_signature(),
+			                     news = self.news["title"] + self.news["content"])
+			self.fetch_artifact("script", key, { "script": self.script_path }, self.generate_script_today)
+			self.script = utils.read_script(self.script_path)
+		elif not os.path.exists(self.script_path):
 			logging.debug("[NewsDirector] fetch_video_material: script not found, generating...")
 			self.script = self.generate_script_today()
 		else:
 			logging.debug("[NewsDirector] fetch_video_material: script found, reading...")
 			self.script = utils.read_script(self.script_path)
 
-		# 生成TTS配音
-		if not os.path.exists(self.tts_path):
-			logging.debug("[NewsDirector] fetch_video_material: tts not found, generating...")
-			self.generate_tts_mp3(self.script)
-		else:
-			logging.debug("[NewsDirector] fetch_video_material: tts found, reading...")
-
-		# 生成背景图片
-		if not os.path.exists(self.raw_bg_path):
-			logging.debug("[NewsDirector] fetch_video_material: background not found, generating...")
-			self.generate_background_today()
-		else:
-			logging.debug("[NewsDirector] fetch_video_material: background found, reading...")
+	def fetch_tts(self) -> None:
+		"""
+		获取TTS配音与字幕，脚本或TTS参数变化时重新生成
+		:return: None
+		"""
+		key = self.cache.key("tts", tts = self.tts_ai.cache_signature(), text = self.script)
+		outputs = { "audio": self.tts_path, "subtitle": self.subtitle_path }
+		if self.tts_ai.word_timings:
+			# 字级时间戳与字幕一起缓存，改变字幕的显示方式时不需要重新合成
+			outputs["words"] = Timings.words_path(self.subtitle_path)
+		self.fetch_artifact("tts", key, outputs, lambda: self.generate_tts_mp3(self.script))
+
+	def fetch_background(self) -> None:
+		"""
+		获取背景图片，prompt或绘画AI变化时重新生成
+		:return: None
+		"""
+		key = self.cache.key("background", draw = self.draw_ai.cache_signature(), prompt = self.background_prompt)
+		self.fetch_artifact("background", key, { "image": self.raw_bg_path }, self.generate_background_today)
 
-		# 生成模糊背景图片
-		if not os.path.exists(self.blured_bg_path):
-			logging.debug("[NewsDirector] fetch_video_material: blured background not found, generating...")
-			artUtils.blur_resize(self.raw_bg_path, self.blured_bg_path)
-		else:
-			logging.debug("[NewsDirector] fetch_video_material: blured background found, reading...")
+	def fetch_blured_background(self) -> None:
+		"""
+		获取模糊背景图片，背景图片变化时重新生成
+		:return: None
+		"""
+		key = self.cache.key("blured_background", blur = "artUtils.blur_resize",
+		                     background = Caches.digest_file(self.raw_bg_path))
+		self.fetch_artifact("blured_background", key, { "image": self.blured_bg_path },
+		                    lambda: artUtils.blur_resize(self.raw_bg_path, self.blured_bg_path))
 
-		# 生成视频描述
-		if not os.path.exists(self.description_path):
-			self.generate_description()
-			logging.debug("[NewsDirector] fetch_video_material: description not found, generating...")
-		else:
-			self.description = utils.read_description(self.description_path)
-			logging.debug("[NewsDirector] fetch_video_material: description found, reading...")
+	def fetch_description(self) -> None:
+		"""
+		获取视频描述，脚本变化时重新生成
+		:return: None
+		"""
+		key = self.cache.key("description", chat = self.chat_ai.cache_signature(),
+		                     uploader = type(self.uploader).__name__, script = self.script)
+		self.fetch_artifact("description", key, { "description": self.description_path }, self.generate_description)
+		self.description = utils.read_description(self.description_path)
 
 	def generate_script_today(self) -> str:
 		"""
-		爬取今天的热点，通过和大模型API交互生成《AI评论》的文稿并返回
+		爬取今天的热点，通过和大模型API交互生成《AI评论》的文稿并返回。如果初始化时指定了news，则直接使用该新闻。
 		:return: 生成的新闻播音稿
 		"""
-		news = Spiders.WeiBo(
-				"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 Safari/537.36",
-				"_zap=2dcd386f-35ef-49b5-9a63-240b320b7295; d_c0=ACAYje8nKBaPTm7hDMFV1rUKWk99Qnz4yik=|1673431945; YD00517437729195%3AWM_TID=4XvSXI3sz8RBVEFUVBbFaZFeQMrN45Ch; __snaker__id=2YUVyUjuyjKNhphF; YD00517437729195%3AWM_NI=kOuUDgVtNcEnT9Dc808Rj11gWKBsOWecfQyYI1NHCec2%2FKRbUxbNE8KxKezYmikZJydCOKcsI%2B4MWFClB5sOpFlDx3a16PMC6g6W9%2FVKj6QVAnE%2BHTrhLDj8D87a9a1nSG8%3D; YD00517437729195%3AWM_NIKE=9ca17ae2e6ffcda170e2e6ee8fae49a2ebe185e47a9abc8ea7d14f828e9e86c548a2a79faaea73b5899e8fc42af0fea7c3b92aa991bbb6c76d96ac8284c86698e78c84bb3cfc8ea6d2b46d95958e94ce5da7bdaab2fc538bef82a9c26fa1eee1acd16a97a8aeafc83489a88586f953afb7a5bbc973a89d81ace2798bf5fcaed64e81b48ed6f245b49aa4a5fb39a3effab1d049f6b9fab8bc259695a6d7d45e83b28bcccb60b2b884a5e93488e8f982bc6bf3b29da8bb37e2a3; q_c1=46ae590826624150bc0c04f866ca348a|1678936637000|1678936637000; z_c0=2|1:0|10:1699939230|4:z_c0|80:MS4xUmE2RkNBQUFBQUFtQUFBQVlBSlZUUUtzTldiUXd1ZzN3VTJxMGgwVWdFUmpVeVdwS2pLN09RPT0=|6667fdde5e996d9294a22c1ab0fc13ab54ce6f26fa898705d038d79c1dab18f6; tst=h; _xsrf=296cef34-d81d-494b-acbf-17e9f048a554; Hm_lvt_98beee57fd2ef70ccdd5ca52b9740c49=1699688361,1699836450,1699938459,1700052688; SESSIONID=cV7o1YemROdq41wgEq8pDgKoGGdAdz3RjbTCcyGRHdX; JOID=VF8WBU-bIILX6tUpUJtzELEEAEpD-XKwutmNSDjLbuKj3OZfM0-f0bLp0ChXtsAVXly1a11xoPfHDx52pX2yu88=; osd=Ul0cBU-dIojX6tMrWptzFrMOAEpF-3iwut-PQjjLaOCp3OZZMUWf0bTr2ihXsMIfXlyzaVdxoPHFBR52o3-4u88=; Hm_lpvt_98beee57fd2ef70ccdd5ca52b9740c49=1700052726; KLBRSID=76ae5fb4fba0f519d97e594f1cef9fab|1700052728|1700052685",
-				"https://www.zhihu.com/hot").Crawl()
+		if self.news is not None:
+			# 指定了新闻，则只播报这一条
+			news = [self.news]
+		else:
+			news = Spiders.WeiBo(
+					"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 Safari/537.36",
+					"_zap=2dcd386f-35ef-49b5-9a63-240b320b7295; d_c0=ACAYje8nKBaPTm7hDMFV1rUKWk99Qnz4yik=|1673431945; YD00517437729195%3AWM_TID=4XvSXI3sz8RBVEFUVBbFaZFeQMrN45Ch; __snaker__id=2YUVyUjuyjKNhphF; YD00517437729195%3AWM_NI=kOuUDgVtNcEnT9Dc808Rj11gWKBsOWecfQyYI1NHCec2%2FKRbUxbNE8KxKezYmikZJydCOKcsI%2B4MWFClB5sOpFlDx3a16PMC6g6W9%2FVKj6QVAnE%2BHTrhLDj8D87a9a1nSG8%3D; YD00517437729195%3AWM_NIKE=9ca17ae2e6ffcda170e2e6ee8fae49a2ebe185e47a9abc8ea7d14f828e9e86c548a2a79faaea73b5899e8fc42af0fea7c3b92aa991bbb6c76d96ac8284c86698e78c84bb3cfc8ea6d2b46d95958e94ce5da7bdaab2fc538bef82a9c26fa1eee1acd16a97a8aeafc83489a88586f953afb7a5bbc973a89d81ace2798bf5fcaed64e81b48ed6f245b49aa4a5fb39a3effab1d049f6b9fab8bc259695a6d7d45e83b28bcccb60b2b884a5e93488e8f982bc6bf3b29da8bb37e2a3; q_c1=46ae590826624150bc0c04f866ca348a|1678936637000|1678936637000; z_c0=2|1:0|10:1699939230|4:z_c0|80:MS4xUmE2RkNBQUFBQUFtQUFBQVlBSlZUUUtzTldiUXd1ZzN3VTJxMGgwVWdFUmpVeVdwS2pLN09RPT0=|6667fdde5e996d9294a22c1ab0fc13ab54ce6f26fa898705d038d79c1dab18f6; tst=h; _xsrf=296cef34-d81d-494b-acbf-17e9f048a554; Hm_lvt_98beee57fd2ef70ccdd5ca52b9740c49=1699688361,1699836450,1699938459,1700052688; SESSIONID=cV7o1YemROdq41wgEq8pDgKoGGdAdz3RjbTCcyGRHdX; JOID=VF8WBU-bIILX6tUpUJtzELEEAEpD-XKwutmNSDjLbuKj3OZfM0-f0bLp0ChXtsAVXly1a11xoPfHDx52pX2yu88=; osd=Ul0cBU-dIojX6tMrWptzFrMOAEpF-3iwut-PQjjLaOCp3OZZMUWf0bTr2ihXsMIfXlyzaVdxoPHFBR52o3-4u88=; Hm_lpvt_98beee57fd2ef70ccdd5ca52b9740c49=1700052726; KLBRSID=76ae5fb4fba0f519d97e594f1cef9fab|1700052728|1700052685",
+					"https://www.zhihu.com/hot").Crawl()
 		logging.debug("[NewsDirector] generate_script_today: found news here:" + str(news).replace('\n\n', ' '))
 		prompt = "你是"
 		# 截短新闻列表长度
@@ -193,7 +288,7 @@ class NewsDirector(Director):
 					"[NewsDirector] generate_script_today: news_str for reading:" + str(self.news_str).replace('\n\n',
 					                                                                                           ' '))
 			try:
-				self.script = self.chat_ai.ask_once(self.news_str)
+				self.script = self.chat_ai.ask_limited(self.news_str)
 			except:
 				# TODO: 补完报错信息
 				logging.error("[NewsDirector] ")
@@ -217,7 +312,7 @@ class NewsDirector(Director):
 		i = self.script.index("：\n")
 		self.script = self.script[i + 2:]  # 从该位置之后截取字符串
 		logging.debug("[NewsDirector] generate_script_today: trimmed script:" + str(self.script).replace('\n\n', ' '))
-		utils.save_script(self.script)
+		utils.save_script(self.script, self.script_path)
 		return self.script
 
 	def check_video_material(self) -> bool:
@@ -233,10 +328,19 @@ class NewsDirector(Director):
 		:param fps:
 		:return:
 		"""
-		self.editor.create_subtitled_video(background_path = self.blured_bg_path, audio_path = self.tts_path,
-		                                   output_path = self.output_path, subtitle_path = self.subtitle_path,
-		                                   bgm_path = self.bgm_path, video_title = None,
-		                                   fps = fps)
+		self.render_job(fps)()
+
+	def render_job(self, fps=60) -> functools.partial:
+		"""
+		返回一个不依赖导演自身状态的渲染任务，可以pickle后交给进程池执行
+		:param fps: 帧率
+		:return: 无参数的渲染任务
+		"""
+		return functools.partial(self.editor.create_subtitled_video,
+		                         background_path = self.blured_bg_path, audio_path = self.tts_path,
+		                         output_path = self.output_path, subtitle_path = self.subtitle_path,
+		                         bgm_path = self.bgm_path, video_title = None,
+		                         fps = fps, cache = self.cache)
 
 	def upload_video(self) -> None:
 		self.uploader.upload(file_path = self.output_path, video_description = self.description)
@@ -256,8 +360,8 @@ class NewsDirector(Director):
 		"""
 		# ai = ChatAIs.ErnieBot()
 		# ai.ask_once()
-		png_link = self.draw_ai.create_art_once("新闻播报 AI 信息 背景 麦克风")
-		utils.save_background(png_link)
+		png_link = self.draw_ai.create_art_once(self.background_prompt)
+		utils.save_background(png_link, self.raw_bg_path)
 
 	def generate_description(self):
 		"""
@@ -267,7 +371,7 @@ class NewsDirector(Director):
 		# 要交给uploader进行视频简介生成，因为每个平台对应的简介不一样。
 		self.description = self.uploader.generate_description(chat_ai = self.chat_ai, video_script = self.script)
 		logging.info("[NewsDirector] Got generated description :" + str(self.description))
-		utils.save_description(self.description)
+		utils.save_description(self.description, self.description_path)
 
 
 class ChatDirector(Director):
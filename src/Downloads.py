@@ -0,0 +1,180 @@
+"""
+流式、可断点续传的文件下载，utils.download以及配音、背景图片的下载都通过它完成
+"""
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import Sessions
+from Caches import digest_file
+from Sessions import HttpClient
+
+logging.basicConfig(format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s-%(funcName)s',
+                    level = logging.DEBUG)
+
+CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class DownloadError(Exception):
+	"""
+	下载失败，或下载的文件没有通过长度、校验和检查
+	"""
+
+
+class Downloader:
+	"""
+	下载文件。响应分块写入目标路径旁的.part临时文件，不在内存中保存整个文件；
+	连接中断时使用Range请求从已下载的位置继续；下载完成后检查长度与sha256，通过后重命名为目标路径，
+	因此目标路径上不会出现不完整的文件。
+	服务端的ETag或Last-Modified与下载链接保存在.part.json中，续传时通过If-Range确认已下载的部分属于同一个文件；
+	没有这些信息的.part（例如同一路径上一次下载的是其他文件）不会被续传。
+	"""
+
+	def __init__(self, http_client: HttpClient = None, chunk_size: int = 1 << 16, retries: int = 3,
+	             concurrency: int = 4):
+		"""
+		:param http_client: 发送请求使用的连接池，为None时使用Sessions.client
+		:param chunk_size: 每次写入的字节数
+		:param retries: 中断后续传的次数
+		:param concurrency: download_many同时进行的下载数
+		"""
+		self.http_client = http_client or Sessions.client
+		self.chunk_size = chunk_size
+		self.retries = retries
+		self.concurrency = concurrency
+
+	def download(self, url: str, path: str, size: int = None, sha256: str = None) -> str:
+		"""
+		下载文件到path
+		:param url: 下载链接
+		:param path: 保存路径
+		:param size: 期望的字节数，为None时只与服务端声明的长度比较
+		:param sha256: 期望的sha256，为None时不检查
+		:return: path
+		"""
+		part_path = path + ".part"
+		# 服务端给出的ETag或Last-Modified，续传时通过If-Range确认文件没有变化
+		validator = self.read_validator(url, part_path)
+		total = None
+		for attempt in range(self.retries + 1):
+			offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+			headers = { }
+			if offset:
+				headers["Range"] = f"bytes={offset}-"
+				if validator:
+					headers["If-Range"] = validator
+			try:
+				with self.http_client.get(url, headers = headers, stream = True) as response:
+					if response.status_code == 416 and offset:
+						# 已下载的部分就是整个文件
+						total = self.content_range_total(response) or offset
+						break
+					response.raise_for_status()
+					validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+					self.write_validator(url, part_path, validator)
+					if response.status_code == 206:
+						match = CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+						if match is None or int(match.group(1)) != offset:
+							raise DownloadError(f"Unexpected Content-Range {response.headers.get('Content-Range')} "
+							                    f"for {url}")
+						total = int(match.group(3)) if match.group(3) != "*" else None
+						mode = "ab"
+					else:
+						# 服务端不支持Range或文件已经变化，从头下载
+						offset = 0
+						length = response.headers.get("Content-Length")
+						# 压缩传输时Content-Length是压缩后的长度
+						total = int(length) if length and not response.headers.get("Content-Encoding") else None
+						mode = "wb"
+					with open(part_path, mode) as f:
+						for chunk in response.iter_content(self.chunk_size):
+							f.write(chunk)
+				if total is None or os.path.getsize(part_path) >= total or attempt == self.retries:
+					break
+				logging.warning(f"[Downloader] Connection to {url} closed at {os.path.getsize(part_path)} of "
+				                f"{total} bytes, resuming")
+			except requests.HTTPError as e:
+				if e.response is None or e.response.status_code < 500:
+					raise DownloadError(f"Failed to download {url}: {e}") from e
+				if attempt == self.retries:
+					raise DownloadError(f"Failed to download {url} after {attempt + 1} attempts: {e}") from e
+				logging.warning(f"[Downloader] Server error while downloading {url}, retrying: {e}")
+			except requests.RequestException as e:
+				if attempt == self.retries:
+					raise DownloadError(f"Failed to download {url} after {attempt + 1} attempts: {e}") from e
+				logging.warning(f"[Downloader] Download of {url} interrupted at "
+				                f"{os.path.getsize(part_path) if os.path.exists(part_path) else 0} bytes, "
+				                f"resuming: {e}")
+
+		self.remove_validator(part_path)
+		self.verify(url, part_path, total if size is None else size, sha256)
+		os.replace(part_path, path)
+		logging.debug(f"[Downloader] Downloaded {url} to {path}")
+		return path
+
+	@staticmethod
+	def validator_path(part_path: str) -> str:
+		return part_path + ".json"
+
+	def read_validator(self, url: str, part_path: str) -> str | None:
+		"""
+		读取之前的下载保存的校验值。.part不属于url，或没有可以用于If-Range的校验值时删除.part，从头下载
+		:param url: 下载链接
+		:param part_path: 临时文件路径
+		:return: ETag或Last-Modified，没有可以续传的.part时返回None
+		"""
+		try:
+			with open(self.validator_path(part_path), "r", encoding = "utf-8") as f:
+				meta = json.load(f)
+		except (OSError, ValueError):
+			meta = { }
+		if meta.get("url") == url and meta.get("validator") and os.path.exists(part_path):
+			return meta["validator"]
+		if os.path.exists(part_path):
+			logging.info(f"[Downloader] Discarding {part_path}, it cannot be verified to belong to {url}")
+			os.remove(part_path)
+		self.remove_validator(part_path)
+		return None
+
+	def write_validator(self, url: str, part_path: str, validator: str | None) -> None:
+		if validator is None:
+			self.remove_validator(part_path)
+			return
+		with open(self.validator_path(part_path), "w", encoding = "utf-8") as f:
+			json.dump({ "url": url, "validator": validator }, f)
+
+	def remove_validator(self, part_path: str) -> None:
+		if os.path.exists(self.validator_path(part_path)):
+			os.remove(self.validator_path(part_path))
+
+	@staticmethod
+	def content_range_total(response: requests.Response) -> int | None:
+		match = re.match(r"bytes \*/(\d+)", response.headers.get("Content-Range", ""))
+		return int(match.group(1)) if match else None
+
+	@staticmethod
+	def verify(url: str, part_path: str, size: int | None, sha256: str | None) -> None:
+		"""
+		检查下载的长度与sha256，不通过时删除临时文件，下一次下载从头开始
+		"""
+		actual = os.path.getsize(part_path)
+		if size is not None and actual != size:
+			os.remove(part_path)
+			raise DownloadError(f"Downloaded {actual} bytes from {url}, expected {size}")
+		if sha256 is not None and digest_file(part_path) != sha256.lower():
+			os.remove(part_path)
+			raise DownloadError(f"Checksum mismatch for {url}")
+
+	def download_many(self, items: list[tuple[str, str]]) -> list[str]:
+		"""
+		同时下载多个文件，全部完成后返回；有下载失败时，其余下载完成后抛出第一个错误
+		:param items: (下载链接, 保存路径)的列表
+		:return: 保存路径的列表
+		"""
+		with ThreadPoolExecutor(max_workers = self.concurrency) as executor:
+			futures = [executor.submit(self.download, url, path) for url, path in items]
+		return [future.result() for future in futures]
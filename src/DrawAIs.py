@@ -4,11 +4,14 @@ import time
 from abc import ABCMeta, abstractmethod
 from http import HTTPStatus
 
-import dashscope
 import requests
 from dashscope import ImageSynthesis
 
+import Sessions
 import config
+from Pollers import TaskPoller
+from Sessions import HttpClient
+from Tokens import fetch_baidu_token, tokens
 
 logging.basicConfig(format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s-%(funcName)s',
                     level = logging.DEBUG)
@@ -18,6 +21,8 @@ class DrawAI(metaclass = ABCMeta):
 	"""
 	画图AI抽象类，定义了画图AI的接口
 	"""
+	# 发送HTTP请求使用的连接池，可以替换为单独配置的HttpClient
+	http_client: HttpClient = Sessions.client
 
 	@abstractmethod
 	def create_art_once(self, prompt: str) -> str:
@@ -37,6 +42,13 @@ class DrawAI(metaclass = ABCMeta):
 		"""
 		pass
 
+	def cache_signature(self) -> dict:
+		"""
+		返回决定画作的服务商、模型与参数，用于计算素材缓存的键
+		:return: dict
+		"""
+		return { "provider": type(self).__name__ }
+
 
 class BaiduDrawBot(DrawAI):
 	"""
@@ -45,6 +57,7 @@ class BaiduDrawBot(DrawAI):
 
 	API_KEY = config.DRAW_BAIDU_API_KEY
 	SECRET_KEY = config.DRAW_BAIDU_SECRET_KEY
+	poller = TaskPoller("BaiduDrawBot", initial = 3.0)
 
 	def __init__(self):
 		logging.debug("[BaiduDrawBot] __init__")
@@ -76,12 +89,11 @@ class BaiduDrawBot(DrawAI):
 
 	def get_access_token(self):
 		"""
-		使用 AK，SK 生成鉴权签名（Access Token）
-		:return: access_token，或是None(如果错误)
+		使用 AK，SK 生成鉴权签名（Access Token），在过期前由TokenManager缓存
+		:return: access_token
 		"""
-		url = "https://aip.baidubce.com/oauth/2.0/token"
-		params = { "grant_type": "client_credentials", "client_id": self.API_KEY, "client_secret": self.SECRET_KEY }
-		return str(requests.post(url, params = params).json().get("access_token"))
+		return tokens.get("baidu", self.API_KEY,
+		                  lambda: fetch_baidu_token(self.API_KEY, self.SECRET_KEY, self.http_client))
 
 	def create_task(self, prompt, width=1440, height=2560) -> str:
 		"""
@@ -104,7 +116,7 @@ class BaiduDrawBot(DrawAI):
 			'Accept'      : 'application/json'
 		}
 
-		response = requests.request("POST", url, headers = headers, data = payload)
+		response = self.http_client.request("POST", url, headers = headers, data = payload)
 		logging.debug("[BaiduDrawBot] create_task: response = " + response.text)
 		task_id = str(response.json()["data"]["primary_task_id"])
 		logging.debug("[BaiduDrawBot] create_task: task_id = " + task_id)
@@ -127,23 +139,38 @@ class BaiduDrawBot(DrawAI):
 			'Accept'      : 'application/json'
 		}
 
-		response = requests.request("POST", url, headers = headers, data = payload).json()
+		def fetch():
+			response = self.http_client.request("POST", url, headers = headers, data = payload)
+			# 429、5xx带有Retry-After时由TaskPoller等待后重试
+			response.raise_for_status()
+			return response
+
+		download_url, _ = self.poller.poll(fetch, lambda response: self.parser_response(task_id, response))
+		logging.debug(f"[BaiduDrawBot] Oh, now we got this task {task_id} finished, link here:" + download_url)
+		return download_url
+
+	def parser_response(self, task_id: str, response: requests.Response) -> str | None:
+		"""
+		处理query_task获得的response
+		:param task_id: 任务ID
+		:param response: 查询的响应
+		:return: 下载链接，任务未完成时返回None
+		"""
+		response = response.json()
 		logging.debug("[BaiduDrawBot] Got response from the server = " + str(response))
 		# 请求出错
 		if "error_code" in response:
 			logging.error("[BaiduDrawBot] Opps, There's an error " + str(response))
 			raise Exception("Opps, There's an error " + str(response))
 
-		# task_id正在运行中
-		while response["data"]["task_status"] == "RUNNING":
+		# task_id正在排队或运行中
+		if response["data"]["task_status"] in ("INIT", "WAIT", "RUNNING"):
 			logging.info(f"[BaiduDrawBot] It seems like the task {task_id} is still running, retrying......")
-			time.sleep(3)
-			response = requests.request("POST", url, headers = headers, data = payload).json()
-			logging.debug("[BaiduDrawBot] Got response from the server = " + str(response))
-
-		download_url = response["data"]["sub_task_result_list"][0]["final_image_list"][0]["img_url"]
-		logging.debug(f"[BaiduDrawBot] Oh, now we got this task {task_id} finished, link here:" + download_url)
-		return download_url
+			return None
+		if response["data"]["task_status"] != "SUCCESS":
+			logging.error("[BaiduDrawBot] Task failed " + str(response))
+			raise Exception("Task failed " + str(response))
+		return response["data"]["sub_task_result_list"][0]["final_image_list"][0]["img_url"]
 
 
 class PexelsDrawAI(DrawAI):
@@ -163,7 +190,13 @@ class WanXiangDrawAI(DrawAI):
 	"""
 	万象画作，API文档：https://www.xfyun.cn/doc/words/word2picture/API.html
 	"""
-	dashscope.api_key = config.DRAW_WANXIANG_API_KEY
+	# 调用时显式传入，避免与同时运行的Qwen、DashScopeTTS争用dashscope.api_key
+	API_KEY = config.DRAW_WANXIANG_API_KEY
+	MODEL = ImageSynthesis.Models.wanx_v1
+	SIZE = "720*1280"
+
+	def cache_signature(self) -> dict:
+		return { **super().cache_signature(), "model": self.MODEL, "size": self.SIZE }
 
 	def create_art_once(self, prompt: str) -> str:
 		"""
@@ -171,10 +204,11 @@ class WanXiangDrawAI(DrawAI):
 		:param prompt:
 		:return:
 		"""
-		response = ImageSynthesis.call(model = ImageSynthesis.Models.wanx_v1,
+		response = ImageSynthesis.call(model = self.MODEL,
+		                               api_key = self.API_KEY,
 		                               prompt = prompt,
 		                               n = 1,
-		                               size = "720*1280")
+		                               size = self.SIZE)
 		if response.status_code == HTTPStatus.OK:
 			logging.debug(response.output)
 			logging.debug(response.usage)
@@ -1,61 +1,232 @@
+import logging
+import math
+import os
+import re
+import tempfile
+import time
+
 import ffmpeg
+from PIL import Image
+from moviepy.config import get_setting
+
+from MovieEditors import MovieEditor, SubtitleSprites
+
+logging.basicConfig(format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s-%(funcName)s',
+                    level = logging.DEBUG)
 
 
-def create_subtitled_video(background_path, audio_path, output_path, subtitle_path, bgm_path,
-                           project_title=None, video_title=None, fps=30):
+class FFMpegMovieEditor(MovieEditor):
 	"""
-    使用 ffmpeg-python 创建带字幕的视频。
+	完全在ffmpeg滤镜图中渲染的视频编辑器，画面与MovieEditor一致：背景、标题、日期、副标题与字幕，
+	背景音乐峰值归一化后以0.1的音量淡入。所有文字和底色块写入一个ASS字幕文件，由libass使用fonts/中的字体绘制，
+	渲染过程中没有逐帧的Python回调。
+	"""
+	# ASS文件中的字体名称，对应fonts_dir中的字体文件
+	font_name = "Smiley Sans Oblique"
+	fonts_dir = "../fonts/"
+	# 与SubtitleSprites的默认排版一致
+	subtitle_fontsize = 110
+	subtitle_line_height = 210
+
+	def __init__(self, line_windows: bool = False, highlight_words: bool = False):
+		"""
+		:param line_windows: 是否按行显示字幕，见MovieEditor
+		:param highlight_words: 是否逐字高亮，使用ASS的卡拉OK标签\\k实现
+		"""
+		# 整个视频在ffmpeg中一次编码，不需要静止片段模式
+		super().__init__(still_segments = False, line_windows = line_windows, highlight_words = highlight_words)
+
+	def cache_signature(self) -> dict:
+		return { **super().cache_signature(), "subtitles": "ass", "font": self.font_name }
+
+	def render(self, compose_args: tuple, output_path, fps=30) -> None:
+		"""
+		完整渲染视频
+		:param compose_args: compose的参数
+		:param output_path: 输出路径
+		:param fps: 帧率
+		:return: None
+		"""
+		self.render_segment(compose_args, output_path, 0, None, fps)
+
+	def render_segment(self, compose_args: tuple, segment_path, start, end, fps=30) -> None:
+		"""
+		渲染start到end之间的片段，end为None时渲染到视频结尾
+		"""
+		background_path, audio_path, subtitle_path, bgm_path, project_title, video_title = compose_args
+		duration = self.media_duration(audio_path)
+		with tempfile.TemporaryDirectory(prefix = "ass-") as tmp:
+			ass_path = os.path.join(tmp, "overlay.ass")
+			with open(ass_path, "w", encoding = "utf-8") as f:
+				f.write(self.build_ass(background_path, subtitle_path, duration, project_title, video_title))
+
+			# 背景图片只解码一次，再用loop滤镜重复成整段视频；-loop 1输入会在每一帧重新解码PNG
+			video = (ffmpeg.input(background_path)
+			         .filter("loop", loop = math.ceil(duration * fps) - 1, size = 1, start = 0)
+			         .filter("setpts", f"N/{fps}/TB")
+			         .filter("ass", ass_path, fontsdir = self.fonts_dir))
+			audio = self.mix_audio(audio_path, bgm_path, duration)
+
+			if end is None:
+				end = duration
+			logging.info(f"[FFMpegMovieEditor] Rendering {start}s-{end:.2f}s to {segment_path}")
+			(ffmpeg.output(video, audio, segment_path, vcodec = self.codec, pix_fmt = "yuv420p", r = fps,
+			               acodec = "libmp3lame", audio_bitrate = self.audio_bitrate, ar = 48000, ss = start,
+			               t = end - start, movflags = "+faststart",
+			               force_key_frames = f"expr:gte(t,n_forced*{self.keyframe_interval})")
+			 .overwrite_output()
+			 .run(cmd = get_setting("FFMPEG_BINARY"), quiet = True))
+
+	def mix_audio(self, audio_path, bgm_path, duration):
+		"""
+		混合配音与背景音乐。背景音乐先按峰值归一化，再乘以0.1并在1.686秒内淡入，与MovieEditor.compose一致
+		:param audio_path: 配音路径
+		:param bgm_path: 背景音乐路径，为None时只有配音
+		:param duration: 视频时长
+		:return: ffmpeg音频流
+		"""
+		audio = ffmpeg.input(audio_path).audio
+		if bgm_path is None:
+			return audio
+		gain = 0.1 * 10 ** (-self.peak_volume(bgm_path) / 20)
+		bgm = (ffmpeg.input(bgm_path).audio
+		       .filter("atrim", duration = duration)
+		       .filter("volume", f"{gain:.6f}")
+		       .filter("afade", t = "in", d = 1.686))
+		# CompositeAudioClip直接相加，amix默认会按输入数量降低音量
+		return ffmpeg.filter([audio, bgm], "amix", inputs = 2, duration = "first", normalize = 0)
+
+	@staticmethod
+	def peak_volume(path) -> float:
+		"""
+		使用volumedetect读取音频的峰值音量
+		:param path: 音频路径
+		:return: 峰值音量，单位dB，0为满幅
+		"""
+		_, err = (ffmpeg.input(path).audio
+		          .filter("volumedetect")
+		          .output("-", f = "null")
+		          .run(cmd = get_setting("FFMPEG_BINARY"), capture_stderr = True))
+		match = re.search(r"max_volume: (-?[\d.]+) dB", err.decode("utf-8", errors = "ignore"))
+		return float(match.group(1)) if match else 0.0
 
-    :param background_path: 背景图片的路径。这张图片将被用作视频的背景。
-    :param audio_path: 音频文件的路径。这个音频将被用作视频的主音轨。
-    :param output_path: 视频输出的路径。
-    :param subtitle_path: 字幕文件的路径。字幕将被添加到视频中。
-    :param bgm_path: 背景音乐文件的路径。背景音乐将被添加到视频中。
-    :param project_title: 视频的主标题，如果提供，将出现在视频中。
-    :param video_title: 视频的副标题，如果提供，将出现在视频中。
-    :param fps: 背景视频的帧率，默认为30。
+	def build_ass(self, background_path, subtitle_path, duration,
+	              project_title: str = None, video_title: str = None) -> str:
+		"""
+		生成画面上所有文字与底色块的ASS字幕，坐标与MovieEditor.compose相同，单位为像素
+		:param background_path: 背景路径，用于获取视频尺寸
+		:param subtitle_path: 字幕路径
+		:param duration: 视频时长
+		:param project_title: 视频的标题
+		:param video_title: 视频的副标题
+		:return: ASS文件内容
+		"""
+		width, height = Image.open(background_path).size
+		if project_title is None:
+			project_title = f"《AI信息差》"
+		lines = ["[Script Info]", "ScriptType: v4.00+", f"PlayResX: {width}", f"PlayResY: {height}",
+		         "WrapStyle: 2", "ScaledBorderAndShadow: yes", "",
+		         "[V4+ Styles]",
+		         "Format: Name, Fontname, Fontsize, PrimaryColour, OutlineColour, BackColour, Bold, BorderStyle, "
+		         "Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding",
+		         f"Style: Default,{self.font_name},{self.subtitle_fontsize},&H00FFFFFF,&H00000000,&H00000000,"
+		         f"0,1,2,0,5,0,0,0,1",
+		         "",
+		         "[Events]",
+		         "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text"]
 
-    :return: None
-    """
+		def event(layer, start, end, text):
+			lines.append(f"Dialogue: {layer},{ass_time(start)},{ass_time(end)},Default,,0,0,0,,{text}")
 
-	# 步骤1: 创建一个基于背景图片的视频流
-	background_input = ffmpeg.input(background_path, loop = 1, framerate = fps)
-	audio_duration = float(ffmpeg.probe(audio_path)['format']['duration'])
-	background_video = ffmpeg.filter(background_input, 'trim', duration = audio_duration)
+		def box(start, end, x, y, w, h, color, alpha):
+			event(0, start, end, f"{{\\an7\\pos({x},{y})\\p1\\bord0\\shad0\\1c{color}\\1a{alpha}}}"
+			                     f"m 0 0 l {w} 0 {w} {h} 0 {h}{{\\p0}}")
 
-	# 步骤2: 读取音频文件
-	audio_input = ffmpeg.input(audio_path)
+		def text(start, end, x, y, content, fontsize, color, outline_color, outline):
+			event(1, start, end, f"{{\\an5\\pos({x},{y})\\fs{fontsize}\\1c{color}\\3c{outline_color}\\bord{outline}}}"
+			                     f"{ass_escape(content)}")
 
-	# 步骤3: 添加字幕
-	video_with_subtitles = ffmpeg.filter([background_video], 'subtitles', subtitle_path)
+		# 视频的大标题，黄色底色块
+		box(0, duration, 80, height // 3 - 200, width - 190, 280, "&H00FFFF&", "&H00&")
+		text(0, duration, 80 + (width - 190) // 2, height // 3 - 200 + 140, project_title, 190, "&H000000&",
+		     "&H000000&", 2)
+		# 视频的日期，rgba(255,255,255,0.174)的底色块
+		box(0, duration, 0, height // 3 - 500, width, 230, "&HFFFFFF&", "&HD3&")
+		text(0, duration, width // 2, height // 3 - 500 + 115, time.strftime('%Y年%m月%d日', time.localtime()), 140,
+		     "&HFFFFFF&", "&H0000FF&", 4)
+		# 视频的副标题
+		if video_title:
+			text(0, duration, width // 2, height * 4 // 5 + 140, video_title, 100, "&H00FFFF&", "&H000000&", 4)
 
-	# 步骤4: 添加标题（如果提供）
-	if project_title:
-		video_with_subtitles = ffmpeg.drawtext(video_with_subtitles,
-		                                       text = project_title,
-		                                       x = '(w-text_w)/2', y = '(h-text_h)/2')
-	if video_title:
-		video_with_subtitles = ffmpeg.drawtext(video_with_subtitles, text = video_title,
-		                                       x = '(w-text_w)/2', y = 'h-50')
+		# 字幕，排版与SubtitleSprites一致：每行固定行高，整体带rgba(0,0,0,0.32)的底色
+		top = height - 2000
+		cues, highlights = self.load_subtitles(subtitle_path)
+		for i, (start, end, content) in enumerate(cues.seconds()):
+			rows = SubtitleSprites.wrap_text(content, self.subtitle_line_chars)
+			box(start, end, 0, top, width, len(rows) * self.subtitle_line_height, "&H000000&", "&HAD&")
+			pieces = SubtitleSprites.split_rows(rows, highlights[i]) if highlights is not None else None
+			for j, row in enumerate(rows):
+				y = top + j * self.subtitle_line_height + self.subtitle_line_height // 2
+				if pieces is None:
+					text(start, end, width // 2, y, row, self.subtitle_fontsize, "&HFFFFFF&", "&H000000&", 2)
+					continue
+				# 未读到的字为次要颜色（白色），读到时切换为主要颜色（高亮颜色）
+				event(1, start, end, f"{{\\an5\\pos({width // 2},{y})\\fs{self.subtitle_fontsize}"
+				                     f"\\1c{ass_color(self.highlight_color)}\\2c&HFFFFFF&\\3c&H000000&\\bord2}}"
+				                     f"{karaoke(pieces[j], cues[i][0], cues[i][1])}")
+		return "\n".join(lines) + "\n"
 
-	# 步骤5: 处理背景音乐
-	bgm_input = ffmpeg.input(bgm_path)
-	bgm_trimmed = ffmpeg.filter(bgm_input, 'atrim', duration = audio_duration)
-	mixed_audio = ffmpeg.filter([audio_input, bgm_trimmed], 'amix', duration = 'first')
 
-	# 步骤6: 结合音频和视频
-	final_video = ffmpeg.output(video_with_subtitles, mixed_audio, output_path, vcodec = 'libx264', acodec = 'aac')
+def ass_time(seconds: float) -> str:
+	"""
+	秒数转换为ASS的时间格式 h:mm:ss.cc
+	"""
+	centiseconds = round(seconds * 100)
+	return (f"{centiseconds // 360000}:{centiseconds // 6000 % 60:02d}:{centiseconds // 100 % 60:02d}."
+	        f"{centiseconds % 100:02d}")
+
+
+def ass_color(color: tuple) -> str:
+	"""
+	RGB(A)颜色转换为ASS的颜色格式 &HBBGGRR&
+	"""
+	return f"&H{color[2]:02X}{color[1]:02X}{color[0]:02X}&"
 
-	# 执行ffmpeg命令并生成视频
-	ffmpeg.run(final_video)
 
+def karaoke(pieces: list[tuple[str, int]], start_ms: int, end_ms: int) -> str:
+	"""
+	为一行字幕加上卡拉OK标签：\\k标签的音节在开始时由次要颜色切换为主要颜色，时长为到下一个词开始的间隔。
+	第一个词之前的时间由一个没有文字的音节占据；时长为0的音节在libass中会直接显示为主要颜色，因此至少为1厘秒
+	:param pieces: 这一行的(文本, 开始毫秒数)列表，见SubtitleSprites.split_rows
+	:param start_ms: 字幕的开始毫秒数
+	:param end_ms: 字幕的结束毫秒数
+	:return: 带标签的ASS文本
+	"""
+	# 相对字幕开始的厘秒数，按累计值取整，避免误差累积
+	times = [round((start - start_ms) / 10) for _, start in pieces] + [round((end_ms - start_ms) / 10)]
+	result = []
+	elapsed = 0
+	if pieces and times[0] > 0:
+		result.append(f"{{\\k{times[0]}}}")
+		elapsed = times[0]
+	for i, (piece, _) in enumerate(pieces):
+		duration = max(1, times[i + 1] - elapsed)
+		result.append(f"{{\\k{duration}}}{ass_escape(piece)}")
+		elapsed += duration
+	return "".join(result)
+
+
+def ass_escape(text: str) -> str:
+	"""
+	ASS中反斜杠和花括号是控制字符，替换为全角字符，换行替换为\\N
+	"""
+	return text.replace("\\", "＼").replace("{", "｛").replace("}", "｝").replace("\n", "\\N")
 
-# 这个函数可以用来创建带字幕的视频，适用于生成各种配有背景音乐、字幕和标题的视频内容。
 
 if __name__ == '__main__':
-	create_subtitled_video(background_path = "../daily/2023_11_03/input/background_blured.png",
-	                       audio_path = "../daily/2023_11_03/input/tts.mp3",
-	                       output_path = "../daily/2023_11_03/output/output.mp4",
-	                       subtitle_path = "../daily/2023_11_03/input/subtitle.srt",
-	                       bgm_path = "../bin/bgm.flac",
-	                       fps = 30)
+	FFMpegMovieEditor().create_subtitled_video(background_path = "../daily/2023_11_03/input/background_blured.png",
+	                                           audio_path = "../daily/2023_11_03/input/tts.mp3",
+	                                           output_path = "../daily/2023_11_03/output/output.mp4",
+	                                           subtitle_path = "../daily/2023_11_03/input/subtitle.srt",
+	                                           bgm_path = "../bin/bgm.flac",
+	                                           fps = 30)
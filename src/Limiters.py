@@ -0,0 +1,98 @@
+"""
+按服务商限制并发请求数与请求速率，同一服务商的所有对象共用一个限制器
+"""
+import logging
+import threading
+import time
+from typing import Callable
+
+logging.basicConfig(format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s-%(funcName)s',
+                    level = logging.DEBUG)
+
+
+class RateLimiter:
+	"""
+	并发数由信号量限制；速率由令牌桶限制，令牌每秒补充rate个，最多积累burst个，每个请求消耗一个。
+	令牌不足时预支令牌并计算需要等待的时间，等待在锁外进行，先到的请求先得到令牌。
+	线程安全，同步调用与在线程中执行的异步调用共用同一个实例。
+	"""
+
+	def __init__(self, name: str, concurrency: int = 4, rate: float = None, burst: int = 1,
+	             clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+		"""
+		:param name: 服务商名称，用于日志与统计
+		:param concurrency: 同时进行的请求数上限
+		:param rate: 每秒请求数上限，为None时不限制速率
+		:param burst: 空闲时最多积累的令牌数，即允许连续发出的请求数
+		:param clock: 单调时钟，测试时可以替换
+		:param sleep: 等待函数，测试时可以替换
+		"""
+		self.name = name
+		self.concurrency = concurrency
+		self.rate = rate
+		self.burst = burst
+		self.clock = clock
+		self.sleep = sleep
+		self.semaphore = threading.BoundedSemaphore(concurrency)
+		self.tokens = float(burst)
+		self.updated = clock()
+		self.requests = 0
+		self.waited = 0.0
+		self.in_flight = 0
+		self.max_in_flight = 0
+		self._lock = threading.Lock()
+
+	def acquire(self) -> float:
+		"""
+		等待直到可以发出一个请求，之后必须调用release
+		:return: 等待的秒数
+		"""
+		started = self.clock()
+		self.semaphore.acquire()
+		delay = self.reserve()
+		if delay > 0:
+			self.sleep(delay)
+		waited = self.clock() - started
+		with self._lock:
+			self.requests += 1
+			self.waited += waited
+			self.in_flight += 1
+			self.max_in_flight = max(self.max_in_flight, self.in_flight)
+		if waited >= 1:
+			logging.debug(f"[RateLimiter] {self.name} request waited {waited:.2f}s")
+		return waited
+
+	def reserve(self) -> float:
+		"""
+		取一个令牌，令牌不足时预支
+		:return: 需要等待的秒数
+		"""
+		if self.rate is None:
+			return 0.0
+		with self._lock:
+			now = self.clock()
+			self.tokens = min(float(self.burst), self.tokens + (now - self.updated) * self.rate)
+			self.updated = now
+			self.tokens -= 1
+			return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+	def release(self) -> None:
+		with self._lock:
+			self.in_flight -= 1
+		self.semaphore.release()
+
+	def __enter__(self) -> "RateLimiter":
+		self.acquire()
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+		self.release()
+
+	def stats(self) -> dict:
+		"""
+		:return: 请求数、平均等待秒数与最大同时请求数
+		"""
+		with self._lock:
+			return { "requests"     : self.requests, "waited": self.waited,
+			         "mean_wait"    : self.waited / self.requests if self.requests else 0.0,
+			         "max_in_flight": self.max_in_flight }
@@ -1,21 +1,70 @@
+import hashlib
+import json
 import logging
-import re
+import math
+import os
+import tempfile
+import time
+
+import ffmpeg
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from moviepy.config import get_setting
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
 
 from moviepy.audio.AudioClip import CompositeAudioClip
 from moviepy.audio.io.AudioFileClip import AudioFileClip
 from moviepy.video.VideoClip import TextClip, ImageClip
 from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
 
+import Subtitles
+import Timings
 import utils
+from Caches import ArtifactCache, digest_file
+from Subtitles import CueTable
 
 logging.basicConfig(format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s-%(funcName)s',
                     level = logging.DEBUG)
 
 
 class MovieEditor:
+	# 输出视频的编码参数
+	codec = "libx264"
+	audio_bitrate = "320k"
+	# 每隔多少秒强制插入一个关键帧，局部重新渲染时只替换两个关键帧之间的片段
+	keyframe_interval = 2
+	# 需要重新渲染的时长超过总时长的这个比例时，直接完整渲染
+	partial_render_ratio = 0.5
+	# 字幕排版：每条字幕最多字数与每行最多字数，与Timings.timestamps_to_srt的默认值一致
+	subtitle_cue_chars = 24
+	subtitle_line_chars = 12
+	# 逐字高亮时已经读到的字的颜色
+	highlight_color = (255, 215, 0, 255)
+
+	def __init__(self, still_segments: bool = False, line_windows: bool = False, highlight_words: bool = False):
+		"""
+		:param still_segments: 是否按静止片段渲染。画面只在字幕切换时变化，开启后每个静止片段只编码一帧，
+		由concat的duration保持显示时长，输出为可变帧率视频，编码耗时与字幕条数成正比而不是与时长×帧率成正比
+		:param line_windows: 是否按行显示字幕，每次只显示正在朗读的一行
+		:param highlight_words: 是否逐字高亮，已经读到的字显示为highlight_color
+		"""
+		self.still_segments = still_segments
+		self.line_windows = line_windows
+		self.highlight_words = highlight_words
+
+	def cache_signature(self) -> dict:
+		"""
+		返回影响渲染结果的编辑器与编码参数，用于计算素材缓存的键
+		:return: dict
+		"""
+		return { "editor"           : type(self).__name__, "codec": self.codec, "audio_bitrate": self.audio_bitrate,
+		         "keyframe_interval": self.keyframe_interval, "subtitles": SubtitleSprites.__name__,
+		         "still_segments"   : self.still_segments, "line_windows": self.line_windows,
+		         "highlight_words"  : self.highlight_words }
+
 	def create_subtitled_video(self, background_path, audio_path, output_path, subtitle_path, bgm_path,
 	                           project_title: str = None, video_title: str = None,
-	                           fps=30):
+	                           fps=30, cache: ArtifactCache = None):
 		"""
 		将背景图片和语音合成为短视频，并在短视频中加入字幕，标题副标题，背景音乐。
 		:param background_path: 背景路径
@@ -26,8 +75,318 @@ class MovieEditor:
 		:param project_title: 视频的标题，将放在短视频中间。
 		:param video_title: 视频的副标题，将放在短视频下方。
 		:param fps: 帧率, 默认为30
+		:param cache: 素材缓存，所有输入都相同时直接从缓存复制渲染结果
 		:return:
 		"""
+		fingerprint = self.render_fingerprint(background_path, audio_path, subtitle_path, bgm_path,
+		                                      project_title, video_title, fps)
+		previous = self.read_render_manifest(output_path)
+		if os.path.exists(output_path) and previous == fingerprint:
+			logging.info(f"[MovieEditor] Render inputs of {output_path} unchanged, skip encoding")
+			return
+
+		compose_args = (background_path, audio_path, subtitle_path, bgm_path, project_title, video_title)
+		rendered = False
+		if (not self.still_segments and os.path.exists(output_path)
+				and previous is not None and previous["base"] == fingerprint["base"]):
+			# 只有字幕变化，尝试只重新渲染变化的字幕所在的片段。静止片段模式没有固定的关键帧间隔，而且完整渲染本身就很快
+			rendered = self.rerender_changed_cues(previous["cues"], fingerprint["cues"], output_path, compose_args, fps)
+		if not rendered:
+			if cache is not None:
+				cache.fetch("render", cache.key("render", **fingerprint), { "video": output_path },
+				            lambda: self.render(compose_args, output_path, fps))
+			else:
+				self.render(compose_args, output_path, fps)
+		self.write_render_manifest(output_path, fingerprint)
+
+	def render_fingerprint(self, background_path, audio_path, subtitle_path, bgm_path,
+	                       project_title: str = None, video_title: str = None, fps=30) -> dict:
+		"""
+		计算渲染输入的指纹。base覆盖除字幕以外的所有输入，cues为解析后的字幕，
+		以便判断是否只有字幕发生了变化。逐字高亮时字级时间戳计入base，时间戳变化时完整渲染。
+		:return: { "base": str, "cues": [[开始秒数, 结束秒数, 文本], ...] }
+		"""
+		words_path = Timings.words_path(subtitle_path)
+		words = digest_file(words_path) if self.highlight_words and os.path.exists(words_path) else None
+		base = ArtifactCache.key("render", editor = self.cache_signature(), words = words,
+		                         background = digest_file(background_path), audio = digest_file(audio_path),
+		                         bgm = digest_file(bgm_path) if bgm_path is not None else None,
+		                         project_title = project_title, video_title = video_title, fps = fps,
+		                         # 视频中会绘制渲染当天的日期
+		                         date = time.strftime('%Y年%m月%d日', time.localtime()))
+		return { "base": base, "cues": [list(cue) for cue in self.read_cues(subtitle_path)] }
+
+	@staticmethod
+	def render_manifest_path(output_path) -> str:
+		return os.path.splitext(output_path)[0] + ".render.json"
+
+	def read_render_manifest(self, output_path) -> dict | None:
+		"""
+		读取上一次渲染时保存的指纹
+		:param output_path: 输出路径
+		:return: 指纹，没有则返回None
+		"""
+		try:
+			with open(self.render_manifest_path(output_path), "r", encoding = "utf-8") as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return None
+
+	def write_render_manifest(self, output_path, fingerprint: dict) -> None:
+		with open(self.render_manifest_path(output_path), "w", encoding = "utf-8") as f:
+			json.dump(fingerprint, f, ensure_ascii = False)
+
+	def write_params(self, fps) -> dict:
+		"""
+		write_videofile的编码参数，完整渲染与局部渲染必须一致，片段才能直接拼接
+		:param fps: 帧率
+		:return: dict
+		"""
+		return dict(codec = self.codec, fps = fps, audio_bitrate = self.audio_bitrate, audio_fps = 48000,
+		            audio_bufsize = 6000,
+		            ffmpeg_params = ["-force_key_frames", f"expr:gte(t,n_forced*{self.keyframe_interval})"])
+
+	def render(self, compose_args: tuple, output_path, fps=30) -> None:
+		"""
+		完整渲染视频
+		:param compose_args: compose的参数
+		:param output_path: 输出路径
+		:param fps: 帧率
+		:return: None
+		"""
+		final_clip = self.compose(*compose_args)
+		if self.still_segments:
+			cues, highlights = self.load_subtitles(compose_args[2])
+			cues = cues.seconds()
+			if highlights is not None:
+				# 每个词开始时高亮发生变化，作为没有持续时间的字幕加入变化时间点
+				cues += [(start / 1000, start / 1000, "") for starts, _ in highlights for start in starts.tolist()]
+			self.render_stills(final_clip, cues, output_path)
+		else:
+			final_clip.write_videofile(output_path, **self.write_params(fps))
+
+	@staticmethod
+	def change_points(cues: list[tuple[float, float, str]], duration) -> list[float]:
+		"""
+		计算画面发生变化的时间点：视频开头、结尾以及每条字幕的开始与结束
+		:param cues: (开始秒数, 结束秒数, 文本)的列表
+		:param duration: 视频时长
+		:return: 从小到大排列的秒数，相邻两个时间点之间的画面保持不变
+		"""
+		points = { 0.0, float(duration) }
+		for start, end, _ in cues:
+			points.update(t for t in (start, end) if 0 < t < duration)
+		return sorted(points)
+
+	def render_stills(self, final_clip, cues: list[tuple[float, float, str]], output_path) -> None:
+		"""
+		按静止片段渲染：每两个相邻的变化时间点之间只取一帧保存为PNG，相同的画面只保存一次，
+		再用concat demuxer按片段时长拼接并编码为可变帧率视频，音频单独混音后直接复制进输出文件。
+		:param final_clip: compose返回的视频clip
+		:param cues: 视频中显示的字幕，用于确定画面变化的时间点
+		:param output_path: 输出路径
+		:return: None
+		"""
+		duration = final_clip.duration
+		points = self.change_points(cues, duration)
+		with tempfile.TemporaryDirectory(prefix = "stills-", dir = os.path.dirname(os.path.abspath(output_path))) as tmp:
+			stills = []
+			saved: dict[str, str] = { }
+			for start, end in zip(points, points[1:]):
+				frame = final_clip.get_frame(start)
+				digest = hashlib.sha1(frame.tobytes()).hexdigest()
+				if digest not in saved:
+					saved[digest] = os.path.join(tmp, f"{len(saved):05d}.png")
+					Image.fromarray(frame).save(saved[digest], compress_level = 1)
+				stills.append((saved[digest], end - start))
+			logging.info(f"[MovieEditor] {len(stills)} still segments, {len(saved)} distinct frames "
+			             f"for {duration:.2f}s of {output_path}")
+
+			audio_path = None
+			if final_clip.audio is not None:
+				audio_path = os.path.join(tmp, "audio.mp3")
+				final_clip.audio.write_audiofile(audio_path, fps = 48000, nbytes = 4, buffersize = 6000,
+				                                 codec = "libmp3lame", bitrate = self.audio_bitrate, logger = None)
+			self.encode_stills(stills, audio_path, output_path)
+
+	def encode_stills(self, stills: list[tuple[str, float]], audio_path, output_path) -> None:
+		"""
+		将静止画面按时长拼接为可变帧率视频，每个片段只编码一帧
+		:param stills: (图片路径, 显示秒数)的列表
+		:param audio_path: 音频路径，为None时输出没有音轨
+		:param output_path: 输出路径
+		:return: None
+		"""
+
+		def quote(path):
+			return "'" + os.path.abspath(path).replace("'", "'\\''") + "'"
+
+		# 图片默认按25帧每秒读取，时间戳会被取整到0.04秒，改为1000使字幕切换精确到毫秒
+		lines = ["ffconcat version 1.0"]
+		for path, seconds in stills:
+			lines += [f"file {quote(path)}", "option framerate 1000", f"duration {seconds:.6f}"]
+		# concat demuxer会忽略最后一个文件的duration，需要再写一次最后一张图片
+		lines += [f"file {quote(stills[-1][0])}", "option framerate 1000"]
+		list_path = output_path + ".stills.txt"
+		with open(list_path, "w", encoding = "utf-8") as f:
+			f.write("\n".join(lines) + "\n")
+		try:
+			streams = [ffmpeg.input(list_path, f = "concat", safe = 0).video]
+			params = dict(vcodec = self.codec, pix_fmt = "yuv420p", fps_mode = "vfr", movflags = "+faststart")
+			if audio_path is not None:
+				streams.append(ffmpeg.input(audio_path).audio)
+				params.update(acodec = "copy", shortest = None)
+			(ffmpeg.output(*streams, output_path, **params)
+			 .overwrite_output()
+			 .run(cmd = get_setting("FFMPEG_BINARY"), quiet = True))
+		finally:
+			os.remove(list_path)
+
+	def rerender_changed_cues(self, old_cues: list, new_cues: list, output_path, compose_args: tuple, fps=30) -> bool:
+		"""
+		只重新渲染变化的字幕所覆盖的时间段（向外取整到关键帧），再与原视频中未变化的部分直接拼接，音频沿用原视频。
+		:param old_cues: 上一次渲染时的字幕
+		:param new_cues: 本次的字幕
+		:param output_path: 输出路径，其中是上一次渲染的视频
+		:param compose_args: compose的参数
+		:param fps: 帧率
+		:return: 是否完成了局部渲染，返回False时需要完整渲染
+		"""
+		changed = set(map(tuple, old_cues)) ^ set(map(tuple, new_cues))
+		if not changed:
+			return False
+		duration = self.media_duration(compose_args[1])
+		start = math.floor(min(cue[0] for cue in changed) / self.keyframe_interval) * self.keyframe_interval
+		end = min(math.ceil(max(cue[1] for cue in changed) / self.keyframe_interval) * self.keyframe_interval,
+		          duration)
+		if end - start > duration * self.partial_render_ratio:
+			logging.info(f"[MovieEditor] {len(changed)} cues changed in {start}s-{end}s, too long for a partial render")
+			return False
+
+		logging.info(f"[MovieEditor] {len(changed)} cues changed, re-rendering {start}s-{end}s of {output_path}")
+		segment_path = output_path + ".segment.mp4"
+		try:
+			self.render_segment(compose_args, segment_path, start, end, fps)
+			self.splice(output_path, segment_path, start, end, duration, fps)
+		except (OSError, ffmpeg.Error) as e:
+			logging.warning(f"[MovieEditor] Partial render failed, falling back to a full render: {e!r}")
+			return False
+		finally:
+			if os.path.exists(segment_path):
+				os.remove(segment_path)
+		return True
+
+	def render_segment(self, compose_args: tuple, segment_path, start, end, fps=30) -> None:
+		"""
+		渲染视频中start到end之间的片段，编码参数与完整渲染一致
+		:param compose_args: compose的参数
+		:param segment_path: 片段的输出路径
+		:param start: 片段开始的秒数
+		:param end: 片段结束的秒数
+		:param fps: 帧率
+		:return: None
+		"""
+		self.compose(*compose_args).subclip(start, end).write_videofile(segment_path, **self.write_params(fps))
+
+	@staticmethod
+	def media_duration(path) -> float:
+		"""
+		读取音频或视频文件的时长，视频时长与配音时长相同
+		:param path: 文件路径
+		:return: 秒数
+		"""
+		return ffmpeg_parse_infos(path)["duration"]
+
+	@staticmethod
+	def splice(video_path, segment_path, start, end, duration, fps=30) -> None:
+		"""
+		用segment替换video中start到end之间的画面，其余画面与整条音轨不重新编码。start与end必须落在关键帧上。
+		先用segment复用器在这两个关键帧处把原视频切为完整的片段，再把片段当作完整的文件拼接，
+		不使用concat的inpoint、outpoint：带B帧的视频直接复制时，它们按解码时间截断，会在拼接处多出或丢掉帧
+		:param video_path: 原视频路径，拼接结果会覆盖该文件
+		:param segment_path: 替换用的片段
+		:param start: 片段开始的秒数
+		:param end: 片段结束的秒数
+		:param duration: 视频总时长
+		:param fps: 帧率，关键帧的时间戳可能因为时间基的换算略小于切分时间，允许半帧的误差
+		:return: None
+		"""
+
+		def quote(path):
+			return "'" + os.path.abspath(path).replace("'", "'\\''") + "'"
+
+		times = [t for t in (start, end) if 0 < t < duration]
+		tmp_path = video_path + ".splice.mp4"
+		with tempfile.TemporaryDirectory(prefix = "splice-") as tmp:
+			# 所有片段都只保留视频流：concat按文件的开始时间拼接，带音频的文件的开始时间来自音频的编码延迟，会使画面推迟
+			video_only = os.path.join(tmp, "segment.mp4")
+			(ffmpeg.input(segment_path).video
+			 .output(video_only, c = "copy")
+			 .run(cmd = get_setting("FFMPEG_BINARY"), quiet = True))
+			pieces = []
+			if times:
+				(ffmpeg.input(video_path).video
+				 .output(os.path.join(tmp, "part%03d.mp4"), c = "copy", f = "segment",
+				         segment_times = ",".join(str(t) for t in times), segment_time_delta = 0.5 / fps,
+				         reset_timestamps = 1)
+				 .run(cmd = get_setting("FFMPEG_BINARY"), quiet = True))
+				parts = sorted(os.path.join(tmp, name) for name in os.listdir(tmp) if name.startswith("part"))
+				if len(parts) != len(times) + 1:
+					raise OSError(f"Expected {len(times) + 1} pieces when cutting {video_path} at {times}, "
+					              f"got {len(parts)}")
+				if start > 0:
+					pieces.append(parts[0])
+				pieces.append(video_only)
+				if end < duration:
+					pieces.append(parts[-1])
+			else:
+				pieces.append(video_only)
+			list_path = os.path.join(tmp, "concat.txt")
+			with open(list_path, "w", encoding = "utf-8") as f:
+				f.write("ffconcat version 1.0\n" + "".join(f"file {quote(piece)}\n" for piece in pieces))
+			try:
+				video = ffmpeg.input(list_path, f = "concat", safe = 0).video
+				audio = ffmpeg.input(video_path).audio
+				(ffmpeg.output(video, audio, tmp_path, c = "copy", movflags = "+faststart")
+				 .overwrite_output()
+				 .run(cmd = get_setting("FFMPEG_BINARY"), quiet = True))
+				os.replace(tmp_path, video_path)
+			finally:
+				if os.path.exists(tmp_path):
+					os.remove(tmp_path)
+
+	def read_cues(self, subtitle_path) -> list[tuple[float, float, str]]:
+		"""
+		读取字幕文件中的所有字幕，按行显示或逐字高亮时为重新切分后的字幕
+		:param subtitle_path: 字幕路径
+		:return: (开始秒数, 结束秒数, 文本)的列表
+		"""
+		if self.line_windows or self.highlight_words:
+			return self.load_subtitles(subtitle_path)[0].seconds()
+		return Subtitles.read_cues(subtitle_path).seconds()
+
+	def load_subtitles(self, subtitle_path) -> tuple[CueTable, list[Timings.Highlight] | None]:
+		"""
+		读取视频中显示的字幕，不含< No Speech >。开启按行显示或逐字高亮时，由字幕旁的字级时间戳重新切分，
+		不需要重新合成语音；没有字级时间戳时由字幕的时间按字数推算。按行显示时每条字幕只有一行，
+		显示时间为这一行的朗读时间
+		:param subtitle_path: 字幕路径
+		:return: 字幕表, 与字幕一一对应的高亮信息（未开启逐字高亮时为None）
+		"""
+		cues = Subtitles.read_cues(subtitle_path).exclude('< No Speech >')
+		if not (self.line_windows or self.highlight_words):
+			return cues, None
+		words = Timings.load_words(subtitle_path, cues)
+		max_chars = self.subtitle_line_chars if self.line_windows else self.subtitle_cue_chars
+		segmented, highlights = words.highlights(max_chars, self.subtitle_line_chars)
+		return CueTable(segmented), highlights if self.highlight_words else None
+
+	def compose(self, background_path, audio_path, subtitle_path, bgm_path,
+	            project_title: str = None, video_title: str = None):
+		"""
+		合成背景、标题、日期、字幕与音频，返回还没有写入文件的视频
+		:return: moviepy的视频clip
+		"""
 		# 合成clip的列表
 		composite_list = []
 
@@ -50,7 +409,7 @@ class MovieEditor:
 
 		# Create a black background video
 		# black_clip = mp.ColorClip(size = (1920, 1080), color = (0, 0, 0), duration = duration)
-		bg_clip = ImageClip(background_path)
+		bg_clip = ImageClip(background_path).set_duration(duration)
 
 		# Generate Title
 		time_cnt = utils.get_cnt()
@@ -65,7 +424,6 @@ class MovieEditor:
 			         color = 'black', stroke_color = "black", stroke_width = 2)
 			.set_position((80, height // 3 - 200))
 			.set_duration(duration))
-		import time
 		# 视频的日期，通常为当天日期
 		date_time_clip = (TextClip(str(time.strftime('%Y年%m月%d日', time.localtime())),
 		                           font = "UD-Digi-Kyokasho-N-B-&-UD-Digi-Kyokasho-NP-B-&-UD-Digi-Kyokasho-NK-B",
@@ -85,100 +443,259 @@ class MovieEditor:
 
 		final_audio_clip = CompositeAudioClip([bgm, audio]).set_fps(48000).set_duration(duration)
 
-		composite_list.extend([bg_clip.set_audio(final_audio_clip), bg_clip, title_clip, date_time_clip])
+		composite_list.extend([bg_clip, title_clip, date_time_clip])
 		if video_title:
 			composite_list.append(sub_title_clip)
 
+		# 背景与标题在整个视频中都不变，预先合成为一张图片，每一帧只需要再混合字幕
+		layers = self.flatten_static_layers(composite_list, duration)
+		final_clip = layers[0] if len(layers) == 1 else CompositeVideoClip(layers)
+		final_clip = final_clip.set_audio(final_audio_clip)
 		# Overlay subtitle on the background video
-		final_clip = CompositeVideoClip(composite_list, )
-		# attach bgm to the final video
 		final_clip = self.AddSubtitles(final_clip, subtitle_path)
 
-		# Write the final video to the specified output path
-		final_clip.duration = duration
-		final_clip.set_duration(duration)
-		final_clip.write_videofile(output_path, codec = "libx264", fps = fps,
-		                           audio_bitrate = "320k", audio_fps = 48000, audio_bufsize = 6000)
-
-	# 读取字幕文件
-	def read_srt(self, path):
-		content = ""
-		with open(path, 'r', encoding = 'UTF-8') as f:
-			content = f.read()
-			return content
-
-	# 字幕拆分
-	def get_sequences(self, content):
-		sequences = content.split('\n\n')
-		sequences = [sequence.split('\n') for sequence in sequences]
-		# 去除每一句空值
-		sequences = [list(filter(None, sequence)) for sequence in sequences]
-		# 去除整体空值
-		return list(filter(None, sequences))
-
-	# 转换时间
-	def strFloatTime(self, tempStr):
-		xx = tempStr.split(':')
-		hour = int(xx[0])
-		minute = int(xx[1])
-		second = int(xx[2].split(',')[0])
-		minsecond = int(xx[2].split(',')[1])
-		allTime = hour * 60 * 60 + minute * 60 + second + minsecond / 1000
-		return allTime
+		final_clip = final_clip.set_duration(duration)
+		return final_clip
 
-	def AddSubtitles(self, videoClip, txtFile):
-		src_video = videoClip
-		sentences = txtFile
+	@staticmethod
+	def is_static(clip, duration) -> bool:
+		"""
+		判断图层在整个视频中是否保持不变：是静态图片（包括TextClip），从0秒开始显示到最后，并且位置不随时间变化
+		:param clip: 图层
+		:param duration: 视频时长
+		:return: bool
+		"""
+		return (isinstance(clip, ImageClip)
+		        and clip.start == 0
+		        and (clip.end is None or clip.end >= duration)
+		        and clip.pos(0) == clip.pos(duration))
 
-		video = src_video
+	def flatten_static_layers(self, clips: list, duration) -> list:
+		"""
+		将最底层连续的静态图层预先合成为一张图片，只渲染一次。动态图层之上的静态图层保持不变，以免改变图层顺序。
+		:param clips: 从下到上的图层列表
+		:param duration: 视频时长
+		:return: 合成后的图层列表，第一个为合成好的底图
+		"""
+		count = 0
+		while count < len(clips) and self.is_static(clips[count], duration):
+			count += 1
+		if count <= 1:
+			return clips
+		base = CompositeVideoClip(clips[:count]).get_frame(0)
+		logging.debug(f"[MovieEditor] Flattened {count} static layers into one {base.shape[1]}x{base.shape[0]} frame")
+		return [ImageClip(base).set_duration(duration)] + clips[count:]
+
+	def AddSubtitles(self, videoClip, txtFile):
+		"""
+		在视频上叠加字幕。每条字幕只用Pillow渲染一次，每一帧只混合当前显示的那一条。
+		:param videoClip: 视频
+		:param txtFile: 字幕路径
+		:return: 叠加了字幕的视频
+		"""
+		video = videoClip
 		# 获取视频的宽度和高度
 		w, h = video.w, video.h
-		# 所有字幕剪辑
-		txts = []
-		# 读取字幕文件
-		content = self.read_srt(sentences)
-		sequences = self.get_sequences(content)
-
 		# 删除< No Speech >
-		sequences = list(filter(lambda x: x[2] != '< No Speech >', sequences))
-
-		# exit()
-
-		for line in sequences:
-			if len(line) < 3:
-				continue
-			sentences = line[2]
-			start = line[1].split(' --> ')[0]
-			end = line[1].split(' --> ')[1]
-
-			start = self.strFloatTime(start)
-			end = self.strFloatTime(end)
-
-			start, end = map(float, (start, end))
-			span = end - start
-			zmstr = []
-			# 超过24个字符则换行
-			if len(sentences) > 12:
-				zmstr = re.findall(r'.{12}', sentences)
-				zmstr.append(sentences[(len(zmstr) * 12):])
-				print(zmstr)
-				sentences = ""
-				for s in zmstr:
-					sentences += s + "\n"
-			# #ddddff
-			# https://moviepy-tburrows13.readthedocs.io/en/improve-docs/ref/VideoClip/TextClip.html
-
-			# stroke_color描边颜色，stroke_width 描边宽度， bg_color="red"
-			font = "Microsoft-YaHei-Bold-&-Microsoft-YaHei-UI-Bold"
-			txt = (TextClip(sentences, fontsize = 110,
-			                font = font, size = (w, len(zmstr) * 210),
-			                align = 'center', color = '#FFF', stroke_color = "black", stroke_width = 2,
-			                bg_color = "rgba(0,0,0,0.32)")
-			       .set_position((0, h - 2000))
-			       .set_duration(span)
-			       .set_start(start))
-
-			txts.append(txt)
-		# 合成视频
-		video = CompositeVideoClip([video, *txts])
-		return video
+		cues, highlights = self.load_subtitles(txtFile)
+		sprites = SubtitleSprites(cues, width = w, line_chars = self.subtitle_line_chars, highlights = highlights,
+		                          highlight_color = self.highlight_color)
+		position = (0, h - 2000)
+		return video.fl(lambda get_frame, t: sprites.blend(get_frame(t), t, position))
+
+
+class SubtitleSprites:
+	"""
+	字幕贴图。使用Pillow把每条字幕预先渲染成RGBA贴图，按开始时间建立区间索引，
+	每一帧通过二分查找得到当前显示的字幕并只混合这一张贴图，不需要ImageMagick，也不需要遍历所有字幕。
+	逐字高亮时每条字幕另外渲染一张高亮颜色的贴图，每一行从左边取高亮贴图中已经读到的部分。
+	"""
+
+	def __init__(self, cues: CueTable, width: int,
+	             font_path: str = "../fonts/SmileySans-Oblique.ttf", fontsize: int = 110, line_chars: int = 12,
+	             line_height: int = 210, color=(255, 255, 255, 255), stroke_color=(0, 0, 0, 255), stroke_width: int = 2,
+	             bg_color=(0, 0, 0, 82), highlights: list[Timings.Highlight] = None,
+	             highlight_color=(255, 215, 0, 255)):
+		"""
+		:param cues: 字幕表
+		:param width: 贴图宽度，通常为视频宽度
+		:param font_path: 字体路径
+		:param fontsize: 字号
+		:param line_chars: 每行最多字数，超过则换行
+		:param line_height: 每行的高度
+		:param color: 文字颜色
+		:param stroke_color: 描边颜色
+		:param stroke_width: 描边宽度
+		:param bg_color: 背景颜色，默认为rgba(0,0,0,0.32)
+		:param highlights: 与字幕一一对应的高亮信息，为None时不高亮
+		:param highlight_color: 已经读到的字的颜色
+		"""
+		self.width = width
+		self.font = ImageFont.truetype(font_path, fontsize)
+		self.line_chars = line_chars
+		self.line_height = line_height
+		self.color = color
+		self.stroke_color = stroke_color
+		self.stroke_width = stroke_width
+		self.bg_color = bg_color
+		self.highlight_color = highlight_color
+
+		self.cues = cues
+		# 相同文本的字幕共用一张贴图
+		rendered: dict[str, np.ndarray] = { }
+		self.sprites = []
+		for _, _, text in cues:
+			if text not in rendered:
+				rendered[text] = self.rasterize(text)
+			self.sprites.append(rendered[text])
+		# 每条字幕的(高亮贴图, 每一行的(每个词的开始毫秒数, 高亮到这个词为止的右边界)列表)
+		self.karaoke = None
+		if highlights is not None:
+			self.karaoke = [self.prepare_karaoke(text, highlight) for (_, _, text), highlight in zip(cues, highlights)]
+		# 上一次合成的贴图，同一个词读完之前的帧直接复用
+		self.composed = None
+
+	def wrap(self, text: str) -> list[str]:
+		"""
+		按每行最多字数换行
+		:param text: 字幕文本
+		:return: 每一行
+		"""
+		return self.wrap_text(text, self.line_chars)
+
+	@staticmethod
+	def wrap_text(text: str, line_chars: int) -> list[str]:
+		"""
+		按每行最多字数换行，FFMpegMovieEditor也使用相同的规则排版字幕。
+		Timings生成的字幕已经按词排好了行，这里只按\n拆分；其他来源的字幕按字数截断
+		:param text: 字幕文本
+		:param line_chars: 每行最多字数
+		:return: 每一行
+		"""
+		lines = []
+		for paragraph in text.split("\n"):
+			rows = [paragraph[i:i + line_chars] for i in range(0, len(paragraph), line_chars)]
+			# 行末的标点不单独换行，与Timings的排版一致
+			if len(rows) > 1 and Timings.is_punctuation(rows[-1]):
+				last = rows.pop()
+				rows[-1] += last
+			lines.extend(rows)
+		return lines or [""]
+
+	@staticmethod
+	def split_rows(rows: list[str], highlight: Timings.Highlight) -> list[list[tuple[str, int]]]:
+		"""
+		按词切分排好的每一行，跨行的词在换行处分为两段，FFMpegMovieEditor也使用它生成卡拉OK标签
+		:param rows: wrap得到的每一行
+		:param highlight: 这条字幕的高亮信息
+		:return: 每一行的(文本, 开始毫秒数)列表
+		"""
+		starts, char_ends = highlight
+		bounds = [0] + char_ends.tolist()
+		result = []
+		offset = 0
+		for row in rows:
+			pieces = []
+			k = int(np.searchsorted(char_ends, offset, side = "right"))
+			while k < len(starts) and bounds[k] < offset + len(row):
+				a, b = max(bounds[k], offset), min(bounds[k + 1], offset + len(row))
+				pieces.append((row[a - offset:b - offset], int(starts[k])))
+				k += 1
+			result.append(pieces)
+			offset += len(row)
+		return result
+
+	def prepare_karaoke(self, text: str, highlight: Timings.Highlight) -> tuple[np.ndarray, list]:
+		"""
+		渲染高亮贴图，并计算每一行中每个词读完时高亮部分的右边界
+		:param text: 字幕文本
+		:param highlight: 高亮信息
+		:return: (高亮贴图, 每一行的(每个词的开始毫秒数, 右边界像素)列表)
+		"""
+		rows = self.wrap(text)
+		bounds = []
+		for row, pieces in zip(rows, self.split_rows(rows, highlight)):
+			# 与rasterize相同，每行以宽度的一半为中心
+			left = self.width // 2 - self.font.getlength(row) / 2
+			xs = []
+			prefix = ""
+			for piece, _ in pieces:
+				prefix += piece
+				# 一行的最后一个词包含右侧的描边
+				right = self.width if prefix == row else math.ceil(left + self.font.getlength(prefix))
+				xs.append(min(self.width, right))
+			bounds.append((np.array([start for _, start in pieces], dtype = np.int64), xs))
+		return self.rasterize(text, self.highlight_color), bounds
+
+	def sprite_at(self, i: int, ms: int) -> np.ndarray:
+		"""
+		:param i: 字幕的下标
+		:param ms: 毫秒数
+		:return: ms时刻第i条字幕的贴图，逐字高亮时已经读到的字为高亮颜色
+		"""
+		if self.karaoke is None:
+			return self.sprites[i]
+		highlighted, bounds = self.karaoke[i]
+		# 每一行已经开始读的词数
+		counts = tuple(int(np.searchsorted(starts, ms, side = "right")) for starts, _ in bounds)
+		if self.composed is not None and self.composed[0] == (i, counts):
+			return self.composed[1]
+		sprite = self.sprites[i]
+		if any(counts):
+			sprite = sprite.copy()
+			for row, ((_, xs), count) in enumerate(zip(bounds, counts)):
+				if count:
+					rows = slice(row * self.line_height, (row + 1) * self.line_height)
+					sprite[rows, :xs[count - 1]] = highlighted[rows, :xs[count - 1]]
+		self.composed = ((i, counts), sprite)
+		return sprite
+
+	def rasterize(self, text: str, color=None) -> np.ndarray:
+		"""
+		将一条字幕渲染为RGBA贴图，每行居中
+		:param text: 字幕文本
+		:param color: 文字颜色，为None时使用self.color
+		:return: 形状为(行数 * 行高, 宽度, 4)的uint8数组
+		"""
+		lines = self.wrap(text)
+		image = Image.new("RGBA", (self.width, len(lines) * self.line_height), self.bg_color)
+		draw = ImageDraw.Draw(image)
+		for i, line in enumerate(lines):
+			draw.text((self.width // 2, i * self.line_height + self.line_height // 2), line, font = self.font,
+			          fill = color or self.color, anchor = "mm", stroke_width = self.stroke_width,
+			          stroke_fill = self.stroke_color)
+		return np.asarray(image)
+
+	def active(self, t: float) -> int | None:
+		"""
+		查找t时刻正在显示的字幕
+		:param t: 秒数
+		:return: 字幕的下标，没有则返回None
+		"""
+		return self.cues.at(round(t * 1000))
+
+	def blend(self, frame: np.ndarray, t: float, position: tuple[int, int]) -> np.ndarray:
+		"""
+		将t时刻的字幕混合到画面上
+		:param frame: 画面，形状为(高, 宽, 3)，不会被修改
+		:param t: 秒数
+		:param position: 贴图左上角的位置(x, y)，可以为负数或超出画面，超出画面的部分被裁掉
+		:return: 混合后的画面
+		"""
+		i = self.active(t)
+		if i is None:
+			return frame
+		sprite = self.sprite_at(i, round(t * 1000))
+		x, y = position
+		# 贴图与画面重叠的区域，在画面中为[top, bottom) x [left, right)
+		top, bottom = max(y, 0), min(y + sprite.shape[0], frame.shape[0])
+		left, right = max(x, 0), min(x + sprite.shape[1], frame.shape[1])
+		if bottom <= top or right <= left:
+			return frame
+		sprite = sprite[top - y:bottom - y, left - x:right - x]
+		frame = frame.copy()
+		region = frame[top:bottom, left:right].astype(np.uint16)
+		rgb = sprite[..., :3].astype(np.uint16)
+		alpha = sprite[..., 3:4].astype(np.uint16)
+		frame[top:bottom, left:right] = ((rgb * alpha + region * (255 - alpha) + 127) // 255).astype(np.uint8)
+		return frame
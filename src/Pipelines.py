@@ -0,0 +1,236 @@
+"""
+导演步骤的依赖图执行器，没有依赖关系的步骤会被并发执行
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Executor, FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Callable
+
+logging.basicConfig(format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s-%(funcName)s',
+                    level = logging.DEBUG)
+
+
+class Step:
+	"""
+	导演步骤，记录步骤名称、执行函数、依赖的步骤、所属阶段以及执行耗时
+	"""
+
+	def __init__(self, name: str, func: Callable[[], object], depends: list[str] = None, stage: str = None):
+		"""
+		:param name: 步骤名称，在同一个StepGraph中唯一
+		:param func: 步骤的执行函数，不接受参数。如果所属阶段在进程池中执行，则必须可以pickle
+		:param depends: 依赖的步骤名称列表，这些步骤全部完成后才会执行本步骤
+		:param stage: 所属阶段，例如llm、tts、draw、render，StagePools按阶段分配执行池
+		"""
+		self.name = name
+		self.func = func
+		self.depends = list(depends) if depends else []
+		self.stage = stage
+		# 步骤的返回值
+		self.result = None
+		# 步骤开始执行的时间（相对于StepGraph.run开始的秒数）
+		self.started_at: float | None = None
+		# 步骤执行耗时，单位秒
+		self.elapsed: float | None = None
+
+	def __repr__(self):
+		return f"Step({self.name!r}, depends={self.depends!r}, stage={self.stage!r}, elapsed={self.elapsed!r})"
+
+
+def _call_timed(func: Callable[[], object]) -> tuple[object, float, float]:
+	"""
+	执行步骤函数并计时，定义在模块级别以便在进程池中执行
+	:param func: 步骤函数
+	:return: 返回值, 开始执行的时间戳, 耗时
+	"""
+	started = time.time()
+	result = func()
+	return result, started, time.time() - started
+
+
+class StagePools:
+	"""
+	按阶段划分的执行池。每个阶段有独立的并发上限，网络等待较多的阶段（llm、tts、draw）使用线程池，
+	CPU密集的render阶段使用进程池，这样渲染不会排在等待网络的步骤后面，也不受GIL限制。
+	"""
+	# 各阶段默认的并发上限，API阶段受服务商的配额限制，渲染阶段随CPU核数扩展
+	DEFAULT_LIMITS = {
+		"llm"    : 2,
+		"tts"    : 2,
+		"draw"   : 2,
+		"render" : os.cpu_count() or 1,
+		"upload" : 1,
+		"default": 4,
+	}
+	# 在进程池中执行的阶段
+	PROCESS_STAGES = ("render",)
+
+	def __init__(self, limits: dict[str, int] = None, process_stages: tuple[str, ...] = PROCESS_STAGES):
+		"""
+		:param limits: 各阶段的并发上限，未指定的阶段使用DEFAULT_LIMITS
+		:param process_stages: 在进程池中执行的阶段
+		"""
+		self.limits = dict(self.DEFAULT_LIMITS)
+		if limits:
+			self.limits.update(limits)
+		self.process_stages = process_stages
+		self._executors: dict[str, Executor] = { }
+		self._lock = threading.Lock()
+
+	def executor(self, stage: str = None) -> Executor:
+		"""
+		获取阶段对应的执行池，第一次使用时创建
+		:param stage: 阶段名称，None或未配置的阶段使用default
+		:return: 执行池
+		"""
+		if stage not in self.limits:
+			stage = "default"
+		with self._lock:
+			if stage not in self._executors:
+				limit = max(1, self.limits[stage])
+				if stage in self.process_stages:
+					self._executors[stage] = ProcessPoolExecutor(max_workers = limit)
+				else:
+					self._executors[stage] = ThreadPoolExecutor(max_workers = limit, thread_name_prefix = stage)
+				logging.debug(f"[StagePools] Created {type(self._executors[stage]).__name__} for stage {stage}, "
+				              f"limit = {limit}")
+			return self._executors[stage]
+
+	def shutdown(self) -> None:
+		"""
+		关闭所有执行池，等待正在执行的步骤结束
+		:return: None
+		"""
+		with self._lock:
+			for executor in self._executors.values():
+				executor.shutdown(wait = True)
+			self._executors = { }
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.shutdown()
+
+
+class StepGraph:
+	"""
+	步骤依赖图，使用线程池并发执行所有依赖已满足的步骤，总耗时约等于最长依赖链的耗时。
+	"""
+
+	def __init__(self, name: str = "StepGraph", max_workers: int = 4):
+		"""
+		:param name: 依赖图的名称，用于日志
+		:param max_workers: 最多同时执行的步骤数
+		"""
+		self.name = name
+		self.max_workers = max_workers
+		self.steps: dict[str, Step] = { }
+
+	def add(self, name: str, func: Callable[[], object], depends: list[str] = None, stage: str = None) -> Step:
+		"""
+		添加一个步骤
+		:param name: 步骤名称
+		:param func: 步骤的执行函数
+		:param depends: 依赖的步骤名称列表
+		:param stage: 所属阶段，仅在使用StagePools执行时生效
+		:return: 添加的步骤
+		"""
+		if name in self.steps:
+			raise ValueError(f"[{self.name}] Step {name} already exists")
+		step = Step(name, func, depends, stage)
+		self.steps[name] = step
+		return step
+
+	def check(self) -> list[str]:
+		"""
+		检查依赖是否都存在且没有环，返回一个可行的拓扑顺序
+		:return: 步骤名称的拓扑顺序
+		"""
+		for step in self.steps.values():
+			for depend in step.depends:
+				if depend not in self.steps:
+					raise ValueError(f"[{self.name}] Step {step.name} depends on unknown step {depend}")
+
+		order = []
+		indegree = { name: len(step.depends) for name, step in self.steps.items() }
+		ready = [name for name, degree in indegree.items() if degree == 0]
+		while ready:
+			name = ready.pop(0)
+			order.append(name)
+			for step in self.steps.values():
+				if name in step.depends:
+					indegree[step.name] -= 1
+					if indegree[step.name] == 0:
+						ready.append(step.name)
+		if len(order) != len(self.steps):
+			cycle = [name for name in self.steps if name not in order]
+			raise ValueError(f"[{self.name}] Dependency cycle between steps {cycle}")
+		return order
+
+	def run(self, pools: StagePools = None) -> dict[str, float]:
+		"""
+		执行所有步骤。某个步骤出错时不再启动新的步骤，等待正在执行的步骤结束后抛出第一个错误。
+		:param pools: 按阶段划分的执行池，可以在多个StepGraph之间共享；为None时所有步骤在自己创建的线程池中执行
+		:return: 每个步骤的耗时，单位秒
+		"""
+		self.check()
+		own_executor = None
+		if pools is None:
+			own_executor = ThreadPoolExecutor(max_workers = self.max_workers, thread_name_prefix = self.name)
+
+		start = time.time()
+		done: set[str] = set()
+		running: dict[Future, Step] = { }
+		submitted_at: dict[str, float] = { }
+		error: BaseException | None = None
+
+		def submit_ready():
+			for step in self.steps.values():
+				if step.name in done or step.name in submitted_at:
+					continue
+				if all(depend in done for depend in step.depends):
+					executor = own_executor if pools is None else pools.executor(step.stage)
+					submitted_at[step.name] = time.time()
+					running[executor.submit(_call_timed, step.func)] = step
+
+		try:
+			submit_ready()
+			while running:
+				finished, _ = wait(running, return_when = FIRST_COMPLETED)
+				for future in finished:
+					step = running.pop(future)
+					try:
+						step.result, started, step.elapsed = future.result()
+						step.started_at = started - start
+					except BaseException as e:
+						step.elapsed = time.time() - submitted_at[step.name]
+						logging.error(f"[{self.name}] Step {step.name} failed after {step.elapsed:.2f}s: {e!r}")
+						if error is None:
+							error = e
+						continue
+					done.add(step.name)
+					logging.info(f"[{self.name}] Step {step.name} finished in {step.elapsed:.2f}s")
+				if error is None:
+					submit_ready()
+		finally:
+			if own_executor is not None:
+				own_executor.shutdown(wait = True)
+
+		total = time.time() - start
+		if error is not None:
+			raise error
+		timings = { name: step.elapsed for name, step in self.steps.items() }
+		logging.info(f"[{self.name}] All steps finished in {total:.2f}s, sum of steps "
+		             f"{sum(timings.values()):.2f}s: {self.format_timings()}")
+		return timings
+
+	def format_timings(self) -> str:
+		"""
+		将每个步骤的开始时间与耗时格式化为一行字符串，用于日志
+		:return: 例如 "script@0.00s+12.30s, background@0.00s+8.10s"
+		"""
+		return ", ".join(f"{step.name}@{step.started_at:.2f}s+{step.elapsed:.2f}s"
+		                 for step in self.steps.values() if step.elapsed is not None)
@@ -0,0 +1,160 @@
+"""
+异步任务的轮询，用于百度语音合成、阿里云NLS长文本语音合成与百度画图等先创建任务、再查询结果的接口
+"""
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable
+
+logging.basicConfig(format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s-%(funcName)s',
+                    level = logging.DEBUG)
+
+# 按服务商统计的轮询次数与耗时，所有TaskPoller共用
+_stats: dict[str, dict[str, float]] = { }
+_stats_lock = threading.Lock()
+
+
+class PollTimeout(Exception):
+	"""
+	任务在截止时间内没有完成
+	"""
+
+	def __init__(self, provider: str, polls: int, elapsed: float, response: Any):
+		super().__init__(f"[{provider}] Task not finished after {polls} polls in {elapsed:.1f}s, "
+		                 f"last response = {response}")
+		self.response = response
+
+
+def retry_after(source: Any) -> float | None:
+	"""
+	读取服务端建议的重试间隔，即Retry-After头，支持秒数与HTTP日期两种格式
+	:param source: 带headers的响应，或是带headers/response的HTTP异常（urllib.error.HTTPError、requests.HTTPError）
+	:return: 秒数，没有建议时返回None
+	"""
+	headers = getattr(source, "headers", None)
+	if headers is None and getattr(source, "response", None) is not None:
+		headers = getattr(source.response, "headers", None)
+	value = headers.get("Retry-After") if headers is not None else None
+	if value is None:
+		return None
+	try:
+		return max(0.0, float(value))
+	except ValueError:
+		pass
+	try:
+		return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+	except (TypeError, ValueError):
+		return None
+
+
+class TaskPoller:
+	"""
+	轮询异步任务直到完成。两次查询的间隔按指数退避增长并加入随机抖动，服务端给出Retry-After时以其为准；
+	总耗时超过deadline时抛出PollTimeout。完成时返回解析结果和最后一次的响应，不需要再查询一次。
+	"""
+
+	def __init__(self, provider: str, initial: float = 1.0, factor: float = 1.6, max_interval: float = 15.0,
+	             jitter: float = 0.2, deadline: float = 300.0, sleep: Callable[[float], None] = time.sleep,
+	             clock: Callable[[], float] = time.monotonic):
+		"""
+		:param provider: 服务商名称，用于日志与统计
+		:param initial: 第一次查询立即进行，之后第一个间隔的基准秒数，后续间隔在此基础上按factor增长
+		:param factor: 每次查询后间隔的增长倍数
+		:param max_interval: 间隔的上限，单位秒
+		:param jitter: 抖动比例，实际间隔在[1 - jitter, 1 + jitter]倍之间均匀分布，避免多个任务同时查询
+		:param deadline: 从开始轮询起的总时限，单位秒
+		:param sleep: 等待函数，测试时可以替换
+		:param clock: 单调时钟，测试时可以替换
+		"""
+		self.provider = provider
+		self.initial = initial
+		self.factor = factor
+		self.max_interval = max_interval
+		self.jitter = jitter
+		self.deadline = deadline
+		self.sleep = sleep
+		self.clock = clock
+
+	def interval(self, attempt: int) -> float:
+		"""
+		:param attempt: 已经查询的次数，从0开始
+		:return: 下一次查询前的等待秒数
+		"""
+		interval = min(self.max_interval, self.initial * self.factor ** attempt)
+		return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+	def poll(self, fetch: Callable[[], Any], parse: Callable[[Any], Any]) -> tuple[Any, Any]:
+		"""
+		轮询直到parse返回非None
+		:param fetch: 查询一次任务状态，返回响应。抛出带Retry-After的HTTP异常时（例如429）会等待后重试
+		:param parse: 解析响应，任务未完成时返回None，失败时抛出异常
+		:return: (parse的结果, 最后一次的响应)
+		"""
+		start = self.clock()
+		polls = 0
+		response = None
+		try:
+			while True:
+				elapsed = self.clock() - start
+				try:
+					wait = self.interval(polls)
+					polls += 1
+					response = fetch()
+				except Exception as e:
+					wait = retry_after(e)
+					if wait is None:
+						raise
+					logging.warning(f"[TaskPoller] {self.provider} asked to retry after {wait:.1f}s: {e}")
+				else:
+					result = parse(response)
+					if result is not None:
+						elapsed = self.clock() - start
+						logging.info(f"[TaskPoller] {self.provider} task finished after {polls} polls in {elapsed:.1f}s")
+						self.record(polls, elapsed, "finished")
+						return result, response
+					suggested = retry_after(response)
+					if suggested is not None:
+						wait = suggested
+				remaining = self.deadline - (self.clock() - start)
+				if remaining <= 0:
+					raise PollTimeout(self.provider, polls, self.clock() - start, response)
+				logging.debug(f"[TaskPoller] {self.provider} task still running after {elapsed:.1f}s, "
+				              f"polling again in {min(wait, remaining):.1f}s")
+				self.sleep(min(wait, remaining))
+		except PollTimeout:
+			self.record(polls, self.clock() - start, "timeouts")
+			raise
+		except Exception:
+			self.record(polls, self.clock() - start, "failed")
+			raise
+
+	def record(self, polls: int, elapsed: float, outcome: str) -> None:
+		with _stats_lock:
+			stat = _stats.setdefault(self.provider, { "tasks": 0, "finished": 0, "failed": 0, "timeouts": 0,
+			                                          "polls": 0, "seconds": 0.0, "max_seconds": 0.0 })
+			stat["tasks"] += 1
+			stat[outcome] += 1
+			stat["polls"] += polls
+			stat["seconds"] += elapsed
+			stat["max_seconds"] = max(stat["max_seconds"], elapsed)
+
+
+def stats() -> dict[str, dict]:
+	"""
+	本进程内按服务商统计的轮询情况
+	:return: { 服务商: { tasks, finished, failed, timeouts, polls, mean_polls, mean_seconds, max_seconds } }
+	"""
+	with _stats_lock:
+		snapshot = { provider: dict(stat) for provider, stat in _stats.items() }
+	for stat in snapshot.values():
+		stat["mean_polls"] = stat["polls"] / stat["tasks"]
+		stat["mean_seconds"] = stat["seconds"] / stat["tasks"]
+	return snapshot
+
+
+def reset_stats() -> None:
+	with _stats_lock:
+		_stats.clear()
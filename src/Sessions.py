@@ -0,0 +1,99 @@
+"""
+共用的HTTP连接池。服务商、爬虫与下载都通过HttpClient发送请求，同一主机的请求复用keep-alive连接，
+避免轮询、获取token等大量小请求每次都重新进行TCP与TLS握手。
+"""
+import logging
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logging.basicConfig(format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s-%(funcName)s',
+                    level = logging.DEBUG)
+
+
+class HttpClient:
+	"""
+	带连接池的requests.Session。每个主机一个连接池，可以为指定主机设置不同的池大小；
+	未指定timeout的请求使用默认超时；幂等请求（GET、HEAD、PUT、DELETE、OPTIONS）在连接失败
+	或服务端返回429、5xx时按指数退避重试，并遵守Retry-After。POST不会自动重试，由调用方决定。
+	"""
+
+	def __init__(self, pool_size: int = 10, host_pool_sizes: dict[str, int] = None, timeout: tuple = (5, 60),
+	             retries: int = 3, backoff_factor: float = 0.5):
+		"""
+		:param pool_size: 每个主机保持的连接数
+		:param host_pool_sizes: 指定主机的连接数，例如 { "aip.baidubce.com": 16 }
+		:param timeout: 默认的(连接超时, 读取超时)，单位秒
+		:param retries: 幂等请求的重试次数
+		:param backoff_factor: 重试的退避系数，第n次重试前等待backoff_factor * 2 ** (n - 1)秒
+		"""
+		self.timeout = timeout
+		self.retry = Retry(total = retries, backoff_factor = backoff_factor,
+		                   status_forcelist = (429, 500, 502, 503, 504),
+		                   allowed_methods = Retry.DEFAULT_ALLOWED_METHODS, respect_retry_after_header = True,
+		                   raise_on_status = False)
+		self.session = requests.Session()
+		self.adapters: list[HTTPAdapter] = []
+		self.session.mount("http://", self.adapter(pool_size))
+		self.session.mount("https://", self.adapter(pool_size))
+		for host, size in (host_pool_sizes or { }).items():
+			for scheme in ("http://", "https://"):
+				self.session.mount(scheme + host, self.adapter(size))
+		# 按主机统计的请求数与耗时
+		self.counters: dict[str, dict[str, float]] = { }
+		self._lock = threading.Lock()
+
+	def adapter(self, pool_size: int) -> HTTPAdapter:
+		adapter = HTTPAdapter(pool_connections = pool_size, pool_maxsize = pool_size, max_retries = self.retry)
+		self.adapters.append(adapter)
+		return adapter
+
+	def request(self, method: str, url: str, **kwargs) -> requests.Response:
+		"""
+		发送请求，参数与requests.request相同
+		:return: requests.Response
+		"""
+		kwargs.setdefault("timeout", self.timeout)
+		response = self.session.request(method, url, **kwargs)
+		with self._lock:
+			counter = self.counters.setdefault(urlsplit(url).hostname or "", { "requests": 0, "seconds": 0.0 })
+			counter["requests"] += 1
+			counter["seconds"] += response.elapsed.total_seconds()
+		return response
+
+	def get(self, url: str, **kwargs) -> requests.Response:
+		return self.request("GET", url, **kwargs)
+
+	def post(self, url: str, **kwargs) -> requests.Response:
+		return self.request("POST", url, **kwargs)
+
+	def stats(self) -> dict[str, dict]:
+		"""
+		按主机统计的请求数、新建连接数与连接复用率。连接数来自urllib3的连接池，
+		连接池因数量超过上限被关闭后，其中的连接数不再计入
+		:return: { 主机: { requests, connections, reuse_rate, mean_seconds } }
+		"""
+		connections: dict[str, int] = { }
+		for adapter in self.adapters:
+			pools = adapter.poolmanager.pools
+			for key in pools.keys():
+				pool = pools.get(key)
+				if pool is not None:
+					connections[pool.host] = connections.get(pool.host, 0) + pool.num_connections
+		with self._lock:
+			counters = { host: dict(counter) for host, counter in self.counters.items() }
+		for host, counter in counters.items():
+			counter["connections"] = connections.get(host, 0)
+			counter["reuse_rate"] = 1 - counter["connections"] / counter["requests"]
+			counter["mean_seconds"] = counter.pop("seconds") / counter["requests"]
+		return counters
+
+	def close(self) -> None:
+		self.session.close()
+
+
+# 进程内共用的实例，服务商类的http属性默认指向它
+client = HttpClient(host_pool_sizes = { "aip.baidubce.com": 16, "nls-gateway.cn-shanghai.aliyuncs.com": 16 })
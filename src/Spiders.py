@@ -3,18 +3,22 @@ from datetime import datetime
 
 import Data
 import ffmpeg
-import requests
 from bs4 import BeautifulSoup
 
+import Blobs
+import Sessions
 import config
 import utils
 from Data import News
+from Sessions import HttpClient
 
 
 class WeiBo:
 	"""
 	微博热搜爬虫
 	"""
+	# 发送HTTP请求使用的连接池，可以替换为单独配置的HttpClient
+	http_client: HttpClient = Sessions.client
 
 	def __init__(self, UserAgent, Cookie, Url):
 		self.Headers = { "User-Agent": UserAgent, "Cookie": Cookie }
@@ -22,7 +26,7 @@ class WeiBo:
 
 	##爬取成功 返回列表  爬取失败返回None
 	def Crawl(self):
-		response = requests.get(headers = self.Headers, url = self.Url)
+		response = self.http_client.get(headers = self.Headers, url = self.Url)
 		if response.ok:
 			soup = BeautifulSoup(response.text, "html.parser")
 			all = soup.findAll("div", attrs = { "class": "HotItem-content" })
@@ -40,13 +44,15 @@ class ZhihuHotSpider:
 	"""
 	知乎热榜爬虫
 	"""
+	# 发送HTTP请求使用的连接池，可以替换为单独配置的HttpClient
+	http_client: HttpClient = Sessions.client
 
 	def __init__(self):
 		self.Headers = config.SPYDER_ZHIHU_HEADER
 		self.Url = "https://www.zhihu.com/hot"
 
 	def get_news_list(self) -> list[dict]:
-		response = requests.get(headers = self.Headers, url = self.Url)
+		response = self.http_client.get(headers = self.Headers, url = self.Url)
 		if response.ok:
 			soup = BeautifulSoup(response.text, "html.parser")
 			all = soup.findAll("section", attrs = { "class": "HotItem" })
@@ -87,10 +93,10 @@ class ZhihuHotSpider:
 		# 下载cover_url中的图片，并把不是.jpg的图片使用ffmpeg-python转换为.jpg
 		for news in News_list:
 			# 下载图片
-			response = requests.get(news.cover_url)
+			response = self.http_client.get(news.cover_url)
 			# 如果图片是.jpg格式，则直接保存
 			if response.headers["Content-Type"] == "image/jpeg":
-				news.cover_data = response.content
+				news.set_blob("cover", Blobs.store.put_bytes(response.content, "image/jpeg"))
 			# 如果图片不是.jpg格式，则使用ffmpeg-python转换为.jpg
 			else:
 				# 保存图片到临时文件夹
@@ -101,13 +107,12 @@ class ZhihuHotSpider:
 				suffix = response.headers["Content-Type"].split("/")[-1]
 				input_file_name = f"../temp/temp.{suffix}"
 				output_file_name = "../temp/temp.jpg"
-				utils.download(news.cover_url, input_file_name)
+				utils.download(news.cover_url, input_file_name, self.http_client)
 				# 使用ffmpeg-python转换为.jpg
 				input_file = ffmpeg.input(input_file_name)
 				output_file = (ffmpeg
 				               .output(input_file, output_file_name))
 				ffmpeg.run(output_file)
-				with open("../temp/temp.jpg", "rb") as f:
-					news.cover_data = f.read()
+				news.save_blob("cover", output_file_name, "image/jpeg")
 		Data.write_news(news_list = News_list)
 		return News_list
@@ -0,0 +1,188 @@
+"""
+字幕的解析与写入，两个视频编辑器与TTS的字幕生成共用。
+SRT与WebVTT逐行流式解析，时间轴使用一个预编译的正则表达式；解析结果保存在数组实现的CueTable中，按时间二分查找。
+"""
+import bisect
+import re
+from array import array
+from typing import Iterable, Iterator
+
+# 时间轴行，例如 00:00:02,704 --> 00:00:12,435，WebVTT使用点号，并且可以省略小时，时间轴后面可以跟cue设置
+TIMING = re.compile(r"\s*(?:(\d+):)?(\d{1,2}):(\d{2})[,.](\d{1,3})\s*-->\s*(?:(\d+):)?(\d{1,2}):(\d{2})[,.](\d{1,3})")
+
+Cue = tuple[int, int, str]
+
+
+def _to_ms(hours, minutes, seconds, fraction) -> int:
+	return ((int(hours or 0) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + int(fraction.ljust(3, "0"))
+
+
+def iter_cues(lines: Iterable[str]) -> Iterator[Cue]:
+	"""
+	从SRT或WebVTT的行中逐条解析字幕，不需要先读入整个文件。
+	序号行、WEBVTT文件头、NOTE等不在时间轴之后的内容都会被忽略，没有文本的字幕返回空字符串。
+	:param lines: 字幕文件的行，例如打开的文件对象
+	:return: (开始毫秒数, 结束毫秒数, 文本)的迭代器，多行文本用\\n连接
+	"""
+	start = end = None
+	text: list[str] = []
+	for line in lines:
+		line = line.rstrip("\r\n")
+		if start is None:
+			match = TIMING.match(line)
+			if match:
+				start, end = _to_ms(*match.group(1, 2, 3, 4)), _to_ms(*match.group(5, 6, 7, 8))
+		elif line.strip():
+			text.append(line)
+		else:
+			yield start, end, "\n".join(text)
+			start = end = None
+			text = []
+	if start is not None:
+		yield start, end, "\n".join(text)
+
+
+class CueTable:
+	"""
+	按开始时间排序的字幕表。开始、结束毫秒数与文本在拼接字符串中的偏移量分别保存在array中，
+	所有文本拼接为一个字符串，比保存大量元组更紧凑。
+	"""
+
+	def __init__(self, cues: Iterable[Cue] = ()):
+		"""
+		:param cues: (开始毫秒数, 结束毫秒数, 文本)，不要求有序
+		"""
+		cues = list(cues)
+		if any(cues[i][0] > cues[i + 1][0] for i in range(len(cues) - 1)):
+			cues.sort(key = lambda cue: cue[0])
+		self.starts = array("q", (cue[0] for cue in cues))
+		self.ends = array("q", (cue[1] for cue in cues))
+		# 第i条字幕的文本为self.texts[self.offsets[i]:self.offsets[i + 1]]
+		self.offsets = array("q", [0])
+		for cue in cues:
+			self.offsets.append(self.offsets[-1] + len(cue[2]))
+		self.texts = "".join(cue[2] for cue in cues)
+		# 前i条字幕中最晚的结束时间，用于在字幕重叠时提前结束查找
+		self.max_ends = array("q")
+		for end in self.ends:
+			self.max_ends.append(max(end, self.max_ends[-1]) if self.max_ends else end)
+
+	@classmethod
+	def from_seconds(cls, cues: Iterable[tuple[float, float, str]]) -> "CueTable":
+		"""
+		从以秒为单位的字幕创建
+		:param cues: (开始秒数, 结束秒数, 文本)
+		:return: CueTable
+		"""
+		return cls((round(start * 1000), round(end * 1000), text) for start, end, text in cues)
+
+	def __len__(self) -> int:
+		return len(self.starts)
+
+	def __getitem__(self, i: int) -> Cue:
+		if i < 0:
+			i += len(self)
+		return self.starts[i], self.ends[i], self.text(i)
+
+	def __iter__(self) -> Iterator[Cue]:
+		for i in range(len(self)):
+			yield self[i]
+
+	def text(self, i: int) -> str:
+		return self.texts[self.offsets[i]:self.offsets[i + 1]]
+
+	def at(self, ms: int) -> int | None:
+		"""
+		查找ms时刻正在显示的字幕，有多条重叠时返回开始得最晚的一条
+		:param ms: 毫秒数
+		:return: 字幕的下标，没有则返回None
+		"""
+		i = bisect.bisect_right(self.starts, ms) - 1
+		while i >= 0 and self.max_ends[i] > ms:
+			if self.ends[i] > ms:
+				return i
+			i -= 1
+		return None
+
+	def exclude(self, *texts: str) -> "CueTable":
+		"""
+		去掉文本为texts之一的字幕，例如 < No Speech >
+		:param texts: 要去掉的文本
+		:return: 新的CueTable
+		"""
+		return CueTable(cue for cue in self if cue[2] not in texts)
+
+	def seconds(self) -> list[tuple[float, float, str]]:
+		"""
+		:return: (开始秒数, 结束秒数, 文本)的列表
+		"""
+		return [(start / 1000, end / 1000, text) for start, end, text in self]
+
+
+def read_cues(path: str) -> CueTable:
+	"""
+	流式读取SRT或WebVTT字幕文件
+	:param path: 字幕路径
+	:return: CueTable
+	"""
+	with open(path, "r", encoding = "utf-8-sig") as f:
+		return CueTable(iter_cues(f))
+
+
+def format_srt_time(ms: int) -> str:
+	"""
+	将毫秒数转换为SRT的时间格式 00:00:00,000
+	"""
+	ms = int(ms)
+	return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}"
+
+
+def format_cue(index: int, start: int, end: int, text: str) -> str:
+	"""
+	:return: 一条SRT字幕，包括末尾的空行
+	"""
+	return f"{index}\n{format_srt_time(start)} --> {format_srt_time(end)}\n{text}\n\n"
+
+
+def write_srt(cues: Iterable[Cue]) -> str:
+	"""
+	将字幕写为SRT文件内容，序号从0开始
+	:param cues: (开始毫秒数, 结束毫秒数, 文本)
+	:return: SRT文件内容
+	"""
+	return "".join(format_cue(i, start, end, text) for i, (start, end, text) in enumerate(cues))
+
+
+class SrtWriter:
+	"""
+	逐条追加写入SRT文件，每写入一条立即flush，读取方可以在字幕生成的过程中读到已经完成的字幕
+	"""
+
+	def __init__(self, path: str):
+		"""
+		:param path: 字幕路径，已有的文件会被覆盖
+		"""
+		self.path = path
+		self.count = 0
+		self.file = open(path, "w", encoding = "utf-8")
+
+	def write(self, start: int, end: int, text: str) -> None:
+		"""
+		追加一条字幕
+		:param start: 开始毫秒数
+		:param end: 结束毫秒数
+		:param text: 文本
+		:return: None
+		"""
+		self.file.write(format_cue(self.count, start, end, text))
+		self.file.flush()
+		self.count += 1
+
+	def close(self) -> None:
+		self.file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.close()
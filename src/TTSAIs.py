@@ -4,25 +4,42 @@ import hmac
 import http
 import json
 import logging
+import os
+import re
+import tempfile
 import time
-import urllib
 import uuid
 from abc import ABCMeta, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
 from urllib import parse
 
 import azure.cognitiveservices.speech as speechsdk
-import dashscope
-import requests
+import ffmpeg
+import nls
 from dashscope import SpeechSynthesizer
+from moviepy.config import get_setting
 
+import Caches
+import Sessions
+import Subtitles
 import config
 import utils
+from Pollers import TaskPoller
+from Sessions import HttpClient
+import Timings
+from Timings import WordTimings
+from Tokens import fetch_baidu_token, tokens
 
 
 class TextToSpeechAI(metaclass = ABCMeta):
 	"""
 	语音合成AI抽象类，定义了语音合成AI的接口
 	"""
+	# 发送HTTP请求使用的连接池，可以替换为单独配置的HttpClient
+	http_client: HttpClient = Sessions.client
+	# 是否在字幕旁保存字级时间戳（Timings.words_path），视频编辑器据此按行显示字幕或逐字高亮
+	word_timings = False
 
 	@abstractmethod
 	def create_audio_once(self, text: str, download_mp3_path: str, download_subtitle_path: str) -> None:
@@ -42,6 +59,26 @@ class TextToSpeechAI(metaclass = ABCMeta):
 		:return: 下载地址
 		"""
 
+	def cache_signature(self) -> dict:
+		"""
+		返回决定合成结果的服务商、音色、模型与参数，用于计算素材缓存的键
+		:return: dict
+		"""
+		return { "provider": type(self).__name__ }
+
+	@staticmethod
+	def write_subtitles(timestamps: list[dict], download_subtitle_path: str) -> None:
+		"""
+		由时间戳写入SRT字幕，同时把字级时间戳保存在字幕旁，之后改变字幕的显示方式不需要重新合成
+		:param timestamps: 句级时间戳列表，见Timings.WordTimings.from_items
+		:param download_subtitle_path: 字幕的保存路径
+		:return: None
+		"""
+		words = WordTimings.from_items(timestamps)
+		with open(download_subtitle_path, "w", encoding = 'utf-8') as f:
+			f.write(Subtitles.write_srt(words.segment()))
+		words.save(Timings.words_path(download_subtitle_path))
+
 
 class BaiduTextToSpeechAI(TextToSpeechAI):
 	"""
@@ -50,6 +87,8 @@ class BaiduTextToSpeechAI(TextToSpeechAI):
 
 	API_KEY = config.TTS_BAIDU_API_KEY
 	SECRET_KEY = config.TTS_BAIDU_SECRET_KEY
+	poller = TaskPoller("BaiduTextToSpeechAI", initial = 2.0, deadline = 600.0)
+	word_timings = True
 
 	def create_audio_once(self, text: str, download_mp3_path: str, download_subtitle_path: str) -> None:
 		"""
@@ -62,17 +101,12 @@ class BaiduTextToSpeechAI(TextToSpeechAI):
 		logging.debug("[BaiduTextToSpeechAI] Got text, text = " + text.replace("\n", " ").strip())
 		task_id = self.create_task(text)
 		logging.debug("[BaiduTextToSpeechAI] Created text to speech task,  task_id = " + task_id)
-		while self.parser_response(self.query_task(task_id)) is None:
-			time.sleep(3)
 		# 处理response，获得mp3和time_stamp
-		mp3_link, time_stamps = self.parser_response(self.query_task(task_id))
+		(mp3_link, time_stamps), _ = self.poller.poll(lambda: self.query_task(task_id), self.parser_response)
 		# 下载mp3
-		utils.download(mp3_link, download_mp3_path)
-		# 得到srt字符串
-		srt = utils.timestamps_to_srt(time_stamps)
-		# 写入字幕文件
-		with open(download_subtitle_path, "w", encoding = 'utf-8') as f:
-			f.write(srt)
+		utils.download(mp3_link, download_mp3_path, self.http_client)
+		# 写入字幕文件与字级时间戳
+		self.write_subtitles(time_stamps, download_subtitle_path)
 
 	def create_audio_multi(self, text_list: list) -> list:
 		"""
@@ -88,12 +122,11 @@ class BaiduTextToSpeechAI(TextToSpeechAI):
 
 	def get_access_token(self):
 		"""
-		使用 AK，SK 生成鉴权签名（Access Token）
-		:return: access_token，或是None(如果错误)
+		使用 AK，SK 生成鉴权签名（Access Token），在过期前由TokenManager缓存
+		:return: access_token
 		"""
-		url = "https://aip.baidubce.com/oauth/2.0/token"
-		params = { "grant_type": "client_credentials", "client_id": self.API_KEY, "client_secret": self.SECRET_KEY }
-		return str(requests.post(url, params = params).json().get("access_token"))
+		return tokens.get("baidu", self.API_KEY,
+		                  lambda: fetch_baidu_token(self.API_KEY, self.SECRET_KEY, self.http_client))
 
 	def create_task(self, text, fmt="mp3-48k", voice=106, lang="zh", speed=7, pitch=5, volume=7, enable_subtitle=1,
 	                brk=660) -> str | None:
@@ -129,7 +162,7 @@ class BaiduTextToSpeechAI(TextToSpeechAI):
 			'Accept'      : 'application/json'
 		}
 
-		response = requests.request("POST", url, headers = headers, data = payload)
+		response = self.http_client.request("POST", url, headers = headers, data = payload)
 		logging.debug("[BaiduTextToSpeechAI] Posted request, response = " + response.text)
 
 		j = response.json()
@@ -156,7 +189,7 @@ class BaiduTextToSpeechAI(TextToSpeechAI):
 			'Accept'      : 'application/json'
 		}
 
-		response = requests.request("POST", url, headers = headers, data = payload)
+		response = self.http_client.request("POST", url, headers = headers, data = payload)
 		return response.json()
 
 	def parser_response(self, response):
@@ -171,6 +204,9 @@ class BaiduTextToSpeechAI(TextToSpeechAI):
 			mp3 = response["speech_url"]
 			time_stamp = response["speech_timestamp"]["sentences"]
 			return mp3, time_stamp
+		elif response["task_status"] == "Failure":
+			logging.error("[BaiduTextToSpeechAI] Error at querying task: " + str(response))
+			raise Exception("[BaiduTextToSpeechAI] Error at querying task: " + str(response))
 		else:
 			return None
 
@@ -229,19 +265,52 @@ class AzureTTS(TextToSpeechAI):
 
 
 class DashScopeTTS(TextToSpeechAI):
-
-	def __init__(self):
-		dashscope.api_key = config.TTS_DASHSCOPE_API_KEY
+	# 句子结束的标点，分段合成时只在这些位置切分
+	SENTENCE_END = re.compile(r"(?<=[。！？；!?;\n])")
+	word_timings = True
+
+	def __init__(self, chunk_chars: int = None, concurrency: int = 4, retries: int = 2,
+	             phrase_cache: Caches.ArtifactCache = None):
+		"""
+		:param chunk_chars: 分段合成时每段的最大字数，为None时整篇文本一次合成
+		:param concurrency: 分段合成时同时请求的段数
+		:param retries: 分段合成时每段失败后的重试次数，一段失败不需要重新合成整篇文本
+		:param phrase_cache: 句子级的配音缓存，设置后逐句合成，每期重复的开场白、结束语等句子直接从缓存读取
+		"""
+		# 并发合成时全局的dashscope.api_key可能被其他服务覆盖，因此调用时显式传入
+		self.api_key = config.TTS_DASHSCOPE_API_KEY
+		self.model = 'sambert-zhide-v1'
+		self.sample_rate = 48000
+		self.rate = 1.1
+		self.volume = 85
+		self.chunk_chars = chunk_chars
+		self.concurrency = concurrency
+		self.retries = retries
+		self.phrase_cache = phrase_cache
+
+	def cache_signature(self) -> dict:
+		signature = { **super().cache_signature(), "model": self.model, "sample_rate": self.sample_rate,
+		              "rate": self.rate, "volume": self.volume, "chunk_chars": self.chunk_chars }
+		if self.phrase_cache is not None:
+			signature["phrases"] = True
+		return signature
 
 	def create_audio_once(self, text: str, download_mp3_path: str, download_subtitle_path: str) -> None:
+		if self.phrase_cache is not None:
+			self.create_audio_phrases(text, download_mp3_path, download_subtitle_path)
+			return
+		if self.chunk_chars:
+			self.create_audio_chunked(text, download_mp3_path, download_subtitle_path)
+			return
 		ssml_text = self.pre_SSML(text)
 		logging.debug("[DashScopeTTS] Got SSML text : " + ssml_text.replace("\n", " ").strip())
-		result = SpeechSynthesizer.call(model = 'sambert-zhide-v1',
+		result = SpeechSynthesizer.call(model = self.model,
+		                                api_key = self.api_key,
 		                                text = ssml_text,
-		                                sample_rate = 48000,
+		                                sample_rate = self.sample_rate,
 		                                format = 'mp3',
-		                                rate = 1.1,
-		                                volume = 85,
+		                                rate = self.rate,
+		                                volume = self.volume,
 		                                word_timestamp_enabled = True,
 		                                )
 		# 保存文件到当前目录
@@ -249,17 +318,154 @@ class DashScopeTTS(TextToSpeechAI):
 			with open(download_mp3_path, 'wb') as f:
 				f.write(result.get_audio_data())
 
-			word_timestamps = result.get_timestamps()
-			# 拿到字级时间戳，使用算法来进行句级时间戳的生成
-			time_stamps = []
-			for sentence in word_timestamps:
-				d = { "begin_time"    : sentence["begin_time"], "end_time": sentence["end_time"],
-				      "sentence_texts": "".join([word["text"] for word in sentence["words"]]) }
-				time_stamps.append(d)
-			srt = utils.timestamps_to_srt(time_stamps)
-			# 写入字幕文件
-			with open(download_subtitle_path, "w", encoding = 'utf-8') as f:
-				f.write(srt)
+			# 由字级时间戳切分字幕
+			self.write_subtitles(result.get_timestamps(), download_subtitle_path)
+
+	def create_audio_chunked(self, text: str, download_mp3_path: str, download_subtitle_path: str) -> None:
+		"""
+		在句子边界把文本分为不超过chunk_chars字的若干段，并发合成PCM，按采样点拼接后编码为一个mp3，
+		每段的时间戳按该段之前的采样点数平移，得到与整篇合成相同格式的连续字幕
+		:param text: text
+		:param download_mp3_path: 音频的下载路径
+		:param download_subtitle_path: 字幕的下载路径
+		:return: None
+		"""
+		chunks = self.split_sentences(text, self.chunk_chars)
+		logging.info(f"[DashScopeTTS] Synthesizing {len(chunks)} chunks, concurrency = {self.concurrency}")
+		with ThreadPoolExecutor(max_workers = max(1, self.concurrency), thread_name_prefix = "tts") as executor:
+			results = list(executor.map(self.synthesize_chunk, chunks))
+		self.write_stitched(results, download_mp3_path, download_subtitle_path)
+
+	def create_audio_phrases(self, text: str, download_mp3_path: str, download_subtitle_path: str) -> None:
+		"""
+		逐句合成，每句的PCM与字级时间戳以(synthesis_params中的合成参数, 规范化的SSML)为键存入phrase_cache。
+		缓存中已有的句子不再请求接口，只有新的句子并发合成，最后与create_audio_chunked相同地按采样点拼接
+		:param text: text
+		:param download_mp3_path: 音频的下载路径
+		:param download_subtitle_path: 字幕的下载路径
+		:return: None
+		"""
+		sentences = self.split_sentences(text, 0)
+		keys = [self.phrase_key(sentence) for sentence in sentences]
+		phrases: dict[str, tuple[bytes, list]] = { }
+		with tempfile.TemporaryDirectory(prefix = "tts-phrases-") as tmp:
+			# 同一篇文本中重复的句子只合成一次
+			missing = { }
+			for key, sentence in zip(keys, sentences):
+				if key in phrases or key in missing:
+					continue
+				outputs = self.phrase_outputs(tmp, key)
+				if self.phrase_cache.restore("tts_phrase", key, outputs):
+					with open(outputs["pcm"], "rb") as f, open(outputs["timestamps"], "r", encoding = "utf-8") as g:
+						phrases[key] = f.read(), json.load(g)
+				else:
+					missing[key] = sentence
+			logging.info(f"[DashScopeTTS] {len(sentences) - len(missing)}/{len(sentences)} sentences served from "
+			             f"the phrase cache, synthesizing {len(missing)}")
+			with ThreadPoolExecutor(max_workers = max(1, self.concurrency), thread_name_prefix = "tts") as executor:
+				for key, result in zip(missing, executor.map(self.synthesize_chunk, missing.values())):
+					phrases[key] = result
+					outputs = self.phrase_outputs(tmp, key)
+					with open(outputs["pcm"], "wb") as f, open(outputs["timestamps"], "w", encoding = "utf-8") as g:
+						f.write(result[0])
+						json.dump(result[1], g, ensure_ascii = False)
+					self.phrase_cache.store("tts_phrase", key, outputs)
+		self.write_stitched([phrases[key] for key in keys], download_mp3_path, download_subtitle_path)
+
+	def phrase_key(self, sentence: str) -> str:
+		"""
+		句子级缓存的键，SSML中的空白被规范化，只因换行、缩进不同的句子共用一个缓存项
+		:param sentence: 一个句子
+		:return: 缓存键
+		"""
+		ssml = re.sub(r"\s+", " ", self.pre_SSML(sentence)).strip()
+		return Caches.ArtifactCache.key("tts_phrase", ssml = ssml, **self.synthesis_params())
+
+	def synthesis_params(self) -> dict:
+		"""
+		逐段合成时除api_key与文本之外传给SpeechSynthesizer.call的全部参数，同时是句子级缓存键的一部分，
+		增加或修改合成参数时缓存键随之改变。DashScope的音色由model决定
+		:return: 参数字典
+		"""
+		return dict(model = self.model, sample_rate = self.sample_rate, format = 'pcm', rate = self.rate,
+		            volume = self.volume, word_timestamp_enabled = True)
+
+	@staticmethod
+	def phrase_outputs(directory: str, key: str) -> dict[str, str]:
+		return { "pcm": os.path.join(directory, key + ".pcm"), "timestamps": os.path.join(directory, key + ".json") }
+
+	def write_stitched(self, results: list[tuple[bytes, list]], download_mp3_path: str,
+	                   download_subtitle_path: str) -> None:
+		"""
+		拼接各段的PCM并编码为mp3，同时写入平移后的字幕
+		:param results: 每段的(16位单声道PCM, 时间戳)
+		:param download_mp3_path: 音频的下载路径
+		:param download_subtitle_path: 字幕的下载路径
+		:return: None
+		"""
+		pcm, word_timestamps = self.stitch(results, self.sample_rate)
+
+		(ffmpeg.input("pipe:", f = "s16le", ar = self.sample_rate, ac = 1)
+		 .output(download_mp3_path, acodec = "libmp3lame", audio_bitrate = "192k")
+		 .overwrite_output()
+		 .run(cmd = get_setting("FFMPEG_BINARY"), input = pcm, quiet = True))
+
+		self.write_subtitles(word_timestamps, download_subtitle_path)
+
+	def synthesize_chunk(self, text: str) -> tuple[bytes, list]:
+		"""
+		合成一段文本，失败时重试
+		:param text: 一段文本
+		:return: 16位单声道PCM, 字级时间戳
+		"""
+		for attempt in range(self.retries + 1):
+			result = SpeechSynthesizer.call(api_key = self.api_key, text = self.pre_SSML(text),
+			                                **self.synthesis_params())
+			if result.get_audio_data() is not None:
+				return result.get_audio_data(), result.get_timestamps()
+			logging.warning(f"[DashScopeTTS] Chunk failed (attempt {attempt + 1}): {result.get_response()}")
+		raise Exception(f"[DashScopeTTS] Failed to synthesize chunk after {self.retries + 1} attempts: {text[:20]}")
+
+	@classmethod
+	def split_sentences(cls, text: str, chunk_chars: int) -> list[str]:
+		"""
+		在句子结束的标点处切分文本，并把相邻的句子合并为不超过chunk_chars字的段。单句超过chunk_chars时单独成段
+		:param text: 文本
+		:param chunk_chars: 每段的最大字数
+		:return: 段落列表
+		"""
+		chunks = []
+		for sentence in cls.SENTENCE_END.split(text):
+			sentence = sentence.strip()
+			if not sentence:
+				continue
+			if chunks and len(chunks[-1]) + len(sentence) <= chunk_chars:
+				chunks[-1] += sentence
+			else:
+				chunks.append(sentence)
+		return chunks
+
+	@staticmethod
+	def stitch(results: list[tuple[bytes, list]], sample_rate: int) -> tuple[bytes, list]:
+		"""
+		按顺序拼接各段的PCM，并将每段的句级与字级时间戳平移该段在整段音频中的起始时间。
+		起始时间由之前的采样点总数计算，不会累积各段取整的误差。
+		:param results: 每段的(16位单声道PCM, 时间戳)
+		:param sample_rate: 采样率
+		:return: 拼接后的PCM, 平移后的时间戳
+		"""
+		pcm = bytearray()
+		timestamps = []
+		for audio, sentences in results:
+			offset = len(pcm) // 2 * 1000 // sample_rate
+			pcm += audio[:len(audio) // 2 * 2]
+			for sentence in sentences or []:
+				timestamps.append({ **sentence, "begin_time": sentence["begin_time"] + offset,
+				                    "end_time": sentence["end_time"] + offset,
+				                    "words": [{ **word, "begin_time": word["begin_time"] + offset,
+				                                "end_time": word["end_time"] + offset }
+				                              for word in sentence.get("words", [])] })
+		return bytes(pcm), timestamps
 
 	def pre_SSML(self, text: str) -> str:
 		"""
@@ -285,6 +491,8 @@ class NLSTTS(TextToSpeechAI):
 	Console：https://nls-portal.console.aliyun.com/overview
 	DOC: https://help.aliyun.com/document_detail/130555.html
 	"""
+	poller = TaskPoller("NLSTTS", initial = 2.0, deadline = 600.0)
+	word_timings = True
 
 	def __init__(self):
 		self.appkey = config.TTS_NLS_APPKEY
@@ -302,24 +510,12 @@ class NLSTTS(TextToSpeechAI):
 		logging.debug("[NLS] Got text, text = " + text.replace("\n", " ").strip())
 		task_id = self.create_task(text)
 		logging.debug("[NLS] Created text to speech task,  task_id = " + task_id)
-		error_count = 0
-		while self.parser_response(self.query_task(task_id)) is None:
-			time.sleep(5)
-			error_count += 1
-			logging.debug(f"[NLS] It seems like the task {task_id} is still running, retrying......")
-			if error_count > 10:
-				logging.error("[NLS] Opps, There's an error " + str(self.query_task(task_id)))
-				raise Exception("Opps, There's an error " + str(self.query_task(task_id)))
-
 		# 处理response，获得mp3和time_stamp
-		mp3_link, time_stamps = self.parser_response(self.query_task(task_id))
+		(mp3_link, time_stamps), _ = self.poller.poll(lambda: self.query_task(task_id), self.parser_response)
 		# 下载mp3
-		utils.download(mp3_link, download_mp3_path)
-		# 得到srt字符串
-		srt = self.timestamps_to_srt(time_stamps)
-		# 写入字幕文件
-		with open(download_subtitle_path, "w", encoding = 'utf-8') as f:
-			f.write(srt)
+		utils.download(mp3_link, download_mp3_path, self.http_client)
+		# 写入字幕文件与字级时间戳
+		self.write_subtitles(time_stamps, download_subtitle_path)
 
 	def create_audio_multi(self, text_list: list) -> list:
 		"""
@@ -334,9 +530,17 @@ class NLSTTS(TextToSpeechAI):
 		return download_urls
 
 	def get_access_token(self):
+		"""
+		获取Access Token，在过期前由TokenManager缓存
+		:return: access_token, expire_time
+		"""
+		token = tokens.get("nls", self.AccessKeyID, self.request_access_token)
+		return token, tokens.expires_at("nls", self.AccessKeyID)
+
+	def request_access_token(self) -> tuple[str, float]:
 		"""
 		使用 AK，SK 生成鉴权签名（Access Token）
-		:return: access_token, expire_time，或是None(如果错误)
+		:return: access_token, expire_time（Unix时间戳）
 		"""
 
 		def _encode_text(text):
@@ -377,7 +581,7 @@ class NLSTTS(TextToSpeechAI):
 		full_url = 'http://nls-meta.cn-shanghai.aliyuncs.com/?Signature=%s&%s' % (signature, query_string)
 		print('url: %s' % full_url)
 		# 提交HTTP GET请求
-		response = requests.get(full_url)
+		response = self.http_client.get(full_url)
 		if response.ok:
 			root_obj = response.json()
 			key = 'Token'
@@ -385,8 +589,8 @@ class NLSTTS(TextToSpeechAI):
 				token = root_obj[key]['Id']
 				expire_time = root_obj[key]['ExpireTime']
 				return token, expire_time
-		print(response.text)
-		return None, None
+		logging.error("[NLS] Error at getting access token: " + response.text)
+		raise Exception("[NLS] Error at getting access token: " + response.text)
 
 	def create_task(self, text,
 	                voice="xiaoyun", sample_rate=16000,
@@ -424,7 +628,7 @@ class NLSTTS(TextToSpeechAI):
 			"device_id": "my_device_id",
 		}
 
-		response = requests.request("POST", url, headers = headers, data = payload)
+		response = self.http_client.request("POST", url, headers = headers, data = payload)
 		logging.debug("[BaiduTextToSpeechAI] Posted request, response = " + response.text)
 
 		j = response.json()
@@ -447,8 +651,10 @@ class NLSTTS(TextToSpeechAI):
 		host = { "Host"      : "nls-gateway.cn-shanghai.aliyuncs.com", "Accept": "*/*",
 		         "Connection": "keep-alive", 'Content-Type': 'application/json' }
 
-		response = urllib.request.urlopen(url).read()
-		j = json.loads(response)
+		response = self.http_client.get(url)
+		# 429、5xx带有Retry-After时由TaskPoller等待后重试
+		response.raise_for_status()
+		j = response.json()
 		logging.debug("[NLS] Got response, response = " + str(j))
 		return j
 
@@ -473,27 +679,140 @@ class NLSTTS(TextToSpeechAI):
 		else:
 			raise Exception("[NLS] Error at querying task: " + str(response))
 
-	def timestamps_to_srt(self, timestamps: list) -> str:
-		"""
-		将时间戳数据转换为 srt 文件内容
-		:param timestamps: 时间戳数据列表
-		:return:
-		"""
-		# 解析时间戳数据为 Python 列表
-		data = timestamps
-		# 创建一个空字符串，用于存储 srt 文件内容
-		srt = ""
-		# 遍历时间戳数据中的每个字典
-		for item, i in zip(data, range(0, len(data))):
-			# 获取字典中的段落序号、文本、开始时间和结束时间
-			index = i
-			text = item["text"]
-			start = int(item["begin_time"])
-			end = int(item["end_time"])
-			# 将开始时间和结束时间转换为 srt 格式的时间字符串
-			start_srt = utils.ms_to_srt(start)
-			end_srt = utils.ms_to_srt(end)
-			# 将序号、时间范围、文本和空行拼接到 srt 文件内容中
-			srt += f"{index}\n{start_srt} --> {end_srt}\n{text}\n\n"
-		# 返回 srt 文件内容
-		return srt
+
+class SentenceAssembler:
+	"""
+	把NLS在MetaInfo中逐字推送的时间戳合并为句子。字的begin_index/end_index指向原文，
+	某个字后面紧跟句末标点时，认为一句已经完成，立即回调，不需要等待整篇合成结束。
+	"""
+	SENTENCE_END = "。！？；!?;\n"
+
+	def __init__(self, text: str, on_sentence: Callable[[dict], None] = None):
+		"""
+		:param text: 合成的原文
+		:param on_sentence: 每完成一句调用一次，参数包含begin_time、end_time、sentence_texts与words
+		"""
+		self.text = text
+		self.on_sentence = on_sentence
+		self.sentences: list[dict] = []
+		self.words: list[dict] = []
+		# 已经处理到的原文位置，重复推送的字会被跳过
+		self.consumed = 0
+
+	def feed(self, subtitles: list[dict]) -> None:
+		"""
+		处理一条MetaInfo中的字级时间戳
+		:param subtitles: payload中的subtitles
+		:return: None
+		"""
+		for word in subtitles:
+			if word.get("sentence") or word["end_index"] <= self.consumed:
+				continue
+			self.consumed = word["end_index"]
+			self.words.append(word)
+			if self.ends_sentence(word["end_index"]):
+				self.emit()
+
+	def ends_sentence(self, index: int) -> bool:
+		while index < len(self.text) and self.text[index] in " \t\r":
+			index += 1
+		return index < len(self.text) and self.text[index] in self.SENTENCE_END
+
+	def emit(self) -> None:
+		if not self.words:
+			return
+		sentence = { "begin_time"    : int(self.words[0]["begin_time"]), "end_time": int(self.words[-1]["end_time"]),
+		             "sentence_texts": "".join(word["text"] for word in self.words), "words": self.words }
+		self.words = []
+		self.sentences.append(sentence)
+		if self.on_sentence is not None:
+			self.on_sentence(sentence)
+
+	def finish(self) -> list[dict]:
+		"""
+		合成结束，最后一句可能没有句末标点
+		:return: 所有句子
+		"""
+		self.emit()
+		return self.sentences
+
+
+class NLSStreamingTTS(NLSTTS):
+	"""
+	基于NLS websocket接口（nls.NlsSpeechSynthesizer）的流式语音合成。音频在on_data中边收边写入文件，
+	字幕在每句完成时追加写入，不需要像NLSTTS那样轮询异步任务再下载完整的文件。
+	"""
+	URL = "wss://nls-gateway.cn-shanghai.aliyuncs.com/ws/v1"
+
+	def __init__(self, voice: str = "xiaoyun", sample_rate: int = 16000, long_tts: bool = True,
+	             completed_timeout: int = 600):
+		"""
+		:param voice: 发音人
+		:param sample_rate: 采样率
+		:param long_tts: 是否使用长文本语音合成，短文本接口最多只能合成300字
+		:param completed_timeout: 等待合成结束的最长秒数
+		"""
+		super().__init__()
+		self.voice = voice
+		self.sample_rate = sample_rate
+		self.long_tts = long_tts
+		self.completed_timeout = completed_timeout
+
+	def cache_signature(self) -> dict:
+		return { **super().cache_signature(), "voice": self.voice, "sample_rate": self.sample_rate,
+		         "long_tts": self.long_tts }
+
+	def create_audio_once(self, text: str, download_mp3_path: str, download_subtitle_path: str) -> None:
+		self.create_audio_stream(text, download_mp3_path, download_subtitle_path)
+
+	def create_audio_stream(self, text: str, download_mp3_path: str, download_subtitle_path: str,
+	                        on_sentence: Callable[[dict], None] = None) -> list[dict]:
+		"""
+		流式合成语音。音频边收边写入download_mp3_path，每完成一句就追加到字幕文件并调用on_sentence，
+		下游可以在合成结束之前开始处理已经完成的句子。合成失败时删除不完整的文件。
+		:param text: text
+		:param download_mp3_path: 音频的保存路径
+		:param download_subtitle_path: 字幕的保存路径
+		:param on_sentence: 每完成一句调用一次
+		:return: 句级时间戳，格式与utils.timestamps_to_srt的输入相同，另外包含字级时间戳words
+		"""
+		logging.debug("[NLSStreamingTTS] Got text, text = " + text.replace("\n", " ").strip())
+		errors = []
+		try:
+			with open(download_mp3_path, "wb") as audio, Subtitles.SrtWriter(download_subtitle_path) as srt:
+
+				def sentence_done(sentence):
+					for cue in WordTimings.from_items([sentence]).segment():
+						srt.write(*cue)
+					if on_sentence is not None:
+						on_sentence(sentence)
+
+				assembler = SentenceAssembler(text, sentence_done)
+
+				def on_data(data, *args):
+					audio.write(data)
+					audio.flush()
+
+				def on_metainfo(message, *args):
+					assembler.feed(json.loads(message).get("payload", { }).get("subtitles", []))
+
+				def on_error(message, *args):
+					errors.append(message)
+
+				synthesizer = nls.NlsSpeechSynthesizer(url = self.URL, token = self.get_access_token()[0],
+				                                       appkey = self.appkey, long_tts = self.long_tts,
+				                                       on_metainfo = on_metainfo, on_data = on_data,
+				                                       on_error = on_error)
+				synthesizer.start(text, voice = self.voice, aformat = "mp3", sample_rate = self.sample_rate,
+				                  completed_timeout = self.completed_timeout, ex = { "enable_subtitle": True })
+				if errors:
+					raise Exception("[NLSStreamingTTS] Synthesis failed: " + str(errors[0]))
+				sentences = assembler.finish()
+			WordTimings.from_items(sentences).save(Timings.words_path(download_subtitle_path))
+		except BaseException:
+			for path in (download_mp3_path, download_subtitle_path, Timings.words_path(download_subtitle_path)):
+				if os.path.exists(path):
+					os.remove(path)
+			raise
+		logging.info(f"[NLSStreamingTTS] Synthesized {len(sentences)} sentences to {download_mp3_path}")
+		return sentences
@@ -0,0 +1,222 @@
+"""
+由TTS的字级时间戳生成字幕。各个TTS服务商的时间戳先转换为数组，再按字数上限与标点切分为字幕并预先排好每一行，
+最后一次性写为SRT，视频编辑器渲染时不需要再换行。
+字级时间戳同时保存在字幕旁的.words.json中，视频编辑器可以据此按行显示字幕，或是逐字高亮。
+"""
+import json
+import logging
+import os
+import re
+
+import numpy as np
+
+import Subtitles
+from Subtitles import Cue, CueTable
+
+# 一条字幕的逐字高亮信息：(每个词的开始毫秒数, 到这个词为止的累计字数，不含换行)
+Highlight = tuple[np.ndarray, np.ndarray]
+
+# 句子结束的标点，字幕总是在这里切分
+SENTENCE_END = set("。！？；!?;…")
+# 句中停顿的标点，字幕超过字数上限时优先在这里切分
+CLAUSE_END = set("，、：,:")
+PUNCTUATION = SENTENCE_END | CLAUSE_END | set("”’）》」")
+
+
+class WordTimings:
+	"""
+	字级时间戳。开始、结束毫秒数与每个字（或词）的长度保存在numpy数组中，文本保存在列表中
+	"""
+
+	def __init__(self, texts: list[str], starts, ends):
+		"""
+		:param texts: 每个字或词的文本，按时间顺序
+		:param starts: 开始毫秒数
+		:param ends: 结束毫秒数
+		"""
+		self.texts = texts
+		self.starts = np.asarray(starts, dtype = np.int64)
+		self.ends = np.asarray(ends, dtype = np.int64)
+		self.lengths = np.fromiter((len(text) for text in texts), dtype = np.int64, count = len(texts))
+
+	@classmethod
+	def from_items(cls, items: list[dict]) -> "WordTimings":
+		"""
+		从TTS服务商返回的时间戳创建。包含words的句子（DashScope、NLS流式合成）使用其中的字级时间戳；
+		只有句级时间戳的（百度、NLS长文本合成）整句视为一个词，切分时按字数分配时间
+		:param items: 句级时间戳列表，每一项包含begin_time、end_time，以及words或sentence_texts或text
+		:return: WordTimings
+		"""
+		texts, starts, ends = [], [], []
+		for item in items:
+			words = item.get("words") or [{ "text"    : item.get("sentence_texts", item.get("text", "")),
+			                                "begin_time": item["begin_time"], "end_time": item["end_time"] }]
+			for word in words:
+				if word["text"]:
+					texts.append(word["text"])
+					starts.append(int(word["begin_time"]))
+					ends.append(int(word["end_time"]))
+		return cls(texts, starts, ends)
+
+	def __len__(self) -> int:
+		return len(self.texts)
+
+	def save(self, path: str) -> None:
+		"""
+		保存为JSON
+		:param path: 路径，通常为words_path(字幕路径)
+		:return: None
+		"""
+		with open(path, "w", encoding = "utf-8") as f:
+			json.dump({ "texts": self.texts, "starts": self.starts.tolist(), "ends": self.ends.tolist() }, f,
+			          ensure_ascii = False)
+
+	@classmethod
+	def load(cls, path: str) -> "WordTimings":
+		with open(path, "r", encoding = "utf-8") as f:
+			data = json.load(f)
+		return cls(data["texts"], data["starts"], data["ends"])
+
+	def split_long(self, max_chars: int) -> "WordTimings":
+		"""
+		把超过max_chars字的词切为若干段，每段的时间按字数在原来的时间范围内线性分配
+		:param max_chars: 每段的最大字数
+		:return: 新的WordTimings，没有过长的词时返回自身
+		"""
+		long = np.flatnonzero(self.lengths > max_chars)
+		if len(long) == 0:
+			return self
+		texts, starts, ends = [], [], []
+		previous = 0
+		for i in long:
+			texts.extend(self.texts[previous:i])
+			starts.extend(self.starts[previous:i].tolist())
+			ends.extend(self.ends[previous:i].tolist())
+			bounds = np.arange(0, self.lengths[i] + max_chars, max_chars).clip(max = self.lengths[i])
+			times = self.starts[i] + (self.ends[i] - self.starts[i]) * bounds // self.lengths[i]
+			texts.extend(self.texts[i][a:b] for a, b in zip(bounds[:-1], bounds[1:]))
+			starts.extend(times[:-1].tolist())
+			ends.extend(times[1:].tolist())
+			previous = i + 1
+		texts.extend(self.texts[previous:])
+		starts.extend(self.starts[previous:].tolist())
+		ends.extend(self.ends[previous:].tolist())
+		return WordTimings(texts, starts, ends)
+
+	def boundaries(self, marks: set[str]) -> np.ndarray:
+		"""
+		:param marks: 标点集合
+		:return: 以这些标点结尾的词之后的切分位置，即词的下标加一
+		"""
+		return np.flatnonzero(np.fromiter((text[-1] in marks for text in self.texts), dtype = bool,
+		                                  count = len(self.texts))) + 1
+
+	def segment(self, max_chars: int = 24, line_chars: int = 12) -> list[Cue]:
+		"""
+		切分为字幕：句子结束处总是切分；一句超过max_chars字时，在不超过字数上限的前提下尽量在句中停顿处切分，
+		但不会切出少于一半上限的片段。每条字幕的文本按line_chars字换行，换行位置不会拆开一个词
+		:param max_chars: 每条字幕的最大字数
+		:param line_chars: 每行的最大字数
+		:return: (开始毫秒数, 结束毫秒数, 文本)的列表
+		"""
+		words, spans = self.spans(max_chars, line_chars)
+		return [(int(words.starts[i]), int(words.ends[j - 1]), self.layout(words.texts[i:j], line_chars))
+		        for i, j in spans]
+
+	def highlights(self, max_chars: int = 24, line_chars: int = 12) -> tuple[list[Cue], list[Highlight]]:
+		"""
+		与segment相同地切分字幕，同时返回每条字幕中每个词的开始时间，用于逐字高亮
+		:param max_chars: 每条字幕的最大字数
+		:param line_chars: 每行的最大字数
+		:return: 字幕列表, 与字幕一一对应的高亮信息列表
+		"""
+		words, spans = self.spans(max_chars, line_chars)
+		cues = [(int(words.starts[i]), int(words.ends[j - 1]), self.layout(words.texts[i:j], line_chars))
+		        for i, j in spans]
+		return cues, [(words.starts[i:j], np.cumsum(words.lengths[i:j])) for i, j in spans]
+
+	def spans(self, max_chars: int, line_chars: int) -> tuple["WordTimings", list[tuple[int, int]]]:
+		"""
+		计算切分位置，规则见segment
+		:param max_chars: 每条字幕的最大字数
+		:param line_chars: 每行的最大字数
+		:return: 切开过长的词之后的WordTimings, 每条字幕的[开始, 结束)词下标
+		"""
+		words = self.split_long(min(max_chars, line_chars))
+		n = len(words)
+		# cumulative[i]为前i个词的总字数
+		cumulative = np.concatenate(([0], np.cumsum(words.lengths)))
+		sentence_ends = words.boundaries(SENTENCE_END)
+		clause_ends = words.boundaries(SENTENCE_END | CLAUSE_END)
+		spans = []
+		i = 0
+		while i < n:
+			# 不超过字数上限的最远切分位置
+			j = min(n, max(i + 1, int(np.searchsorted(cumulative, cumulative[i] + max_chars, side = "right")) - 1))
+			k = np.searchsorted(sentence_ends, i, side = "right")
+			if k < len(sentence_ends) and sentence_ends[k] <= j:
+				j = int(sentence_ends[k])
+			elif j < n:
+				k = np.searchsorted(clause_ends, j, side = "right") - 1
+				if k >= 0 and clause_ends[k] > i and cumulative[clause_ends[k]] - cumulative[i] >= max_chars // 2:
+					j = int(clause_ends[k])
+			spans.append((i, j))
+			i = j
+		return words, spans
+
+	@staticmethod
+	def layout(texts: list[str], line_chars: int) -> str:
+		"""
+		把若干词排成每行不超过line_chars字的多行文本
+		:param texts: 词的列表，每个词不超过line_chars字
+		:param line_chars: 每行的最大字数，行末的标点不计入
+		:return: 用\\n连接的文本
+		"""
+		lines = [""]
+		for text in texts:
+			# 单独的标点不放在行首
+			if lines[-1] and len(lines[-1]) + len(text) > line_chars and not is_punctuation(text):
+				lines.append("")
+			lines[-1] += text
+		return "\n".join(lines)
+
+
+def is_punctuation(text: str) -> bool:
+	return all(char in PUNCTUATION for char in text)
+
+
+def words_path(subtitle_path: str) -> str:
+	"""
+	:return: 字幕对应的字级时间戳文件路径，例如 subtitle.srt -> subtitle.words.json
+	"""
+	return os.path.splitext(subtitle_path)[0] + ".words.json"
+
+
+def load_words(subtitle_path: str, cues: CueTable) -> WordTimings:
+	"""
+	读取字幕对应的字级时间戳。没有.words.json，或其中的文本与字幕不一致（例如字幕被其他TTS重新生成）时，
+	由字幕本身推算：每条字幕视为一个词，切分时按字数分配时间
+	:param subtitle_path: 字幕路径
+	:param cues: 字幕
+	:return: WordTimings
+	"""
+	path = words_path(subtitle_path)
+	expected = re.sub(r"\s", "", "".join(text for _, _, text in cues))
+	if os.path.exists(path):
+		words = WordTimings.load(path)
+		if re.sub(r"\s", "", "".join(words.texts)) == expected:
+			return words
+		logging.warning(f"[Timings] {path} does not match {subtitle_path}, using the subtitle timings")
+	return WordTimings.from_items([{ "begin_time": start, "end_time": end, "text": re.sub(r"\s", "", text) }
+	                               for start, end, text in cues])
+
+
+def timestamps_to_srt(items: list[dict], max_chars: int = 24, line_chars: int = 12) -> str:
+	"""
+	将TTS服务商返回的时间戳转换为SRT文件内容
+	:param items: 句级时间戳列表，见WordTimings.from_items
+	:param max_chars: 每条字幕的最大字数
+	:param line_chars: 每行的最大字数
+	:return: SRT文件内容
+	"""
+	return Subtitles.write_srt(WordTimings.from_items(items).segment(max_chars, line_chars))
@@ -0,0 +1,126 @@
+"""
+百度、阿里云等服务的Access Token缓存，进程内所有服务商对象共用
+"""
+import logging
+import threading
+import time
+from typing import Callable
+
+import Sessions
+from Sessions import HttpClient
+
+logging.basicConfig(format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s-%(funcName)s',
+                    level = logging.DEBUG)
+
+
+class TokenManager:
+	"""
+	按(服务商, key id)缓存Access Token，直到其过期前margin秒。
+	距离过期不足refresh_ahead秒时，使用中的token照常返回，同时在后台线程中获取新token；
+	没有可用token时在调用线程中获取，同一个key同时只有一个线程在获取，其余线程等待其结果。
+	"""
+
+	def __init__(self, margin: float = 60.0, refresh_ahead: float = 600.0, clock: Callable[[], float] = time.time):
+		"""
+		:param margin: 提前视为过期的秒数，避免token在请求途中过期
+		:param refresh_ahead: 在过期前多少秒开始后台刷新
+		:param clock: 返回Unix时间戳的时钟，测试时可以替换
+		"""
+		self.margin = margin
+		self.refresh_ahead = refresh_ahead
+		self.clock = clock
+		# (服务商, key id) -> [token, 过期的Unix时间戳]
+		self.tokens: dict[tuple[str, str], list] = { }
+		self.locks: dict[tuple[str, str], threading.Lock] = { }
+		self.refreshing: set[tuple[str, str]] = set()
+		self.fetches = 0
+		self._lock = threading.Lock()
+
+	def get(self, provider: str, key_id: str, fetch: Callable[[], tuple[str, float]]) -> str:
+		"""
+		获取token
+		:param provider: 服务商，例如baidu、nls
+		:param key_id: 区分同一服务商的不同账号，例如API Key或AccessKey ID，不要传入密钥
+		:param fetch: 向服务端请求新token，返回(token, 过期的Unix时间戳)，失败时抛出异常
+		:return: token
+		"""
+		key = (provider, key_id)
+		with self._lock:
+			cached = self.tokens.get(key)
+			lock = self.locks.setdefault(key, threading.Lock())
+		now = self.clock()
+		if cached is not None and now < cached[1] - self.margin:
+			if now >= cached[1] - self.refresh_ahead:
+				self.refresh_in_background(key, fetch)
+			return cached[0]
+		with lock:
+			# 等待锁的过程中其他线程可能已经获取了新token
+			with self._lock:
+				cached = self.tokens.get(key)
+			if cached is not None and self.clock() < cached[1] - self.margin:
+				return cached[0]
+			return self.fetch(key, fetch)
+
+	def expires_at(self, provider: str, key_id: str) -> float | None:
+		"""
+		:return: 缓存的token过期的Unix时间戳，没有缓存时返回None
+		"""
+		with self._lock:
+			cached = self.tokens.get((provider, key_id))
+		return cached[1] if cached is not None else None
+
+	def invalidate(self, provider: str, key_id: str) -> None:
+		"""
+		丢弃缓存的token，例如服务端返回token失效时，下一次get会重新获取
+		"""
+		with self._lock:
+			self.tokens.pop((provider, key_id), None)
+
+	def fetch(self, key: tuple[str, str], fetch: Callable[[], tuple[str, float]]) -> str:
+		token, expires_at = fetch()
+		with self._lock:
+			self.tokens[key] = [token, expires_at]
+			self.fetches += 1
+		logging.info(f"[TokenManager] Got a new token for {key[0]}, expires at "
+		             f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(expires_at))}")
+		return token
+
+	def refresh_in_background(self, key: tuple[str, str], fetch: Callable[[], tuple[str, float]]) -> None:
+		with self._lock:
+			if key in self.refreshing:
+				return
+			self.refreshing.add(key)
+
+		def refresh():
+			try:
+				with self.locks[key]:
+					self.fetch(key, fetch)
+			except Exception as e:
+				# 旧token在过期前仍然可用，下一次get会再次尝试
+				logging.warning(f"[TokenManager] Background refresh for {key[0]} failed: {e}")
+			finally:
+				with self._lock:
+					self.refreshing.discard(key)
+
+		threading.Thread(target = refresh, name = f"token-refresh-{key[0]}", daemon = True).start()
+
+
+def fetch_baidu_token(api_key: str, secret_key: str, http_client: HttpClient = None) -> tuple[str, float]:
+	"""
+	使用 AK，SK 生成鉴权签名（Access Token），文心一言、百度画图与百度语音合成共用
+	:param api_key: API Key
+	:param secret_key: Secret Key
+	:param http_client: 发送请求使用的连接池，为None时使用Sessions.client
+	:return: (access_token, 过期的Unix时间戳)
+	"""
+	url = "https://aip.baidubce.com/oauth/2.0/token"
+	params = { "grant_type": "client_credentials", "client_id": api_key, "client_secret": secret_key }
+	response = (http_client or Sessions.client).post(url, params = params).json()
+	if "access_token" not in response:
+		logging.error("[TokenManager] Error at getting baidu access token: " + str(response))
+		raise Exception("Error at getting baidu access token: " + str(response))
+	return str(response["access_token"]), time.time() + float(response["expires_in"])
+
+
+# 进程内共用的实例
+tokens = TokenManager()
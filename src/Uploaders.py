@@ -88,12 +88,12 @@ class DouyinNewsUploader(Uploader):
 		:param video_script: 视频脚本
 		:return: 视频描述
 		"""
-		douyin_description = chat_ai.ask_once(
+		douyin_description = chat_ai.ask_limited(
 				f"{video_script}\n\n对于以上文稿，写一个适合抖音的视频描述，可以使用#标上话题， 回答以“以下为视频描述：”开头：")
 
 		# 如果没有以下字样，则继续对话
 		while not "：\n" in douyin_description:
-			douyin_description = chat_ai.ask_once(
+			douyin_description = chat_ai.ask_limited(
 					f"{video_script}\n\n对于以上演播稿，写一个适合抖音的视频描述，可以使用#标上话题， 回答以“以下为视频描述：”开头：")
 			time.sleep(5)
 
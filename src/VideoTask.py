@@ -1,18 +1,87 @@
 """
 视频任务管理类
 """
+import logging
 
+import ChatAIs
 import Data
 from Data import VideoTask, News
 
+logging.basicConfig(format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s-%(funcName)s',
+                    level = logging.DEBUG)
+
+# 视频栏目分类，与VideoTask.category的枚举相同
+CATEGORIES = ['社会民生', '国际风云', '科技前沿', '生活百态', '体育风暴']
+
+
+def classify(news: News, chat_ai: ChatAIs.ChatAI) -> str | None:
+	"""
+	让AI判断新闻属于哪个栏目
+	:param news: 新闻
+	:param chat_ai: 对话AI
+	:return: 栏目名称，不适合生成视频时返回None
+	"""
+	answer = chat_ai.ask_limited(f"{news.title}\n{news.content[:1000]}\n\n"
+	                             f"以上新闻属于以下哪个栏目：{'、'.join(CATEGORIES)}？"
+	                             f"如果不适合制作成新闻视频，请回答“不适合”。只回答栏目名称。")
+	for category in CATEGORIES:
+		if category in answer:
+			return category
+	return None
+
 
 # 查询视频任务
-def create_task(id: int, force: bool = False) -> VideoTask | None:
+def create_task(id: int, force: bool = False, chat_ai: ChatAIs.ChatAI = None) -> VideoTask | None:
 	"""
-	从数据库中，拿到第id个新闻数据，首先交给AI判断，将其进行栏目分类，如果这个新闻不适合生成视频，则跳过，返回一个None否则，将它创建为视频任务，写进数据库中，并且返回None。
+	从数据库中，拿到第id个新闻数据，首先交给AI判断，将其进行栏目分类，如果这个新闻不适合生成视频，则跳过，返回None；
+	否则，将它创建为视频任务，写进数据库中，并且返回这个视频任务。
+	无论是否创建，新闻都会被标记为已处理并释放租约，不会再被claim_news领取；新闻已经被其他worker领取时抛出Data.LeaseLost，
+	视频任务不会写入。
 	:param id: 新闻id
 	:param force: 是否强制创建视频任务，不管AI判断如何
-	:return:
+	:param chat_ai: 用于栏目分类的对话AI，为None时使用通义千问
+	:return: 视频任务，或None
 	"""
 	# 从数据库中拿到第id个新闻对象
 	news: News = Data.get_news(id)
+	if news is None:
+		logging.warning(f"[VideoTask] News {id} does not exist")
+		return None
+	category = classify(news, chat_ai or ChatAIs.Qwen())
+	if category is None and not force:
+		logging.info(f"[VideoTask] News {id} is not suitable for a video, skipped")
+		Data.complete_news(news)
+		return None
+	task = VideoTask(news_id = news.id, title = news.title, category = category, is_rendered = False,
+	                 is_published = False)
+	Data.session.add(task)
+	Data.complete_news(news)
+	return task
+
+
+def create_tasks(count: int = 10, worker: str = None, chat_ai: ChatAIs.ChatAI = None) -> list[VideoTask]:
+	"""
+	领取最多count条还没有被创建成为视频任务的新闻，逐条创建视频任务。多个worker同时执行时不会处理同一条新闻，
+	创建失败的新闻会释放租约，留给之后重试
+	:param count: 最多领取的新闻条数
+	:param worker: 领取者，为None时使用Data.worker_id()
+	:param chat_ai: 用于栏目分类的对话AI，为None时使用通义千问
+	:return: 创建的视频任务
+	"""
+	chat_ai = chat_ai or ChatAIs.Qwen()
+	tasks = []
+	for news in Data.claim_news(count, worker = worker):
+		try:
+			task = create_task(news.id, chat_ai = chat_ai)
+		except Data.LeaseLost as e:
+			# 处理时间超过了租约，新闻已经由其他worker处理，这里的视频任务没有写入
+			logging.warning(f"[VideoTask] {e}")
+			continue
+		except Exception as e:
+			logging.error(f"[VideoTask] Failed to create a task for news {news.id}: {e!r}")
+			Data.session.rollback()
+			Data.release(news)
+			continue
+		if task is not None:
+			tasks.append(task)
+	return tasks
@@ -1,9 +1,33 @@
+import argparse
+import contextlib
+import logging
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import Caches
+import MovieEditors
+import FFMpegMovieEditor
+import Pipelines
+import Spiders
+import TTSAIs
 import utils
 from Directors import NewsDirector
 
-if __name__ == '__main__':
+
+def director_kwargs(editor: MovieEditors.MovieEditor = None, tts_ai: TTSAIs.TextToSpeechAI = None) -> dict:
+	"""
+	:return: NewsDirector的参数，为None的参数使用NewsDirector的默认值
+	"""
+	return { name: value for name, value in (("editor", editor), ("tts_ai", tts_ai)) if value is not None }
+
+
+def run_daily(editor: MovieEditors.MovieEditor = None, tts_ai: TTSAIs.TextToSpeechAI = None):
+	"""
+	每天生成并上传一期视频
+	:param editor: 视频编辑器，为None时使用NewsDirector的默认编辑器
+	:param tts_ai: 语音合成AI，为None时使用NewsDirector的默认语音合成AI
+	:return: None
+	"""
 	while True:
 		config = utils.get_config()
 		# 检测是否到达新的一天
@@ -17,7 +41,7 @@ if __name__ == '__main__':
 		# 	time.sleep(60 * 30)
 		print("开始运行")
 
-		director = NewsDirector()
+		director = NewsDirector(**director_kwargs(editor, tts_ai))
 		director.fetch_video_material()
 		director.render_video(fps = 30)
 		director.upload_video()
@@ -25,3 +49,96 @@ if __name__ == '__main__':
 		# 记录最后成功生成的日期
 		config["last_date"] = time.strftime("%Y_%m_%d", time.localtime())
 		utils.write_config(config)
+
+
+def run_batch(count: int, source: str = "zhihu", upload: bool = False, fps=30, limits: dict[str, int] = None,
+              editor: MovieEditors.MovieEditor = None, tts_ai: TTSAIs.TextToSpeechAI = None) -> int:
+	"""
+	批量生产多期视频。每条新闻由一个NewsDirector负责，所有导演共享按阶段划分的执行池：
+	llm、tts、draw阶段的并发数受服务商配额限制，render阶段在进程池中执行，并发数随CPU核数扩展。
+	:param count: 生产的期数
+	:param source: 新闻来源，zhihu为知乎热榜，db为news表中还没有被创建成为视频的新闻
+	:param upload: 渲染完成后是否上传
+	:param fps: 渲染帧率
+	:param limits: 各阶段的并发上限，见Pipelines.StagePools.DEFAULT_LIMITS
+	:param editor: 视频编辑器，为None时使用NewsDirector的默认编辑器
+	:param tts_ai: 语音合成AI，为None时使用NewsDirector的默认语音合成AI
+	:return: 成功生产的期数
+	"""
+	if source == "db":
+		import Data
+		# 领取新闻，多个进程同时批量生产时不会重复；生产期间在后台续约，失败的新闻立即释放
+		rows = Data.claim_news(count)
+		leases = Data.keep_leases(rows)
+		news_list = [{ "title": row.title, "content": row.content } for row in rows]
+	else:
+		rows = None
+		leases = contextlib.nullcontext()
+		news_list = Spiders.ZhihuHotSpider().get_news_list()[:count]
+	logging.info(f"[main] Batch producing {len(news_list)} episodes from {source}")
+
+	directors = [NewsDirector(date_path = utils.get_today_dir(episode = i + 1), news = news,
+	                          **director_kwargs(editor, tts_ai))
+	             for i, news in enumerate(news_list)]
+	succeeded = 0
+	with leases, Pipelines.StagePools(limits) as pools, \
+			ThreadPoolExecutor(max_workers = max(1, len(directors)), thread_name_prefix = "episode") as episodes:
+		futures = { episodes.submit(director.build_production_graph(fps = fps, upload = upload).run, pools): i
+		            for i, director in enumerate(directors) }
+		for future in as_completed(futures):
+			i = futures[future]
+			try:
+				future.result()
+			except Exception as e:
+				logging.error(f"[main] Episode {directors[i].date_path} failed: {e!r}")
+				if rows is not None:
+					Data.release(rows[i])
+				continue
+			succeeded += 1
+			if rows is not None:
+				try:
+					Data.complete_news(rows[i])
+				except Data.LeaseLost as e:
+					logging.warning(f"[main] {e}")
+	logging.info(f"[main] Batch finished, {succeeded}/{len(directors)} episodes succeeded")
+	return succeeded
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = "AutoVideo")
+	parser.add_argument("--batch", type = int, default = 0, help = "批量生产的期数，为0时按天生产")
+	parser.add_argument("--source", choices = ["zhihu", "db"], default = "zhihu", help = "批量生产的新闻来源")
+	parser.add_argument("--upload", action = "store_true", help = "批量生产时渲染完成后上传")
+	parser.add_argument("--fps", type = int, default = 30)
+	parser.add_argument("--editor", choices = ["moviepy", "ffmpeg"], default = "moviepy",
+	                    help = "视频编辑器，ffmpeg完全在ffmpeg滤镜图中渲染")
+	parser.add_argument("--still-segments", action = "store_true",
+	                    help = "按静止片段渲染，每条字幕只编码一帧，输出可变帧率视频")
+	parser.add_argument("--line-subtitles", action = "store_true",
+	                    help = "按行显示字幕，每次只显示正在朗读的一行，时间来自配音的字级时间戳")
+	parser.add_argument("--highlight-words", action = "store_true", help = "逐字高亮字幕中已经读到的字")
+	parser.add_argument("--tts-phrase-cache", action = "store_true",
+	                    help = "DashScope逐句合成配音，重复的句子从../cache/phrases/读取")
+	parser.add_argument("--tts-chunk-chars", type = int, default = None,
+	                    help = "DashScope在句子边界分为不超过这个字数的段并发合成，再拼接为一条配音")
+	for stage in ("llm", "tts", "draw", "render"):
+		parser.add_argument(f"--{stage}-workers", type = int, default = None, help = f"{stage}阶段的并发上限")
+	args = parser.parse_args()
+	if args.editor == "ffmpeg":
+		movie_editor = FFMpegMovieEditor.FFMpegMovieEditor(line_windows = args.line_subtitles,
+		                                                   highlight_words = args.highlight_words)
+	else:
+		movie_editor = MovieEditors.MovieEditor(still_segments = args.still_segments, line_windows = args.line_subtitles,
+		                                        highlight_words = args.highlight_words)
+	tts = None
+	if args.tts_phrase_cache or args.tts_chunk_chars:
+		phrase_cache = Caches.ArtifactCache("../cache/phrases/", max_bytes = 1024 ** 3) if args.tts_phrase_cache else None
+		tts = TTSAIs.DashScopeTTS(chunk_chars = args.tts_chunk_chars, phrase_cache = phrase_cache)
+
+	if args.batch > 0:
+		stage_limits = { stage: getattr(args, f"{stage}_workers") for stage in ("llm", "tts", "draw", "render")
+		                 if getattr(args, f"{stage}_workers") is not None }
+		run_batch(args.batch, source = args.source, upload = args.upload, fps = args.fps, limits = stage_limits,
+		          editor = movie_editor, tts_ai = tts)
+	else:
+		run_daily(editor = movie_editor, tts_ai = tts)
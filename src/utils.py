@@ -2,18 +2,33 @@ import json
 import os
 import time
 
+import Subtitles
+import Timings
+from Downloads import Downloader
+from Sessions import HttpClient
 
-def download(url: str, position: str):
+
+def download(url: str, position: str, http_client: HttpClient = None, sha256: str = None):
 	"""
-	下载文件
+	下载文件，流式写入临时文件，中断时断点续传，完成并校验后重命名为position
 	:param url:下载链接
 	:param position:路径
+	:param http_client: 发送请求使用的连接池，为None时使用Sessions.client
+	:param sha256: 期望的sha256，为None时只检查长度
 	:return:
 	"""
-	import requests as re
-	file = re.get(url)
-	with open(position, 'wb') as f:
-		f.write(file.content)
+	Downloader(http_client).download(url, position, sha256 = sha256)
+
+
+def download_many(items: list[tuple[str, str]], http_client: HttpClient = None, concurrency: int = 4) -> list[str]:
+	"""
+	同时下载多个文件
+	:param items: (下载链接, 路径)的列表
+	:param http_client: 发送请求使用的连接池，为None时使用Sessions.client
+	:param concurrency: 同时进行的下载数
+	:return: 路径的列表
+	"""
+	return Downloader(http_client, concurrency = concurrency).download_many(items)
 
 
 def ms_to_srt(ms) -> str:
@@ -22,39 +37,16 @@ def ms_to_srt(ms) -> str:
 	:param ms:
 	:return:
 	"""
-	# 计算小时、分钟、秒和毫秒
-	hours = ms // (1000 * 60 * 60)
-	minutes = (ms % (1000 * 60 * 60)) // (1000 * 60)
-	seconds = (ms % (1000 * 60)) // 1000
-	milliseconds = ms % 1000
-	# 返回格式化的时间字符串，补齐两位数和三位数
-	return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
+	return Subtitles.format_srt_time(ms)
 
 
 def timestamps_to_srt(timestamps: list) -> str:
 	"""
-	将时间戳数据转换为 srt 文件内容
-	:param timestamps: 时间戳数据列表
+	将TTS服务商返回的时间戳转换为 srt 文件内容，按字数与标点切分字幕并预先换行
+	:param timestamps: 时间戳数据列表，每一项包含begin_time、end_time，以及字级时间戳words或句子文本sentence_texts/text
 	:return:
 	"""
-	# 解析时间戳数据为 Python 列表
-	data = timestamps
-	# 创建一个空字符串，用于存储 srt 文件内容
-	srt = ""
-	# 遍历时间戳数据中的每个字典
-	for item, i in zip(data, range(0, len(data))):
-		# 获取字典中的段落序号、文本、开始时间和结束时间
-		index = i
-		text = item["sentence_texts"]
-		start = int(item["begin_time"])
-		end = int(item["end_time"])
-		# 将开始时间和结束时间转换为 srt 格式的时间字符串
-		start_srt = ms_to_srt(start)
-		end_srt = ms_to_srt(end)
-		# 将序号、时间范围、文本和空行拼接到 srt 文件内容中
-		srt += f"{index}\n{start_srt} --> {end_srt}\n{text}\n\n"
-	# 返回 srt 文件内容
-	return srt
+	return Timings.timestamps_to_srt(timestamps)
 
 
 def date_str():
@@ -67,9 +59,11 @@ def date_str():
 	return time.strftime("%Y年%m月%d日", time.localtime()) + " " + weekday
 
 
-def get_today_dir():
+def get_today_dir(episode: int = None):
 	"""
 	获取今天的文件夹路径
+	:param episode: 批量生产时的第几期，为None时返回当天唯一一期的文件夹，例如 ../daily/2023_11_20/；
+	                否则返回 ../daily/2023_11_20_01/ 这样带期号的文件夹
 	:return:
 	"""
 	dir = "../daily/"
@@ -77,6 +71,8 @@ def get_today_dir():
 		os.mkdir(dir)
 	date = time.strftime("%Y_%m_%d", time.localtime())
 	today_folder = dir + date
+	if episode is not None:
+		today_folder += f"_{episode:02d}"
 	if not os.path.exists(today_folder):
 		os.mkdir(today_folder)
 	if not os.path.exists(today_folder + "/input"):
@@ -108,21 +104,21 @@ def add_cnt():
 	write_config(cfg)
 
 
-def save_tts_mp3(url):
-	download(url, get_today_dir() + "/input/tts.mp3")
+def save_tts_mp3(url, path=None):
+	download(url, path or get_today_dir() + "/input/tts.mp3")
 
 
-def save_background(url):
-	download(url, get_today_dir() + "/input/background.png")
+def save_background(url, path=None):
+	download(url, path or get_today_dir() + "/input/background.png")
 
 
-def save_srt(txt):
-	with open(get_today_dir() + "/input/subtitle.srt", 'w', encoding = 'utf-8') as f:
+def save_srt(txt, path=None):
+	with open(path or get_today_dir() + "/input/subtitle.srt", 'w', encoding = 'utf-8') as f:
 		f.write(txt)
 
 
-def save_script(txt):
-	with open(get_today_dir() + "/input/script.txt", 'w', encoding = 'utf-8') as f:
+def save_script(txt, path=None):
+	with open(path or get_today_dir() + "/input/script.txt", 'w', encoding = 'utf-8') as f:
 		f.write(txt)
 
 
@@ -131,8 +127,8 @@ def read_script(script_path):
 		return f.read()
 
 
-def save_description(txt):
-	with open(get_today_dir() + "/input/description.json", 'w', encoding = 'utf-8') as f:
+def save_description(txt, path=None):
+	with open(path or get_today_dir() + "/input/description.json", 'w', encoding = 'utf-8') as f:
 		f.write(txt)
 
 
@@ -0,0 +1,191 @@
+"""
+渲染基准测试。使用daily/2023_11_20/input中的素材，按不同的时长、分辨率与帧率，分别用每个视频编辑器渲染，
+记录耗时、CPU时间、内存峰值与输出文件大小，结果保存为JSON，并可以与之前的结果比较以发现性能回退。
+每个用例在独立的子进程中执行，内存峰值不会互相影响。
+
+用法（在tests目录下）：
+	PYTHONPATH=../src python bench_render.py --durations 10 30 --resolutions 1080x2400 --fps 30
+	PYTHONPATH=../src python bench_render.py --output new.json --baseline old.json --threshold 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+FIXTURE_DIR = "../daily/2023_11_20/input/"
+BACKENDS = ("moviepy", "moviepy-still", "ffmpeg")
+
+
+def create_editor(backend: str):
+	"""
+	创建基准测试使用的视频编辑器
+	:param backend: 编辑器名称，见BACKENDS
+	:return: MovieEditor
+	"""
+	if backend == "ffmpeg":
+		from FFMpegMovieEditor import FFMpegMovieEditor
+		return FFMpegMovieEditor()
+	from MovieEditors import MovieEditor
+	return MovieEditor(still_segments = backend == "moviepy-still")
+
+
+def prepare_fixture(workdir: str, duration: int, resolution: tuple[int, int]) -> dict:
+	"""
+	将素材裁剪为指定时长、缩放为指定分辨率，并生成一段背景音乐。素材准备不计入渲染耗时。
+	:param workdir: 素材输出目录
+	:param duration: 视频时长，单位秒
+	:param resolution: (宽, 高)
+	:return: create_subtitled_video的素材路径参数
+	"""
+	from PIL import Image
+	from moviepy.config import get_setting
+	import Subtitles
+
+	ffmpeg_binary = get_setting("FFMPEG_BINARY")
+	paths = { name: os.path.join(workdir, name) for name in ("background.png", "tts.mp3", "bgm.mp3", "subtitle.srt") }
+	Image.open(FIXTURE_DIR + "background_blured.png").convert("RGB").resize(resolution).save(paths["background.png"])
+	subprocess.run([ffmpeg_binary, "-loglevel", "error", "-y", "-i", FIXTURE_DIR + "tts.mp3", "-t", str(duration),
+	                "-c", "copy", paths["tts.mp3"]], check = True)
+	subprocess.run([ffmpeg_binary, "-loglevel", "error", "-y", "-f", "lavfi", "-i", f"sine=f=220:d={duration + 5}",
+	                paths["bgm.mp3"]], check = True)
+	cues = Subtitles.read_cues(FIXTURE_DIR + "subtitle.srt")
+	with open(paths["subtitle.srt"], "w", encoding = "utf-8") as f:
+		f.write(Subtitles.write_srt((start, min(end, duration * 1000), text) for start, end, text in cues
+		                            if start < duration * 1000))
+	return { "background_path": paths["background.png"], "audio_path": paths["tts.mp3"],
+	         "bgm_path"       : paths["bgm.mp3"], "subtitle_path": paths["subtitle.srt"] }
+
+
+def run_case(case: dict) -> dict:
+	"""
+	在当前进程中渲染一个用例，由子进程调用
+	:param case: 用例，包含backend、fps、素材路径与输出路径
+	:return: 测量结果
+	"""
+	editor = create_editor(case["backend"])
+	start = time.perf_counter()
+	editor.create_subtitled_video(case["background_path"], case["audio_path"], case["output_path"],
+	                              case["subtitle_path"], case["bgm_path"], fps = case["fps"])
+	wall = time.perf_counter() - start
+	# 渲染过程中启动的ffmpeg子进程也计入CPU时间与内存峰值
+	own = resource.getrusage(resource.RUSAGE_SELF)
+	children = resource.getrusage(resource.RUSAGE_CHILDREN)
+	return {
+		"wall_seconds": wall,
+		"cpu_seconds" : own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime,
+		"peak_rss_kb" : max(own.ru_maxrss, children.ru_maxrss),
+		"output_bytes": os.path.getsize(case["output_path"]),
+	}
+
+
+def measure(case: dict, repeat: int = 1) -> dict:
+	"""
+	在独立的子进程中执行用例，重复多次时保留耗时最短的一次
+	:param case: 用例
+	:param repeat: 重复次数
+	:return: 测量结果，失败时包含error
+	"""
+	best = None
+	for _ in range(repeat):
+		if os.path.exists(case["output_path"]):
+			os.remove(case["output_path"])
+		process = subprocess.run([sys.executable, __file__, "--case", json.dumps(case)], capture_output = True,
+		                         text = True)
+		if process.returncode != 0:
+			return { "error": process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "unknown" }
+		result = json.loads(process.stdout.strip().splitlines()[-1])
+		if best is None or result["wall_seconds"] < best["wall_seconds"]:
+			best = result
+	return best
+
+
+def case_key(result: dict) -> tuple:
+	return result["backend"], result["duration"], result["resolution"], result["fps"]
+
+
+def compare(results: list[dict], baseline: list[dict], threshold: float) -> list[str]:
+	"""
+	与之前的结果比较，耗时或内存峰值超过基线(1 + threshold)倍的用例视为回退
+	:param results: 本次的结果
+	:param baseline: 之前的结果
+	:param threshold: 允许的增长比例
+	:return: 回退说明的列表
+	"""
+	previous = { case_key(result): result for result in baseline if "error" not in result }
+	regressions = []
+	for result in results:
+		old = previous.get(case_key(result))
+		if old is None or "error" in result:
+			continue
+		for metric in ("wall_seconds", "peak_rss_kb"):
+			if result[metric] > old[metric] * (1 + threshold):
+				regressions.append(f"{case_key(result)} {metric}: {old[metric]:.2f} -> {result[metric]:.2f}")
+	return regressions
+
+
+def environment() -> dict:
+	"""
+	记录结果时的运行环境，便于比较不同机器上的结果
+	"""
+	from moviepy.config import get_setting
+	ffmpeg_version = subprocess.run([get_setting("FFMPEG_BINARY"), "-version"], capture_output = True,
+	                                text = True).stdout.split("\n")[0]
+	commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True, text = True).stdout.strip()
+	return { "python"   : platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count(),
+	         "ffmpeg"   : ffmpeg_version, "commit": commit,
+	         "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()) }
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(description = "渲染基准测试")
+	parser.add_argument("--backends", nargs = "+", choices = BACKENDS, default = list(BACKENDS))
+	parser.add_argument("--durations", nargs = "+", type = int, default = [10, 30, 60], help = "视频时长，单位秒")
+	parser.add_argument("--resolutions", nargs = "+", default = ["1080x2400", "1440x3200"], help = "宽x高")
+	parser.add_argument("--fps", nargs = "+", type = int, default = [24, 30])
+	parser.add_argument("--repeat", type = int, default = 1, help = "每个用例的重复次数，取耗时最短的一次")
+	parser.add_argument("--output", default = "bench_render.json", help = "结果文件")
+	parser.add_argument("--baseline", default = None, help = "用于比较的之前的结果文件")
+	parser.add_argument("--threshold", type = float, default = 0.2, help = "视为回退的增长比例")
+	parser.add_argument("--case", default = None, help = argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.case is not None:
+		print(json.dumps(run_case(json.loads(args.case))))
+		return 0
+
+	results = []
+	with tempfile.TemporaryDirectory(prefix = "bench-render-") as workdir:
+		for duration in args.durations:
+			for resolution in args.resolutions:
+				fixture_dir = os.path.join(workdir, f"{duration}s-{resolution}")
+				os.makedirs(fixture_dir)
+				width, height = map(int, resolution.split("x"))
+				fixture = prepare_fixture(fixture_dir, duration, (width, height))
+				for fps in args.fps:
+					for backend in args.backends:
+						case = { "backend"    : backend, "duration": duration, "resolution": resolution, "fps": fps,
+						         "output_path": os.path.join(fixture_dir, f"{backend}-{fps}.mp4"), **fixture }
+						result = { "backend": backend, "duration": duration, "resolution": resolution, "fps": fps,
+						           **measure(case, args.repeat) }
+						results.append(result)
+						print(json.dumps(result, ensure_ascii = False), flush = True)
+
+	with open(args.output, "w", encoding = "utf-8") as f:
+		json.dump({ "environment": environment(), "results": results }, f, ensure_ascii = False, indent = 4)
+
+	if args.baseline is not None:
+		with open(args.baseline, "r", encoding = "utf-8") as f:
+			regressions = compare(results, json.load(f)["results"], args.threshold)
+		for regression in regressions:
+			print(f"REGRESSION {regression}")
+		return 1 if regressions else 0
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
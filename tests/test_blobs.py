@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+
+from Blobs import BlobStore, LocalBlobBackend, sniff_mime
+
+
+class TestBlobStore(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.TemporaryDirectory()
+		self.backend = LocalBlobBackend(os.path.join(self.dir.name, "blobs"))
+		self.store = BlobStore(self.backend, chunk_size = 4)
+
+	def tearDown(self):
+		self.dir.cleanup()
+
+	def test_put_bytes(self):
+		ref = self.store.put_bytes(b"\x89PNG\r\n\x1a\n" + b"0" * 10)
+		self.assertEqual(ref.size, 18)
+		self.assertEqual(ref.mime, "image/png")
+		self.assertEqual(self.store.read(ref.sha256), b"\x89PNG\r\n\x1a\n" + b"0" * 10)
+		# 相同内容只保存一份
+		self.assertEqual(self.store.put_bytes(b"\x89PNG\r\n\x1a\n" + b"0" * 10), ref)
+		self.assertEqual(len(os.listdir(os.path.join(self.dir.name, "blobs", ref.sha256[:2]))), 1)
+
+	def test_put_file(self):
+		path = os.path.join(self.dir.name, "video.mp4")
+		with open(path, "wb") as f:
+			f.write(b"0123456789")
+		ref = self.store.put_file(path)
+		self.assertEqual(ref.mime, "video/mp4")
+		self.assertEqual(ref, self.store.put_bytes(b"0123456789", "video/mp4"))
+		self.assertEqual(list(self.store.iter_chunks(ref.sha256)), [b"0123", b"4567", b"89"])
+		output = os.path.join(self.dir.name, "output.mp4")
+		self.assertEqual(self.store.copy_to(ref.sha256, output), output)
+		with open(output, "rb") as f:
+			self.assertEqual(f.read(), b"0123456789")
+
+	def test_missing(self):
+		with self.assertRaises(FileNotFoundError):
+			self.store.read("0" * 64)
+
+	def test_sniff_mime(self):
+		self.assertEqual(sniff_mime(b"\xff\xd8\xff\xe0"), "image/jpeg")
+		self.assertEqual(sniff_mime(b"RIFF\x00\x00\x00\x00WAVEfmt "), "audio/wav")
+		self.assertEqual(sniff_mime(b"\x00\x00\x00\x18ftypmp42"), "video/mp4")
+		self.assertIsNone(sniff_mime(b"plain"))
+
+
+if __name__ == '__main__':
+	unittest.main()
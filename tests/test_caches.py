@@ -0,0 +1,67 @@
+import os
+import pickle
+import tempfile
+import time
+import unittest
+
+from Caches import ArtifactCache, ArtifactManifest
+
+
+class TestArtifactCache(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.TemporaryDirectory()
+		self.cache = ArtifactCache(os.path.join(self.dir.name, "cache"), max_bytes = 1024)
+		self.output = os.path.join(self.dir.name, "script.txt")
+
+	def tearDown(self):
+		self.dir.cleanup()
+
+	def produce(self, text):
+		def func():
+			with open(self.output, "w", encoding = "utf-8") as f:
+				f.write(text)
+
+		return func
+
+	def test_key_depends_on_every_part(self):
+		key = ArtifactCache.key("tts", tts = { "provider": "DashScopeTTS", "rate": 1.1 }, text = "你好")
+		self.assertEqual(key, ArtifactCache.key("tts", text = "你好", tts = { "rate": 1.1, "provider": "DashScopeTTS" }))
+		self.assertNotEqual(key, ArtifactCache.key("tts", tts = { "provider": "DashScopeTTS", "rate": 1.2 }, text = "你好"))
+		self.assertNotEqual(key, ArtifactCache.key("script", tts = { "provider": "DashScopeTTS", "rate": 1.1 }, text = "你好"))
+
+	def test_fetch_miss_then_hit(self):
+		key = ArtifactCache.key("script", text = "a")
+		self.assertFalse(self.cache.fetch("script", key, { "script": self.output }, self.produce("hello")))
+		os.remove(self.output)
+		self.assertTrue(self.cache.fetch("script", key, { "script": self.output }, self.produce("stale")))
+		with open(self.output, encoding = "utf-8") as f:
+			self.assertEqual(f.read(), "hello")
+		stats = self.cache.stats()
+		self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 1, 1))
+
+	def test_lru_eviction(self):
+		keys = [ArtifactCache.key("script", text = str(i)) for i in range(3)]
+		for i, key in enumerate(keys):
+			self.cache.fetch("script", key, { "script": self.output }, self.produce(str(i) * 400))
+			# 保证最近使用时间不同
+			time.sleep(0.01)
+		self.assertLessEqual(self.cache.stats()["bytes"], 1024)
+		self.assertFalse(self.cache.restore("script", keys[0], { "script": self.output }))
+		self.assertTrue(self.cache.restore("script", keys[2], { "script": self.output }))
+
+	def test_picklable(self):
+		cache = pickle.loads(pickle.dumps(self.cache))
+		self.assertEqual(cache.root, self.cache.root)
+
+
+class TestArtifactManifest(unittest.TestCase):
+	def test_persist(self):
+		with tempfile.TemporaryDirectory() as d:
+			path = os.path.join(d, "artifacts.json")
+			ArtifactManifest(path).set("tts", "abc")
+			self.assertEqual(ArtifactManifest(path).get("tts"), "abc")
+			self.assertIsNone(ArtifactManifest(path).get("script"))
+
+
+if __name__ == '__main__':
+	unittest.main()
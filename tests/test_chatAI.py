@@ -1,8 +1,12 @@
+import asyncio
 import logging
+import threading
+import time
 import unittest
 
 import ChatAIs
 from ChatAIs import ErnieBot
+from Limiters import RateLimiter
 
 logging.basicConfig(format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s-%(funcName)s',
                     level = logging.DEBUG)
@@ -74,3 +78,43 @@ class TestQwen(unittest.TestCase):
 		response = ai.conversation("上文中a的值是多少？")
 		print(response)
 		self.assertEquals("20" in response, False)
+
+
+class EchoChatAI(ChatAIs.ChatAI):
+	limiter = RateLimiter("EchoChatAI", concurrency = 2)
+
+	def __init__(self):
+		self.active = 0
+		self.max_active = 0
+		self.lock = threading.Lock()
+
+	def ask_once(self, question) -> str:
+		with self.lock:
+			self.active += 1
+			self.max_active = max(self.max_active, self.active)
+		time.sleep(0.05)
+		with self.lock:
+			self.active -= 1
+		if question == "error":
+			raise ValueError(question)
+		return question + "!"
+
+	def conversation(self, question: str) -> str:
+		return self.ask_once(question)
+
+	def end_conversation(self) -> None:
+		pass
+
+
+class TestAskMany(unittest.TestCase):
+	def test_ask_many(self):
+		ai = EchoChatAI()
+		self.assertEqual(asyncio.run(ai.ask_many(["a", "b", "c", "d", "e"])), ["a!", "b!", "c!", "d!", "e!"])
+		self.assertEqual(ai.max_active, 2)
+
+	def test_return_exceptions(self):
+		answers = asyncio.run(EchoChatAI().ask_many(["a", "error"], return_exceptions = True))
+		self.assertEqual(answers[0], "a!")
+		self.assertIsInstance(answers[1], ValueError)
+		with self.assertRaises(ValueError):
+			asyncio.run(EchoChatAI().ask_once_async("error"))
@@ -1,10 +1,41 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
+from datetime import datetime
 
+import sqlalchemy
+
+import Blobs
 import Data
 import Spiders
 
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(16))
+
+
+class SQLiteTestCase(unittest.TestCase):
+	"""
+	每个测试使用临时目录中的SQLite数据库
+	"""
+
+	def setUp(self):
+		self.dir = tempfile.TemporaryDirectory()
+		Data.configure(f"sqlite:///{os.path.join(self.dir.name, 'test.db')}")
+		Data.create_tables()
+
+	def tearDown(self):
+		Data.configure(None)
+		self.dir.cleanup()
+
+	@staticmethod
+	def news(i: int) -> Data.News:
+		return Data.News(title = f"news {i}", content = "content", source = f"https://example.com/{i}",
+		                 fetched_at = datetime(2023, 11, 20, 0, 0, i))
+
 
-class TestNews(unittest.TestCase):
+class TestNews(SQLiteTestCase):
 	def test_create_tables(self):
 		Data.create_tables()
 
@@ -13,3 +44,156 @@ class TestNews(unittest.TestCase):
 
 	def test_write_news(self):
 		news_list = Spiders.ZhihuHotSpider().fetch_and_write_news()
+
+	def test_write_news_skips_duplicates(self):
+		result = Data.write_news([self.news(i) for i in (0, 1, 1, 2)], batch_size = 2)
+		self.assertEqual(result, { "inserted": 3, "skipped": 1 })
+		result = Data.write_news([self.news(i) for i in (2, 3)])
+		self.assertEqual(result, { "inserted": 1, "skipped": 1 })
+		self.assertEqual(Data.session.scalar(sqlalchemy.select(sqlalchemy.func.count(Data.News.id))), 4)
+
+	def test_pragmas(self):
+		with Data.get_engine().connect() as connection:
+			self.assertEqual(connection.exec_driver_sql("PRAGMA journal_mode").scalar(), "wal")
+			# NORMAL
+			self.assertEqual(connection.exec_driver_sql("PRAGMA synchronous").scalar(), 1)
+			self.assertEqual(connection.exec_driver_sql("PRAGMA foreign_keys").scalar(), 1)
+
+	def test_memory_database(self):
+		Data.configure("sqlite://")
+		Data.create_tables()
+		Data.write_news([self.news(0)])
+		self.assertEqual(Data.get_news(1).title, "news 0")
+
+
+class TestLegacyMigration(unittest.TestCase):
+	"""
+	旧表结构：封面保存在LONGBLOB列中，没有source_hash，来源可以重复
+	"""
+
+	def setUp(self):
+		self.dir = tempfile.TemporaryDirectory()
+		path = os.path.join(self.dir.name, "legacy.db")
+		connection = sqlite3.connect(path)
+		connection.execute("CREATE TABLE news (id INTEGER PRIMARY KEY, title VARCHAR(255) NOT NULL, content TEXT NOT NULL, "
+		                   "category VARCHAR(20), source_site_name VARCHAR(255), source VARCHAR(1000), "
+		                   "posted_at DATETIME, fetched_at DATETIME NOT NULL, cover_url TEXT, cover_data BLOB, "
+		                   "is_created BOOLEAN NOT NULL)")
+		connection.executemany("INSERT INTO news (title, content, source, fetched_at, cover_data, is_created) "
+		                       "VALUES (?, 'content', ?, '2023-11-20 00:00:00', ?, 0)",
+		                       [("first", "https://example.com/a", PNG), ("copy", "https://example.com/a", None),
+		                        ("other", "https://example.com/b", None)])
+		connection.commit()
+		connection.close()
+		self.store = Blobs.store
+		Blobs.store = Blobs.BlobStore(Blobs.LocalBlobBackend(os.path.join(self.dir.name, "blobs")))
+		Data.configure(f"sqlite:///{path}")
+
+	def tearDown(self):
+		Data.configure(None)
+		Blobs.store = self.store
+		self.dir.cleanup()
+
+	def test_alter_tables(self):
+		Data.alter_tables(batch_size = 2)
+		# 再次执行不会重复迁移，也不会因为来源重复的新闻而失败
+		Data.alter_tables(batch_size = 2)
+		first, copy, other = (Data.get_news(i) for i in (1, 2, 3))
+		self.assertEqual(first.source_hash, Data.source_hash("https://example.com/a"))
+		self.assertIsNone(copy.source_hash)
+		self.assertEqual(other.source_hash, Data.source_hash("https://example.com/b"))
+		self.assertEqual(first.cover_data, PNG)
+		self.assertEqual(first.cover_mime, "image/png")
+		inspector = sqlalchemy.inspect(Data.get_engine())
+		self.assertNotIn("cover_data", { column["name"] for column in inspector.get_columns("news") })
+		self.assertIn("ix_news_source_hash", { index["name"] for index in inspector.get_indexes("news") })
+		# 唯一索引生效，写入来源相同的新闻被跳过
+		result = Data.write_news([Data.News(title = "new", content = "content", source = "https://example.com/a",
+		                                    fetched_at = datetime(2023, 11, 21))])
+		self.assertEqual(result["inserted"], 0)
+
+
+class TestWorkQueue(SQLiteTestCase):
+	def test_claim_render_tasks(self):
+		Data.session.add_all([Data.VideoTask(title = "test", is_rendered = False, is_published = False)
+		                      for _ in range(2)])
+		Data.session.commit()
+		first = Data.claim_render_tasks(10, worker = "first")
+		second = Data.claim_render_tasks(10, worker = "second")
+		self.assertTrue(first)
+		self.assertFalse({ task.id for task in first } & { task.id for task in second })
+		for task in first:
+			self.assertTrue(Data.release(task))
+		self.assertEqual(len(Data.claim_render_tasks(10)), 2)
+
+	def test_lease_expiry(self):
+		Data.session.add(Data.VideoTask(title = "test", is_rendered = False, is_published = False))
+		Data.session.commit()
+		self.assertEqual(len(Data.claim_render_tasks(lease = 0.1, worker = "crashed")), 1)
+		self.assertEqual(Data.claim_render_tasks(worker = "second"), [])
+		time.sleep(0.2)
+		task, = Data.claim_render_tasks(worker = "second")
+		self.assertEqual(task.claimed_by, "second")
+		self.assertTrue(Data.renew_lease(task))
+		Data.complete_render(task)
+		self.assertEqual(Data.claim_render_tasks(), [])
+		task, = Data.claim_publish_tasks()
+		Data.complete_publish(task, ["bilibili"])
+		self.assertEqual(Data.claim_publish_tasks(), [])
+
+	def test_stale_worker_cannot_complete(self):
+		Data.session.add(Data.VideoTask(title = "test", is_rendered = False, is_published = False))
+		Data.session.commit()
+		stale, = Data.claim_render_tasks(lease = 0.1, worker = "stale")
+		time.sleep(0.2)
+		tokens = []
+
+		def claim():
+			tokens.extend(task.held_token for task in Data.claim_render_tasks(worker = "owner"))
+			Data.session.remove()
+
+		# 租约过期后其他worker在另一个线程中重新领取
+		thread = threading.Thread(target = claim)
+		thread.start()
+		thread.join()
+		self.assertEqual(len(tokens), 1)
+		with self.assertRaises(Data.LeaseLost):
+			Data.complete_render(stale)
+		self.assertFalse(Data.release(stale))
+		self.assertFalse(Data.renew_lease(stale))
+		task = Data.get_video_task(stale.id)
+		self.assertFalse(task.is_rendered)
+		self.assertEqual(task.claimed_by, "owner")
+		self.assertEqual(task.claim_token, tokens[0])
+
+	def test_keep_leases(self):
+		Data.session.add(Data.VideoTask(title = "test", is_rendered = False, is_published = False))
+		Data.session.commit()
+		rows = Data.claim_render_tasks(lease = 0.2)
+		with Data.keep_leases(rows, lease = 0.2, interval = 0.05):
+			time.sleep(0.4)
+			self.assertEqual(Data.claim_render_tasks(), [])
+		Data.complete_render(rows[0])
+		self.assertTrue(Data.get_video_task(rows[0].id).is_rendered)
+
+	def test_concurrent_claim_news(self):
+		Data.write_news([self.news(i) for i in range(40)])
+		claimed = []
+
+		def work():
+			while rows := Data.claim_news(3):
+				claimed.extend(news.id for news in rows)
+				for news in rows:
+					Data.complete_news(news)
+			Data.session.remove()
+
+		threads = [threading.Thread(target = work) for _ in range(4)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(sorted(claimed), list(range(1, 41)))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,152 @@
+import hashlib
+import http.server
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from Downloads import DownloadError, Downloader
+from Sessions import HttpClient
+
+CONTENT = bytes(range(256)) * 1024
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+	# 每次请求的Range头与If-Range头
+	ranges: list = []
+	if_ranges: list = []
+	# 为True时第一次请求只发送一半内容就断开连接
+	drop_first = False
+	# 为True时忽略Range，总是返回整个文件
+	ignore_range = False
+	# 文件当前的ETag，If-Range与它不一致时返回整个文件
+	etag = '"v1"'
+
+	def do_GET(self):
+		if self.path != "/file.bin":
+			self.send_response(404)
+			self.send_header("Content-Length", "0")
+			self.end_headers()
+			return
+		Handler.ranges.append(self.headers.get("Range"))
+		Handler.if_ranges.append(self.headers.get("If-Range"))
+		start = 0
+		if_range = self.headers.get("If-Range")
+		if self.headers.get("Range") and not Handler.ignore_range and (if_range is None or if_range == Handler.etag):
+			start = int(self.headers["Range"][len("bytes="):-1])
+			self.send_response(206)
+			self.send_header("Content-Range", f"bytes {start}-{len(CONTENT) - 1}/{len(CONTENT)}")
+		else:
+			self.send_response(200)
+		self.send_header("Content-Length", str(len(CONTENT) - start))
+		self.send_header("ETag", Handler.etag)
+		self.end_headers()
+		if Handler.drop_first and len(Handler.ranges) == 1:
+			self.wfile.write(CONTENT[:len(CONTENT) // 2])
+			self.wfile.flush()
+			self.close_connection = True
+			return
+		self.wfile.write(CONTENT[start:])
+
+	def log_message(self, *args):
+		pass
+
+
+class TestDownloader(unittest.TestCase):
+	def setUp(self):
+		Handler.ranges = []
+		Handler.if_ranges = []
+		Handler.drop_first = False
+		Handler.ignore_range = False
+		Handler.etag = '"v1"'
+		self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+		threading.Thread(target = self.server.serve_forever, daemon = True).start()
+		self.url = f"http://127.0.0.1:{self.server.server_port}/file.bin"
+		self.dir = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.dir.name, "file.bin")
+		self.downloader = Downloader(HttpClient(retries = 0), chunk_size = 4096)
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+		self.dir.cleanup()
+
+	def read(self):
+		with open(self.path, "rb") as f:
+			return f.read()
+
+	def test_download(self):
+		self.downloader.download(self.url, self.path, sha256 = hashlib.sha256(CONTENT).hexdigest())
+		self.assertEqual(self.read(), CONTENT)
+		self.assertFalse(os.path.exists(self.path + ".part"))
+
+	def test_resume_after_interruption(self):
+		Handler.drop_first = True
+		self.downloader.download(self.url, self.path)
+		self.assertEqual(self.read(), CONTENT)
+		self.assertEqual(Handler.ranges[0], None)
+		self.assertEqual(Handler.ranges[1], f"bytes={len(CONTENT) // 2}-")
+
+	def write_part(self, content: bytes, url: str = None, validator: str = None):
+		with open(self.path + ".part", "wb") as f:
+			f.write(content)
+		if url is not None:
+			with open(self.path + ".part.json", "w", encoding = "utf-8") as f:
+				json.dump({ "url": url, "validator": validator }, f)
+
+	def test_resume_existing_part(self):
+		self.write_part(CONTENT[:1000], self.url, '"v1"')
+		self.downloader.download(self.url, self.path)
+		self.assertEqual(self.read(), CONTENT)
+		self.assertEqual(Handler.ranges, ["bytes=1000-"])
+		self.assertEqual(Handler.if_ranges, ['"v1"'])
+		self.assertFalse(os.path.exists(self.path + ".part.json"))
+
+	def test_stale_part_of_other_resource(self):
+		# 同一路径上一次下载的是其他文件，长度相同，续传会得到错误的内容
+		other = bytes(reversed(CONTENT))
+		for url in (None, self.url.replace("file.bin", "other.bin")):
+			with self.subTest(url = url):
+				Handler.ranges = []
+				self.write_part(other[:1000], url, '"other"')
+				self.downloader.download(self.url, self.path)
+				self.assertEqual(self.read(), CONTENT)
+				self.assertEqual(Handler.ranges, [None])
+
+	def test_stale_part_of_changed_resource(self):
+		# 文件在两次下载之间发生了变化，If-Range不一致，服务端返回整个文件
+		self.write_part(bytes(reversed(CONTENT))[:1000], self.url, '"v0"')
+		self.downloader.download(self.url, self.path)
+		self.assertEqual(self.read(), CONTENT)
+		self.assertEqual(Handler.if_ranges, ['"v0"'])
+
+	def test_server_ignores_range(self):
+		Handler.ignore_range = True
+		with open(self.path + ".part", "wb") as f:
+			f.write(b"stale")
+		self.downloader.download(self.url, self.path)
+		self.assertEqual(self.read(), CONTENT)
+
+	def test_checksum_mismatch(self):
+		with self.assertRaises(DownloadError):
+			self.downloader.download(self.url, self.path, sha256 = "0" * 64)
+		self.assertFalse(os.path.exists(self.path))
+		self.assertFalse(os.path.exists(self.path + ".part"))
+
+	def test_not_found(self):
+		with self.assertRaises(DownloadError):
+			self.downloader.download(self.url.replace("file.bin", "missing.bin"), self.path)
+		self.assertFalse(os.path.exists(self.path))
+
+	def test_download_many(self):
+		paths = [os.path.join(self.dir.name, f"{i}.bin") for i in range(3)]
+		self.assertEqual(self.downloader.download_many([(self.url, path) for path in paths]), paths)
+		for path in paths:
+			with open(path, "rb") as f:
+				self.assertEqual(f.read(), CONTENT)
+
+
+if __name__ == '__main__':
+	unittest.main()
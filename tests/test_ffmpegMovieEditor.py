@@ -0,0 +1,85 @@
+import os
+import subprocess
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image
+from moviepy.config import get_setting
+
+from FFMpegMovieEditor import FFMpegMovieEditor, ass_escape, ass_time, karaoke
+from Timings import WordTimings, words_path
+
+
+class TestFFMpegMovieEditor(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.TemporaryDirectory()
+		d = self.dir.name
+		self.background_path = os.path.join(d, "background.png")
+		Image.fromarray(np.full((2400, 720, 3), 60, dtype = np.uint8)).save(self.background_path)
+		self.audio_path = os.path.join(d, "tts.mp3")
+		self.bgm_path = os.path.join(d, "bgm.mp3")
+		for path, source in ((self.audio_path, "sine=d=3"), (self.bgm_path, "sine=f=220:d=10")):
+			subprocess.run([get_setting("FFMPEG_BINARY"), "-loglevel", "error", "-y", "-f", "lavfi", "-i", source,
+			                path], check = True)
+		self.subtitle_path = os.path.join(d, "subtitle.srt")
+		with open(self.subtitle_path, "w", encoding = "utf-8") as f:
+			f.write("0\n00:00:00,500 --> 00:00:01,500\n大家好欢迎收看Ai信息差今天我们\n\n"
+			        "1\n00:00:01,500 --> 00:00:02,000\n< No Speech >\n\n")
+
+	def tearDown(self):
+		self.dir.cleanup()
+
+	def test_ass_time(self):
+		self.assertEqual(ass_time(0), "0:00:00.00")
+		self.assertEqual(ass_time(3723.456), "1:02:03.46")
+
+	def test_ass_escape(self):
+		self.assertEqual(ass_escape("a{b}\\c\nd"), "a｛b｝＼c\\Nd")
+
+	def test_build_ass(self):
+		ass = FFMpegMovieEditor().build_ass(self.background_path, self.subtitle_path, 3, video_title = "副标题")
+		self.assertIn("PlayResX: 720", ass)
+		self.assertIn("PlayResY: 2400", ass)
+		self.assertIn("副标题", ass)
+		self.assertNotIn("No Speech", ass)
+		# 字幕按12个字换行，每行一个事件，加上一个底色块
+		self.assertIn("大家好欢迎收看Ai信息差", ass)
+		self.assertIn("今天我们", ass)
+		self.assertEqual(ass.count("Dialogue: 0,0:00:00.50,0:00:01.50"), 1)
+		self.assertEqual(ass.count("Dialogue: 1,0:00:00.50,0:00:01.50"), 2)
+
+	def test_karaoke(self):
+		self.assertEqual(karaoke([("一", 500), ("二三", 700)], 500, 1000), "{\\k20}一{\\k30}二三")
+		# 第一个词之前的时间由没有文字的音节占据，音节的时长至少为1厘秒
+		self.assertEqual(karaoke([("一", 800), ("二", 800)], 500, 800), "{\\k30}{\\k1}一{\\k1}二")
+
+	def test_build_ass_highlight_words(self):
+		text = "大家好欢迎收看Ai信息差今天我们"
+		WordTimings(list(text), range(500, 1500, 62), range(562, 1562, 62)).save(words_path(self.subtitle_path))
+		ass = FFMpegMovieEditor(highlight_words = True).build_ass(self.background_path, self.subtitle_path, 3)
+		self.assertIn("\\2c&HFFFFFF&", ass)
+		self.assertIn("{\\k6}大{\\k6}家", ass)
+		# 字幕的结束时间来自最后一个字
+		self.assertEqual(ass.count("Dialogue: 1,0:00:00.50,0:00:01.49"), 2)
+
+	def test_render(self):
+		output_path = os.path.join(self.dir.name, "output.mp4")
+		FFMpegMovieEditor().create_subtitled_video(self.background_path, self.audio_path, output_path,
+		                                           self.subtitle_path, self.bgm_path, fps = 10)
+		probe = subprocess.run([get_setting("FFMPEG_BINARY"), "-i", output_path], capture_output = True,
+		                       text = True).stderr
+		self.assertIn("Duration: 00:00:03", probe)
+		self.assertIn("720x2400", probe)
+		self.assertIn("Audio", probe)
+		self.assertTrue(os.path.exists(FFMpegMovieEditor.render_manifest_path(output_path)))
+
+	def test_render_without_bgm(self):
+		output_path = os.path.join(self.dir.name, "output.mp4")
+		FFMpegMovieEditor().create_subtitled_video(self.background_path, self.audio_path, output_path,
+		                                           self.subtitle_path, None, fps = 10)
+		self.assertTrue(os.path.exists(output_path))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,61 @@
+import threading
+import time
+import unittest
+
+from Limiters import RateLimiter
+
+
+class FakeClock:
+	def __init__(self):
+		self.now = 0.0
+		self.sleeps = []
+
+	def __call__(self):
+		return self.now
+
+	def sleep(self, seconds):
+		self.sleeps.append(seconds)
+		self.now += seconds
+
+
+class TestRateLimiter(unittest.TestCase):
+	def test_rate(self):
+		clock = FakeClock()
+		limiter = RateLimiter("test", rate = 2.0, burst = 2, clock = clock, sleep = clock.sleep)
+		for _ in range(4):
+			with limiter:
+				pass
+		# 前两个请求使用积累的令牌，之后每0.5秒一个
+		self.assertEqual(clock.sleeps, [0.5, 0.5])
+		self.assertEqual(limiter.stats()["requests"], 4)
+
+	def test_tokens_refill_while_idle(self):
+		clock = FakeClock()
+		limiter = RateLimiter("test", rate = 1.0, clock = clock, sleep = clock.sleep)
+		with limiter:
+			pass
+		clock.now += 5
+		with limiter:
+			pass
+		self.assertEqual(clock.sleeps, [])
+
+	def test_concurrency(self):
+		limiter = RateLimiter("test", concurrency = 2)
+		barrier = threading.Barrier(5)
+
+		def request():
+			barrier.wait()
+			with limiter:
+				time.sleep(0.05)
+
+		threads = [threading.Thread(target = request) for _ in range(5)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(limiter.stats()["max_in_flight"], 2)
+		self.assertEqual(limiter.in_flight, 0)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,218 @@
+import os
+import subprocess
+import tempfile
+import unittest
+
+import numpy as np
+from moviepy.audio.io.AudioFileClip import AudioFileClip
+from moviepy.config import get_setting
+from moviepy.video.VideoClip import ColorClip, ImageClip
+from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
+
+from MovieEditors import MovieEditor, SubtitleSprites
+from Subtitles import CueTable
+from Timings import WordTimings, words_path
+
+
+def make_video(path, color, duration):
+	subprocess.run([get_setting("FFMPEG_BINARY"), "-loglevel", "error", "-y",
+	                "-f", "lavfi", "-i", f"color=c={color}:s=320x240:r=30:d={duration}",
+	                "-f", "lavfi", "-i", f"sine=d={duration}",
+	                "-c:v", "libx264", "-force_key_frames", "expr:gte(t,n_forced*2)", "-c:a", "libmp3lame",
+	                "-shortest", path], check = True)
+
+
+def video_frames(path, copy=False) -> list[tuple[int, int, str]]:
+	"""
+	用ffmpeg的framemd5列出视频流的每一个包（copy为True）或解码后的每一帧
+	:return: (dts, pts, md5)的列表，时间戳的单位为framemd5输出的时间基
+	"""
+	output = subprocess.run([get_setting("FFMPEG_BINARY"), "-loglevel", "error", "-i", path, "-map", "0:v"]
+	                        + (["-c", "copy"] if copy else []) + ["-f", "framemd5", "-"],
+	                        capture_output = True, text = True, check = True).stdout
+	rows = [line.split(",") for line in output.splitlines() if not line.startswith("#")]
+	return [(int(row[1]), int(row[2]), row[5].strip()) for row in rows]
+
+
+class TestMovieEditor(unittest.TestCase):
+	def test_read_cues(self):
+		cues = MovieEditor().read_cues("../daily/2023_11_20/input/subtitle.srt")
+		self.assertGreater(len(cues), 0)
+		for start, end, text in cues:
+			self.assertLessEqual(start, end)
+			self.assertIsInstance(text, str)
+
+	def test_render_manifest(self):
+		with tempfile.TemporaryDirectory() as d:
+			output_path = os.path.join(d, "output.mp4")
+			editor = MovieEditor()
+			self.assertIsNone(editor.read_render_manifest(output_path))
+			editor.write_render_manifest(output_path, { "base": "abc", "cues": [[0.0, 1.0, "你好"]] })
+			self.assertEqual(editor.read_render_manifest(output_path), { "base": "abc", "cues": [[0.0, 1.0, "你好"]] })
+
+	def test_flatten_static_layers(self):
+		bg = ImageClip(np.full((320, 180, 3), 50, dtype = np.uint8)).set_duration(4)
+		title = ColorClip((100, 40), color = (255, 255, 0)).set_position((40, 100)).set_duration(4)
+		flash = ColorClip((100, 40), color = (255, 0, 0)).set_position((40, 200)).set_start(1).set_duration(1)
+		editor = MovieEditor()
+		layers = editor.flatten_static_layers([bg, title, flash], 4)
+		self.assertEqual(len(layers), 2)
+		self.assertIs(layers[1], flash)
+		flattened = CompositeVideoClip(layers)
+		original = CompositeVideoClip([bg, title, flash])
+		for t in (0, 1.5, 3):
+			self.assertTrue((flattened.get_frame(t) == original.get_frame(t)).all())
+
+	def test_splice(self):
+		with tempfile.TemporaryDirectory() as d:
+			full_path = os.path.join(d, "full.mp4")
+			segment_path = os.path.join(d, "segment.mp4")
+			make_video(full_path, "blue", 10)
+			make_video(segment_path, "red", 2)
+			full = video_frames(full_path)
+			blue, red = full[0][2], video_frames(segment_path)[0][2]
+			for start, end in ((4, 6), (0, 2), (8, 10)):
+				with self.subTest(start = start, end = end):
+					video_path = os.path.join(d, f"output_{start}.mp4")
+					make_video(video_path, "blue", 10)
+					MovieEditor.splice(video_path, segment_path, start, end, 10)
+					probe = subprocess.run([get_setting("FFMPEG_BINARY"), "-i", video_path], capture_output = True,
+					                       text = True).stderr
+					self.assertIn("Duration: 00:00:10", probe)
+					self.assertIn("Audio", probe)
+					# 直接复制的视频包解码时间严格递增
+					dts = [packet[0] for packet in video_frames(video_path, copy = True)]
+					self.assertTrue(all(a < b for a, b in zip(dts, dts[1:])))
+					# 帧数与完整渲染相同，显示时间连续，拼接处没有重复或丢失的帧
+					frames = video_frames(video_path)
+					self.assertEqual(len(frames), len(full))
+					self.assertEqual([frame[1] for frame in frames], [frame[1] for frame in full])
+					self.assertEqual([frame[2] for frame in frames],
+					                 [blue] * (start * 30) + [red] * ((end - start) * 30) + [blue] * ((10 - end) * 30))
+
+	def test_change_points(self):
+		cues = [(0.0, 1.5, "一"), (1.5, 3.0, "二"), (4.0, 12.0, "三")]
+		self.assertEqual(MovieEditor.change_points(cues, 10), [0.0, 1.5, 3.0, 4.0, 10.0])
+
+	def test_render_stills(self):
+		with tempfile.TemporaryDirectory() as d:
+			srt = os.path.join(d, "subtitle.srt")
+			with open(srt, "w", encoding = "utf-8") as f:
+				f.write("0\n00:00:01,000 --> 00:00:02,500\n你好\n\n1\n00:00:04,000 --> 00:00:05,000\n再见\n\n")
+			audio_path = os.path.join(d, "audio.mp3")
+			subprocess.run([get_setting("FFMPEG_BINARY"), "-loglevel", "error", "-y", "-f", "lavfi",
+			                "-i", "sine=d=6", audio_path], check = True)
+			editor = MovieEditor(still_segments = True)
+			video = ImageClip(np.full((2400, 720, 3), 30, dtype = np.uint8)).set_duration(6)
+			video = editor.AddSubtitles(video.set_audio(AudioFileClip(audio_path)), srt)
+			output_path = os.path.join(d, "output.mp4")
+			editor.render_stills(video, editor.read_cues(srt), output_path)
+
+			self.assertEqual(sorted(os.listdir(d)), ["audio.mp3", "output.mp4", "subtitle.srt"])
+			probe = subprocess.run([get_setting("FFMPEG_BINARY"), "-i", output_path, "-map", "0:v", "-f", "null", "-"],
+			                       capture_output = True, text = True).stderr
+			self.assertIn("Duration: 00:00:06", probe)
+			self.assertIn("Audio", probe)
+			# 5个静止片段只编码了少量帧，而不是6秒×帧率
+			frames = int(probe.rsplit("frame=", 1)[1].split()[0])
+			self.assertLess(frames, 10)
+
+	def test_load_subtitles(self):
+		with tempfile.TemporaryDirectory() as d:
+			srt = os.path.join(d, "subtitle.srt")
+			text = "一二三四五六七八九十一二三四五六七八"
+			with open(srt, "w", encoding = "utf-8") as f:
+				f.write(f"0\n00:00:00,000 --> 00:00:01,800\n{text[:12]}\n{text[12:]}\n\n")
+			WordTimings(list(text), range(0, 1800, 100), range(100, 1900, 100)).save(words_path(srt))
+			cues, highlights = MovieEditor().load_subtitles(srt)
+			self.assertEqual(len(cues), 1)
+			self.assertIsNone(highlights)
+			# 按行显示：每一行单独显示，时间来自字级时间戳
+			cues, highlights = MovieEditor(line_windows = True).load_subtitles(srt)
+			self.assertEqual(list(cues), [(0, 1200, text[:12]), (1200, 1800, text[12:])])
+			self.assertIsNone(highlights)
+			cues, highlights = MovieEditor(highlight_words = True).load_subtitles(srt)
+			self.assertEqual(len(cues), 1)
+			self.assertEqual(highlights[0][0].tolist(), list(range(0, 1800, 100)))
+
+
+class TestSubtitleSprites(unittest.TestCase):
+	def setUp(self):
+		self.sprites = SubtitleSprites(CueTable([(2000, 3000, "第二句"), (0, 1500, "大家好欢迎收看Ai信息差今天我们要讨论的话题")]),
+		                               width = 720)
+
+	def test_wrap(self):
+		self.assertEqual(self.sprites.wrap("一二三四五六七八九十一二三"), ["一二三四五六七八九十一二", "三"])
+		self.assertEqual(self.sprites.wrap("一二三四五六七八九十一二"), ["一二三四五六七八九十一二"])
+		# 行末的标点不单独成行，Timings生成的多行字幕按原样拆分
+		self.assertEqual(self.sprites.wrap("一二三四五六七八九十一二。"), ["一二三四五六七八九十一二。"])
+		self.assertEqual(self.sprites.wrap("一二三\n四五"), ["一二三", "四五"])
+
+	def test_active(self):
+		self.assertEqual(self.sprites.active(0.0), 0)
+		self.assertIsNone(self.sprites.active(1.7))
+		self.assertEqual(self.sprites.active(2.5), 1)
+		self.assertIsNone(self.sprites.active(3.0))
+		self.assertEqual(self.sprites.sprites[0].shape, (420, 720, 4))
+
+	def test_blend(self):
+		frame = np.full((1280, 720, 3), 200, dtype = np.uint8)
+		self.assertIs(self.sprites.blend(frame, 1.7, (0, 100)), frame)
+		blended = self.sprites.blend(frame, 0.5, (0, 100))
+		self.assertTrue((frame == 200).all())
+		self.assertTrue((blended[:100] == 200).all())
+		self.assertFalse((blended[100:520] == 200).all())
+
+	def test_blend_clips_to_frame(self):
+		frame = np.full((640, 360, 3), 200, dtype = np.uint8)
+		# 贴图的上半部分在画面上方，左边超出画面
+		blended = self.sprites.blend(frame, 0.5, (-100, -210))
+		expected = self.sprites.blend(np.full((1280, 720, 3), 200, dtype = np.uint8), 0.5, (0, 0))
+		self.assertTrue((blended[:210] == expected[210:420, 100:460]).all())
+		self.assertTrue((blended[210:] == 200).all())
+		# 下边与右边超出画面
+		blended = self.sprites.blend(frame, 0.5, (200, 500))
+		self.assertTrue((blended[500:, 200:] == expected[:140, :160]).all())
+		# 完全在画面之外
+		self.assertIs(self.sprites.blend(frame, 0.5, (0, -500)), frame)
+		self.assertIs(self.sprites.blend(frame, 0.5, (360, 0)), frame)
+
+	def test_add_subtitles_short_frame(self):
+		with tempfile.TemporaryDirectory() as d:
+			srt = os.path.join(d, "subtitle.srt")
+			with open(srt, "w", encoding = "utf-8") as f:
+				f.write("0\n00:00:00,000 --> 00:00:01,000\n大家好欢迎收看Ai信息差今天我们要讨论的话题\n\n")
+			# 高度不到2000像素时字幕的位置为负数
+			video = ImageClip(np.zeros((640, 360, 3), dtype = np.uint8)).set_duration(1)
+			video = MovieEditor().AddSubtitles(video, srt)
+			self.assertEqual(video.get_frame(0.5).shape, (640, 360, 3))
+
+	def test_add_subtitles(self):
+		with tempfile.TemporaryDirectory() as d:
+			srt = os.path.join(d, "subtitle.srt")
+			with open(srt, "w", encoding = "utf-8") as f:
+				f.write("0\n00:00:00,000 --> 00:00:01,000\n你好\n\n1\n00:00:01,000 --> 00:00:02,000\n< No Speech >\n\n")
+			video = ImageClip(np.zeros((2400, 720, 3), dtype = np.uint8)).set_duration(2)
+			video = MovieEditor().AddSubtitles(video, srt)
+			self.assertGreater(video.get_frame(0.5).sum(), 0)
+			self.assertEqual(video.get_frame(1.5).sum(), 0)
+
+	def test_highlight_words(self):
+		cues = CueTable([(0, 300, "一二三")])
+		sprites = SubtitleSprites(cues, width = 720, highlights = [(np.array([0, 100, 200]), np.array([1, 2, 3]))])
+
+		def highlighted(t):
+			sprite = sprites.sprite_at(0, t)
+			# 高亮颜色为(255, 215, 0)，蓝色通道很低的文字像素
+			return int(((sprite[..., 0] > 200) & (sprite[..., 2] < 100)).sum())
+
+		counts = [highlighted(t) for t in (50, 150, 250)]
+		self.assertGreater(counts[0], 0)
+		self.assertLess(counts[0], counts[1])
+		self.assertLess(counts[1], counts[2])
+		self.assertEqual(sprites.split_rows(["一二", "三"], (np.array([0, 100]), np.array([1, 3]))),
+		                 [[("一", 0), ("二", 100)], [("三", 100)]])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,87 @@
+import functools
+import threading
+import time
+import unittest
+
+from Pipelines import StagePools, StepGraph
+
+
+class TestStepGraph(unittest.TestCase):
+	def test_run_in_dependency_order(self):
+		order = []
+		lock = threading.Lock()
+
+		def step(name):
+			def func():
+				with lock:
+					order.append(name)
+				return name
+
+			return func
+
+		graph = StepGraph()
+		graph.add("script", step("script"))
+		graph.add("tts", step("tts"), depends = ["script"])
+		graph.add("description", step("description"), depends = ["script"])
+		graph.add("background", step("background"))
+		graph.add("blured_background", step("blured_background"), depends = ["background"])
+		timings = graph.run()
+
+		self.assertEqual(set(timings), set(order))
+		self.assertLess(order.index("script"), order.index("tts"))
+		self.assertLess(order.index("script"), order.index("description"))
+		self.assertLess(order.index("background"), order.index("blured_background"))
+		self.assertEqual(graph.steps["tts"].result, "tts")
+
+	def test_independent_steps_run_concurrently(self):
+		graph = StepGraph(max_workers = 3)
+		for name in ("a", "b", "c"):
+			graph.add(name, lambda: time.sleep(0.2))
+		start = time.perf_counter()
+		graph.run()
+		self.assertLess(time.perf_counter() - start, 0.5)
+
+	def test_failure_stops_dependents(self):
+		ran = []
+
+		def fail():
+			raise RuntimeError("boom")
+
+		graph = StepGraph()
+		graph.add("script", fail)
+		graph.add("tts", lambda: ran.append("tts"), depends = ["script"])
+		with self.assertRaises(RuntimeError):
+			graph.run()
+		self.assertEqual(ran, [])
+
+	def test_check_cycle_and_unknown(self):
+		graph = StepGraph()
+		graph.add("a", lambda: None, depends = ["b"])
+		graph.add("b", lambda: None, depends = ["a"])
+		self.assertRaises(ValueError, graph.check)
+
+		graph = StepGraph()
+		graph.add("a", lambda: None, depends = ["missing"])
+		self.assertRaises(ValueError, graph.check)
+
+
+class TestStagePools(unittest.TestCase):
+	def test_stage_limit(self):
+		graph = StepGraph()
+		graph.add("script", lambda: time.sleep(0.2), stage = "llm")
+		graph.add("description", lambda: time.sleep(0.2), stage = "llm")
+		with StagePools({ "llm": 1 }) as pools:
+			start = time.perf_counter()
+			graph.run(pools)
+			self.assertGreaterEqual(time.perf_counter() - start, 0.4)
+
+	def test_process_stage(self):
+		graph = StepGraph()
+		graph.add("render", functools.partial(pow, 2, 10), stage = "render")
+		with StagePools({ "render": 2 }) as pools:
+			graph.run(pools)
+		self.assertEqual(graph.steps["render"].result, 1024)
+
+
+if __name__ == '__main__':
+	unittest.main()
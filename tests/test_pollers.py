@@ -0,0 +1,101 @@
+import unittest
+
+import Pollers
+from Pollers import PollTimeout, TaskPoller, retry_after
+
+
+class FakeClock:
+	def __init__(self):
+		self.now = 0.0
+		self.sleeps = []
+
+	def __call__(self):
+		return self.now
+
+	def sleep(self, seconds):
+		self.sleeps.append(seconds)
+		self.now += seconds
+
+
+class FakeResponse:
+	def __init__(self, status, headers=None):
+		self.status = status
+		self.headers = headers or { }
+
+
+class TestTaskPoller(unittest.TestCase):
+	def setUp(self):
+		Pollers.reset_stats()
+		self.clock = FakeClock()
+
+	def create_poller(self, **kwargs):
+		return TaskPoller("test", initial = 1.0, factor = 2.0, max_interval = 5.0, jitter = 0.0,
+		                  sleep = self.clock.sleep, clock = self.clock, **kwargs)
+
+	def test_backoff_and_last_response(self):
+		responses = iter([FakeResponse("RUNNING")] * 4 + [FakeResponse("SUCCESS")])
+		fetched = []
+
+		def fetch():
+			fetched.append(next(responses))
+			return fetched[-1]
+
+		result, response = self.create_poller().poll(fetch, lambda r: r.status if r.status == "SUCCESS" else None)
+		self.assertEqual(result, "SUCCESS")
+		self.assertIs(response, fetched[-1])
+		self.assertEqual(len(fetched), 5)
+		self.assertEqual(self.clock.sleeps, [1.0, 2.0, 4.0, 5.0])
+		stat = Pollers.stats()["test"]
+		self.assertEqual((stat["tasks"], stat["finished"], stat["polls"]), (1, 1, 5))
+		self.assertEqual(stat["mean_seconds"], 12.0)
+
+	def test_jitter_bounds(self):
+		poller = TaskPoller("test", initial = 4.0, jitter = 0.25)
+		for _ in range(100):
+			self.assertTrue(3.0 <= poller.interval(0) <= 5.0)
+
+	def test_retry_after(self):
+		self.assertEqual(retry_after(FakeResponse("RUNNING", { "Retry-After": "7" })), 7.0)
+		self.assertIsNone(retry_after(FakeResponse("RUNNING")))
+		self.assertIsNone(retry_after({ "status": "RUNNING" }))
+		self.assertEqual(retry_after(FakeResponse("RUNNING", { "Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT" })), 0.0)
+
+	def test_honors_retry_after(self):
+		responses = iter([FakeResponse("RUNNING", { "Retry-After": "3" }), FakeResponse("SUCCESS")])
+		self.create_poller().poll(lambda: next(responses), lambda r: r.status if r.status == "SUCCESS" else None)
+		self.assertEqual(self.clock.sleeps, [3.0])
+
+	def test_throttled_fetch_is_retried(self):
+		class Throttled(Exception):
+			headers = { "Retry-After": "2" }
+
+		calls = []
+
+		def fetch():
+			calls.append(1)
+			if len(calls) == 1:
+				raise Throttled()
+			return FakeResponse("SUCCESS")
+
+		self.create_poller().poll(fetch, lambda r: r.status)
+		self.assertEqual(self.clock.sleeps, [2.0])
+
+	def test_deadline(self):
+		with self.assertRaises(PollTimeout) as context:
+			self.create_poller(deadline = 10.0).poll(lambda: FakeResponse("RUNNING"), lambda r: None)
+		self.assertEqual(context.exception.response.status, "RUNNING")
+		self.assertEqual(self.clock.now, 10.0)
+		self.assertEqual(Pollers.stats()["test"]["timeouts"], 1)
+
+	def test_parse_error_is_raised(self):
+		def parse(response):
+			raise ValueError("failed")
+
+		with self.assertRaises(ValueError):
+			self.create_poller().poll(lambda: FakeResponse("FAILED"), parse)
+		self.assertEqual(Pollers.stats()["test"]["failed"], 1)
+		self.assertEqual(self.clock.sleeps, [])
+
+
+if __name__ == '__main__':
+	unittest.main()
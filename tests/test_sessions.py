@@ -0,0 +1,67 @@
+import http.server
+import threading
+import unittest
+
+from Sessions import HttpClient
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+	# 每个路径被请求的次数
+	hits: dict[str, int] = { }
+
+	def do_GET(self):
+		Handler.hits[self.path] = Handler.hits.get(self.path, 0) + 1
+		if self.path == "/flaky" and Handler.hits[self.path] == 1:
+			status, body = 503, b"busy"
+		else:
+			status, body = 200, b"ok"
+		self.send_response(status)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	do_POST = do_GET
+
+	def log_message(self, *args):
+		pass
+
+
+class TestHttpClient(unittest.TestCase):
+	def setUp(self):
+		Handler.hits = { }
+		self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+		threading.Thread(target = self.server.serve_forever, daemon = True).start()
+		self.url = f"http://127.0.0.1:{self.server.server_port}"
+		self.client = HttpClient(backoff_factor = 0)
+
+	def tearDown(self):
+		self.client.close()
+		self.server.shutdown()
+		self.server.server_close()
+
+	def test_connection_reuse(self):
+		for _ in range(5):
+			self.assertEqual(self.client.get(self.url + "/a").text, "ok")
+		stats = self.client.stats()["127.0.0.1"]
+		self.assertEqual(stats["requests"], 5)
+		self.assertEqual(stats["connections"], 1)
+		self.assertAlmostEqual(stats["reuse_rate"], 0.8)
+
+	def test_idempotent_retry(self):
+		self.assertEqual(self.client.get(self.url + "/flaky").status_code, 200)
+		self.assertEqual(Handler.hits["/flaky"], 2)
+
+	def test_post_is_not_retried(self):
+		self.assertEqual(self.client.post(self.url + "/flaky").status_code, 503)
+		self.assertEqual(Handler.hits["/flaky"], 1)
+
+	def test_host_pool_size(self):
+		client = HttpClient(pool_size = 2, host_pool_sizes = { "127.0.0.1": 7 })
+		adapter = client.session.get_adapter(self.url + "/a")
+		self.assertEqual(adapter._pool_maxsize, 7)
+		self.assertEqual(client.session.get_adapter("https://example.com/")._pool_maxsize, 2)
+
+
+if __name__ == '__main__':
+	unittest.main()
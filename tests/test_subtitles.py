@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+
+import Subtitles
+from Subtitles import CueTable
+
+
+class TestSubtitles(unittest.TestCase):
+	def test_iter_cues_srt(self):
+		lines = ["0\n", "00:00:00,000 --> 00:00:02,704\n", "大家好\n", "\n",
+		         "1\r\n", "00:00:02,704 --> 01:00:12,435\r\n", "第一行\r\n", "第二行\r\n", "\r\n",
+		         "2\n", "00:01:00,000 --> 00:01:01,000\n", "\n",
+		         "3\n", "00:01:01,000 --> 00:01:02,000\n", "< No Speech >"]
+		self.assertEqual(list(Subtitles.iter_cues(lines)),
+		                 [(0, 2704, "大家好"), (2704, 3612435, "第一行\n第二行"), (60000, 61000, ""),
+		                  (61000, 62000, "< No Speech >")])
+
+	def test_iter_cues_vtt(self):
+		lines = ["WEBVTT\n", "\n", "NOTE 注释\n", "\n", "intro\n", "00:01.500 --> 00:02.000 align:start\n", "你好\n"]
+		self.assertEqual(list(Subtitles.iter_cues(lines)), [(1500, 2000, "你好")])
+
+	def test_cue_table(self):
+		table = CueTable([(2000, 3000, "第二句"), (0, 1500, "第一句"), (2500, 2800, "重叠")])
+		self.assertEqual(len(table), 3)
+		self.assertEqual(table[0], (0, 1500, "第一句"))
+		self.assertEqual(table[-1], (2500, 2800, "重叠"))
+		self.assertEqual(table.at(0), 0)
+		self.assertIsNone(table.at(1500))
+		self.assertEqual(table.at(2200), 1)
+		self.assertEqual(table.at(2600), 2)
+		self.assertEqual(table.at(2900), 1)
+		self.assertIsNone(table.at(3000))
+		self.assertIsNone(CueTable().at(0))
+		self.assertEqual(table.exclude("重叠").seconds(), [(0.0, 1.5, "第一句"), (2.0, 3.0, "第二句")])
+
+	def test_write_and_read(self):
+		cues = [(0, 2704, "大家好"), (2704, 3612435, "第一行\n第二行")]
+		srt = Subtitles.write_srt(cues)
+		self.assertTrue(srt.startswith("0\n00:00:00,000 --> 00:00:02,704\n大家好\n\n1\n00:00:02,704 --> 01:00:12,435\n"))
+		with tempfile.TemporaryDirectory() as d:
+			path = os.path.join(d, "subtitle.srt")
+			with open(path, "w", encoding = "utf-8") as f:
+				f.write(srt)
+			self.assertEqual(list(Subtitles.read_cues(path)), cues)
+
+	def test_srt_writer(self):
+		with tempfile.TemporaryDirectory() as d:
+			path = os.path.join(d, "subtitle.srt")
+			with Subtitles.SrtWriter(path) as writer:
+				writer.write(0, 1000, "你好")
+				# 写入后立即可以读到
+				self.assertEqual(list(Subtitles.read_cues(path)), [(0, 1000, "你好")])
+				writer.write(1000, 2000, "再见")
+			with open(path, encoding = "utf-8") as f:
+				self.assertEqual(f.read(), Subtitles.write_srt([(0, 1000, "你好"), (1000, 2000, "再见")]))
+
+	def test_read_fixture(self):
+		table = Subtitles.read_cues("../daily/2023_11_20/input/subtitle.srt")
+		self.assertGreater(len(table), 0)
+		self.assertEqual(table[0][:2], (0, 2704))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,88 @@
+import os
+import tempfile
+import unittest
+
+import Subtitles
+from Subtitles import CueTable
+from Timings import WordTimings, load_words, timestamps_to_srt, words_path
+
+
+def words(text, start=0, step=100):
+	return [{ "text": char, "begin_time": start + i * step, "end_time": start + (i + 1) * step }
+	        for i, char in enumerate(text)]
+
+
+class TestWordTimings(unittest.TestCase):
+	def test_from_items(self):
+		timings = WordTimings.from_items([{ "begin_time": 0, "end_time": 300, "words": words("你好。") },
+		                                  { "begin_time": 300, "end_time": 500, "sentence_texts": "再见" },
+		                                  { "begin_time": 500, "end_time": 700, "text": "好的" }])
+		self.assertEqual(timings.texts, ["你", "好", "。", "再见", "好的"])
+		self.assertEqual(timings.starts.tolist(), [0, 100, 200, 300, 500])
+		self.assertEqual(timings.lengths.tolist(), [1, 1, 1, 2, 2])
+
+	def test_sentence_end_always_splits(self):
+		cues = WordTimings.from_items([{ "begin_time": 0, "end_time": 700, "words": words("你好。再见！") }]).segment()
+		self.assertEqual(cues, [(0, 300, "你好。"), (300, 600, "再见！")])
+
+	def test_budget_prefers_clause_end(self):
+		text = "首先让我们来看看缅北冲突，这场冲突已经导致三个政府控制区失守。"
+		cues = WordTimings.from_items([{ "begin_time": 0, "end_time": 0, "words": words(text) }]).segment(24, 12)
+		self.assertEqual([cue[2] for cue in cues], ["首先让我们来看看缅北冲突，", "这场冲突已经导致三个政府\n控制区失守。"])
+		self.assertEqual(cues[1][0], 1300)
+		self.assertEqual(cues[-1][1], len(text) * 100)
+
+	def test_budget_without_punctuation(self):
+		cues = WordTimings.from_items([{ "begin_time": 0, "end_time": 0, "words": words("一" * 30) }]).segment(24, 12)
+		self.assertEqual([cue[2] for cue in cues], ["一" * 12 + "\n" + "一" * 12, "一" * 6])
+
+	def test_long_sentence_time_is_redistributed(self):
+		cues = WordTimings.from_items([{ "begin_time": 1000, "end_time": 4000, "sentence_texts": "一" * 30 }]).segment(
+				12, 12)
+		self.assertEqual([(start, end) for start, end, _ in cues], [(1000, 2200), (2200, 3400), (3400, 4000)])
+
+	def test_lines_keep_words_whole(self):
+		self.assertEqual(WordTimings.layout(["LNG", "能否击败", "T1", "与其他三个"], 8), "LNG能否击败\nT1与其他三个")
+
+	def test_timestamps_to_srt(self):
+		srt = timestamps_to_srt([{ "begin_time": 0, "end_time": 300, "words": words("你好。") }])
+		self.assertEqual(srt, "0\n00:00:00,000 --> 00:00:00,300\n你好。\n\n")
+		self.assertEqual(list(Subtitles.iter_cues(srt.splitlines(keepends = True))), [(0, 300, "你好。")])
+
+	def test_highlights(self):
+		timings = WordTimings.from_items([{ "begin_time": 0, "end_time": 500, "words": words("你好。再见") }])
+		cues, highlights = timings.highlights(24, 12)
+		self.assertEqual(cues, timings.segment(24, 12))
+		self.assertEqual(highlights[0][0].tolist(), [0, 100, 200])
+		self.assertEqual(highlights[1][1].tolist(), [1, 2])
+
+
+class TestWordsFile(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.TemporaryDirectory()
+		self.subtitle_path = os.path.join(self.dir.name, "subtitle.srt")
+		self.cues = CueTable([(0, 300, "你好。"), (300, 500, "再见")])
+
+	def tearDown(self):
+		self.dir.cleanup()
+
+	def test_save_load(self):
+		self.assertEqual(words_path(self.subtitle_path), os.path.join(self.dir.name, "subtitle.words.json"))
+		timings = WordTimings.from_items([{ "begin_time": 0, "end_time": 500, "words": words("你好。再见") }])
+		timings.save(words_path(self.subtitle_path))
+		loaded = load_words(self.subtitle_path, self.cues)
+		self.assertEqual(loaded.texts, timings.texts)
+		self.assertEqual(loaded.starts.tolist(), timings.starts.tolist())
+
+	def test_fallback_to_cues(self):
+		# 没有字级时间戳，或其文本与字幕不一致时，每条字幕视为一个词
+		for texts in (None, ["别的", "文本"]):
+			if texts is not None:
+				WordTimings(texts, [0, 100], [100, 200]).save(words_path(self.subtitle_path))
+			loaded = load_words(self.subtitle_path, self.cues)
+			self.assertEqual(loaded.texts, ["你好。", "再见"])
+			self.assertEqual(loaded.ends.tolist(), [300, 500])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,82 @@
+import threading
+import time
+import unittest
+
+from Tokens import TokenManager
+
+
+class TestTokenManager(unittest.TestCase):
+	def setUp(self):
+		self.now = 1000.0
+		self.manager = TokenManager(margin = 60, refresh_ahead = 600, clock = lambda: self.now)
+		self.fetched = []
+
+	def fetch(self):
+		self.fetched.append(self.now)
+		return f"token-{len(self.fetched)}", self.now + 3600
+
+	def test_cached_until_expiry(self):
+		self.assertEqual(self.manager.get("baidu", "ak", self.fetch), "token-1")
+		self.now += 2000
+		self.assertEqual(self.manager.get("baidu", "ak", self.fetch), "token-1")
+		self.assertEqual(len(self.fetched), 1)
+		self.assertEqual(self.manager.expires_at("baidu", "ak"), 4600)
+		# 过期前margin秒内视为过期，同步获取新token
+		self.now = 4600 - 30
+		self.assertEqual(self.manager.get("baidu", "ak", self.fetch), "token-2")
+
+	def test_keys_are_separate(self):
+		self.manager.get("baidu", "ak", self.fetch)
+		self.manager.get("baidu", "other", self.fetch)
+		self.manager.get("nls", "ak", self.fetch)
+		self.assertEqual(len(self.fetched), 3)
+
+	def test_background_refresh(self):
+		self.manager.get("baidu", "ak", self.fetch)
+		self.now += 3200
+		# 进入提前刷新的窗口，仍然返回旧token，新token在后台获取
+		self.assertEqual(self.manager.get("baidu", "ak", self.fetch), "token-1")
+		for _ in range(100):
+			if self.manager.expires_at("baidu", "ak") != 4600:
+				break
+			time.sleep(0.01)
+		self.assertEqual(self.manager.get("baidu", "ak", self.fetch), "token-2")
+		self.assertEqual(len(self.fetched), 2)
+
+	def test_failed_background_refresh_keeps_token(self):
+		self.manager.get("baidu", "ak", self.fetch)
+		self.now += 3200
+
+		def fail():
+			raise ConnectionError("offline")
+
+		self.assertEqual(self.manager.get("baidu", "ak", fail), "token-1")
+		for _ in range(100):
+			if not self.manager.refreshing:
+				break
+			time.sleep(0.01)
+		self.assertEqual(self.manager.get("baidu", "ak", self.fetch), "token-1")
+
+	def test_invalidate(self):
+		self.manager.get("baidu", "ak", self.fetch)
+		self.manager.invalidate("baidu", "ak")
+		self.assertEqual(self.manager.get("baidu", "ak", self.fetch), "token-2")
+
+	def test_single_flight(self):
+		def slow_fetch():
+			time.sleep(0.1)
+			return self.fetch()
+
+		results = []
+		threads = [threading.Thread(target = lambda: results.append(self.manager.get("baidu", "ak", slow_fetch)))
+		           for _ in range(8)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(results, ["token-1"] * 8)
+		self.assertEqual(len(self.fetched), 1)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -1,7 +1,15 @@
 import logging
+import os
+import re
+import tempfile
+import threading
 import unittest
+from unittest import mock
 
-from TTSAIs import AzureTTS, DashScopeTTS, NLSTTS
+import Timings
+import TTSAIs
+from Caches import ArtifactCache
+from TTSAIs import AzureTTS, DashScopeTTS, NLSStreamingTTS, NLSTTS, SentenceAssembler
 
 example_text = """
 		各位观众，大家好！欢迎收看今天的《今日信息差》。今天我们要讨论的话题是近期的一些热点新闻。首先，让我们来看看缅北冲突。这场冲突已经导致三个政府控制区失守，数百人越过边境逃入中国。这无疑会对中缅边境的安全稳定带来一定的影响。中国外交部发言人已经表示，中方高度关注缅北冲突态势，敦促各方立即停火止战，采取切实有效措施，确保中缅边境安全稳定。这场冲突提醒我们，和平与稳定才是国际关系的基石，希望各方能够加强对话，寻求和平解决方案。再来看看《英雄联盟》S13全球总决赛。LNG能否击败T1，与其他三个LPL的战队成功会师四强，这无疑是电竞迷们关注的焦点。各个队伍的实力和优劣需要具体分析，但无论如何，我们都期待看到一场精彩的比赛。
@@ -10,6 +18,24 @@ example_text = """
 logging.basicConfig(level = logging.DEBUG)
 
 
+class FakeSynthesisResult:
+	"""
+	SpeechSynthesizer.call的返回值：每个字100ms的PCM与字级时间戳
+	"""
+
+	def __init__(self, text: str, sample_rate: int):
+		self.text = text
+		self.sample_rate = sample_rate
+
+	def get_audio_data(self) -> bytes:
+		return b"\x01\x00" * (len(self.text) * self.sample_rate // 10)
+
+	def get_timestamps(self) -> list:
+		words = [{ "text": char, "begin_time": i * 100, "end_time": i * 100 + 100 } for i, char in
+		         enumerate(self.text)]
+		return [{ "begin_time": 0, "end_time": len(self.text) * 100, "words": words }]
+
+
 class TestAzureTTS(unittest.TestCase):
 	def test_init(self):
 		azure_tts = AzureTTS()
@@ -35,6 +61,87 @@ class TestDashScopeTTS(unittest.TestCase):
 		time_stamp = azure_tts.create_audio_once(example_text, "output.mp3", "subtitle.srt")
 		print(time_stamp)
 
+	def test_split_sentences(self):
+		chunks = DashScopeTTS.split_sentences(example_text, 60)
+		self.assertEqual("".join(chunks), "".join(example_text.split()))
+		for chunk in chunks:
+			self.assertTrue(len(chunk) <= 60 or chunk[:-1].count("。") == 0)
+			self.assertIn(chunk[-1], "。！？；!?;")
+		self.assertEqual(DashScopeTTS.split_sentences("一句。两句！三句", 4), ["一句。", "两句！", "三句"])
+
+	def test_stitch(self):
+		sentence = { "begin_time": 0, "end_time": 500, "words": [{ "text": "你", "begin_time": 0, "end_time": 500 }] }
+		# 48000Hz下1秒为96000字节
+		pcm, timestamps = DashScopeTTS.stitch([(b"\0" * 96000, [sentence]), (b"\0" * 48001, [sentence]),
+		                                       (b"\0" * 2, [sentence])], 48000)
+		self.assertEqual(len(pcm), 96000 + 48000 + 2)
+		self.assertEqual([t["begin_time"] for t in timestamps], [0, 1000, 1500])
+		self.assertEqual(timestamps[1]["words"][0]["end_time"], 1500)
+		self.assertEqual(sentence["begin_time"], 0)
+
+	def test_create_audio_chunked(self):
+		texts = []
+		lock = threading.Lock()
+
+		def call(api_key, text, sample_rate, **kwargs):
+			self.assertEqual(kwargs["format"], "pcm")
+			with lock:
+				texts.append(text)
+			return FakeSynthesisResult(re.sub(r"<[^>]+>", "", text), sample_rate)
+
+		with tempfile.TemporaryDirectory() as tmp, mock.patch.object(TTSAIs.SpeechSynthesizer, "call", call):
+			tts = DashScopeTTS(chunk_chars = 100, concurrency = 4)
+			mp3, srt = os.path.join(tmp, "tts.mp3"), os.path.join(tmp, "subtitle.srt")
+			tts.create_audio_once(example_text, mp3, srt)
+			chunks = DashScopeTTS.split_sentences(example_text, 100)
+			# 每段在句子边界结束、不超过100字，全部段落各请求一次
+			self.assertGreater(len(chunks), 1)
+			self.assertEqual(sorted(texts), sorted(tts.pre_SSML(chunk) for chunk in chunks))
+			for chunk in chunks:
+				self.assertLessEqual(len(chunk), 100)
+				self.assertIn(chunk[-1], "。！？；!?;")
+			# 每段的时间戳平移之前各段的时长，拼接后每个字紧接上一个字
+			words = Timings.WordTimings.load(Timings.words_path(srt))
+			self.assertEqual("".join(words.texts), "".join(chunks))
+			self.assertEqual(words.starts.tolist(), [i * 100 for i in range(len(words))])
+			self.assertEqual(words.ends.tolist(), [i * 100 + 100 for i in range(len(words))])
+			offset = len(chunks[0]) * 100
+			with open(srt, encoding = "utf-8") as f:
+				self.assertIn(f"00:00:{offset // 1000:02d},{offset % 1000:03d}", f.read())
+			self.assertTrue(os.path.getsize(mp3) > 0)
+
+	def test_phrase_key(self):
+		tts = DashScopeTTS()
+		key = tts.phrase_key("大家好。")
+		self.assertEqual(tts.phrase_key("大家好。"), key)
+		# 每个合成参数都参与缓存键，换了音色（模型）或语速的句子不会读到其他参数合成的PCM
+		for name, value in (("model", "sambert-zhiqi-v1"), ("rate", 1.5), ("volume", 80), ("sample_rate", 16000)):
+			other = DashScopeTTS()
+			setattr(other, name, value)
+			self.assertNotEqual(other.phrase_key("大家好。"), key, name)
+
+	def test_phrase_cache(self):
+		with tempfile.TemporaryDirectory() as tmp:
+			tts = DashScopeTTS(phrase_cache = ArtifactCache(os.path.join(tmp, "cache")))
+			synthesized = []
+
+			def synthesize_chunk(text):
+				synthesized.append(text)
+				words = [{ "text": char, "begin_time": i * 100, "end_time": i * 100 + 100 } for i, char in
+				         enumerate(text)]
+				return b"\x01\x00" * (len(text) * 4800), [{ "begin_time": 0, "end_time": len(text) * 100,
+				                                             "words": words }]
+
+			tts.synthesize_chunk = synthesize_chunk
+			mp3, srt = os.path.join(tmp, "tts.mp3"), os.path.join(tmp, "subtitle.srt")
+			tts.create_audio_once("大家好，欢迎收看AI信息差。今天的新闻。大家好，欢迎收看AI信息差。", mp3, srt)
+			self.assertEqual(synthesized, ["大家好，欢迎收看AI信息差。", "今天的新闻。"])
+			tts.create_audio_once("大家好，欢迎收看AI信息差。明天的新闻。", mp3, srt)
+			self.assertEqual(synthesized[2:], ["明天的新闻。"])
+			with open(srt, encoding = "utf-8") as f:
+				self.assertIn("00:00:01,400 --> 00:00:02,000\n明天的新闻。", f.read())
+			self.assertTrue(os.path.getsize(mp3) > 0)
+
 
 class TestNLSTTS(unittest.TestCase):
 	example_task_id = "091bfc7e430c4084b8ce2da2cbb2c1dd"
@@ -59,5 +166,28 @@ class TestNLSTTS(unittest.TestCase):
 		tts.create_audio_once(example_text, "output.mp3", "subtitle.srt")
 
 
+class TestNLSStreamingTTS(unittest.TestCase):
+	def test_sentence_assembler(self):
+		text = "你好。 再见！好"
+		done = []
+		assembler = SentenceAssembler(text, done.append)
+		words = [{ "text": char, "begin_index": i, "end_index": i + 1, "begin_time": i * 100, "end_time": i * 100 + 90 }
+		         for i, char in enumerate(text) if char not in "。！ "]
+		assembler.feed(words[:1])
+		self.assertEqual(done, [])
+		# 重复推送的字与句级时间戳会被跳过
+		assembler.feed(words[:2] + [{ "text": "", "sentence": True, "begin_index": 0, "end_index": 3 }])
+		self.assertEqual([(s["sentence_texts"], s["begin_time"], s["end_time"]) for s in done], [("你好", 0, 190)])
+		assembler.feed(words[2:])
+		self.assertEqual(len(done), 2)
+		sentences = assembler.finish()
+		self.assertEqual([s["sentence_texts"] for s in sentences], ["你好", "再见", "好"])
+
+	def test_create_audio_stream(self):
+		tts = NLSStreamingTTS()
+		sentences = tts.create_audio_stream(example_text, "output.mp3", "subtitle.srt", on_sentence = print)
+		self.assertGreater(len(sentences), 0)
+
+
 if __name__ == '__main__':
 	unittest.main()